@@ -12,50 +12,389 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-"""Scrypt for Python"""
+"""Scrypt for Python
+
+The implementation is chosen on the first call, not at import. By default it
+is the first one available in the order listed in the README. Setting the
+environment variable PYLIBSCRYPT_BACKEND to a module name, e.g. pylibsodium,
+uses that one without trying the others. PYLIBSCRYPT_BACKEND=router picks one
+for each call instead, see pylibscrypt.router. PYLIBSCRYPT_SELECT=fastest uses
+the one measured fastest on the host, see pylibscrypt.autoselect.
+
+backend_info() tells which implementation was chosen.
+"""
+
+from functools import partial
+import os
+import threading
+import time
+
+from . import common as _common
 
 __version__ = '2.0.0-git'
 
-# First, try hashlib
-_done = False
 try:
-    from .hashlibscrypt import *
-except ImportError:
-    pass
-else:
-    _done = True
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
 
-# If that didn't work, try loading libscrypt
-if not _done:
-    try:
-        from .pylibscrypt import *
-    except ImportError:
-        pass
+
+_backend = None
+_backend_info = None
+_check_cache = None
+_metrics = None
+_lock = threading.Lock()
+
+
+def _resolve():
+    global _backend, _backend_info
+    with _lock:
+        if _backend is not None:
+            return _backend
+
+        start = _clock()
+        from . import registry
+        module = None
+        pinned = os.environ.get('PYLIBSCRYPT_BACKEND')
+        if pinned == 'router':
+            from . import router as module
+            how = 'pinned'
+        elif pinned:
+            if pinned not in registry.names():
+                raise ImportError('Unknown scrypt implementation: ' + pinned)
+            module = registry.load(pinned)
+            if module is None:
+                raise ImportError(registry.error(pinned))
+            how = 'pinned'
+        elif os.environ.get('PYLIBSCRYPT_SELECT') == 'fastest':
+            from .autoselect import select_from_env
+            module = select_from_env()
+            how = 'fastest'
+
+        if module is None:
+            import platform
+            how = 'probed'
+            # In the order of the registry; numpyscrypt runs the lanes in
+            # parallel, which is not worth it on PyPy
+            for name in registry.names():
+                if (name == 'numpyscrypt' and
+                        platform.python_implementation() == 'PyPy'):
+                    continue
+                module = registry.load(name)
+                if module is not None:
+                    break
+
+        _backend_info = {
+            'backend': module.__name__.rsplit('.', 1)[-1],
+            'how': how,
+            'resolve_time': _clock() - start,
+        }
+        _backend = module
+        return module
+
+
+def backends():
+    """Returns a list of dicts describing the known implementations
+
+    Imports them all. See pylibscrypt.registry for the keys.
+    """
+    from . import registry
+    return registry.backends()
+
+
+def backend_info():
+    """Returns a dict describing the implementation in use
+
+    backend       -- module name of the implementation, e.g. 'pylibsodium'
+    how           -- 'pinned', 'fastest' or 'probed', see the module docs
+    resolve_time  -- seconds it took to choose and load the implementation
+
+    Chooses the implementation first, if no call has done so yet.
+    """
+    _resolve()
+    return dict(_backend_info)
+
+
+def _deadline_scrypt(deadline):
+    # The scrypt of the backend bound to a deadline, for the generic MCF code
+    from .deadline import as_deadline
+    return partial((_backend or _resolve()).scrypt,
+                   deadline=as_deadline(deadline))
+
+
+def scrypt(password, salt, N=_common.SCRYPT_N, r=_common.SCRYPT_r,
+           p=_common.SCRYPT_p, olen=64, deadline=None):
+    """Returns a key derived using the scrypt key-derivarion function
+
+    N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
+    r and p must be positive numbers such that r * p < 2 ** 30
+
+    The default values are:
+    N -- 2**14 (~16k)
+    r -- 8
+    p -- 1
+
+    Memory usage is proportional to N*r. Defaults require about 16 MiB.
+    Time taken is proportional to N*p. Defaults take <100ms of a recent x86.
+
+    The last one differs from libscrypt defaults, but matches the 'interactive'
+    work factor from the original paper. For long term storage where runtime of
+    key derivation is not a problem, you could use 16 as in libscrypt or better
+    yet increase N if memory is plentiful.
+
+    Raises TimeoutError once the deadline, seconds or a Deadline from
+    pylibscrypt.deadline, passes.
+    """
+    if deadline is None:
+        func = (_backend or _resolve()).scrypt
     else:
-        _done = True
+        func = _deadline_scrypt(deadline)
+    if _metrics is not None:
+        backend = _metrics_backend(N, r, p, salt)
+        return _metrics.call('scrypt', backend, (N, r, p),
+                             func, password, salt, N, r, p, olen)
+    return func(password, salt, N, r, p, olen)
 
-# Next: try the scrypt module
-if not _done:
-    try:
-        from .pyscrypt import *
-    except ImportError:
-        pass
+
+def scrypt_into(password, salt, out, N=_common.SCRYPT_N, r=_common.SCRYPT_r,
+                p=_common.SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out, which can be e.g. a bytearray, memoryview or
+    mmap. The ctypes based implementations write it there without copies.
+    See scrypt for the parameters.
+    """
+    backend = _backend or _resolve()
+    into = getattr(backend, 'scrypt_into', None)
+    if into is None:
+        return _common.scrypt_into(backend.scrypt, password, salt, out,
+                                   N, r, p)
+    return into(password, salt, out, N, r, p)
+
+
+def scrypt_mcf(password, salt=None, N=_common.SCRYPT_N, r=_common.SCRYPT_r,
+               p=_common.SCRYPT_p, prefix=_common.SCRYPT_MCF_PREFIX_DEFAULT,
+               deadline=None):
+    """Derives a Modular Crypt Format hash using the scrypt KDF
+
+    Parameter space is smaller than for scrypt():
+    N must be a power of two larger than 1 but no larger than 2 ** 31
+    r and p must be positive numbers between 1 and 255
+    Salt must be a byte string 1-16 bytes long.
+
+    If no salt is given, a random salt of 128+ bits is used. (Recommended.)
+
+    Raises TimeoutError once the deadline passes, see scrypt().
+    """
+    if deadline is None:
+        func = (_backend or _resolve()).scrypt_mcf
     else:
-        _done = True
+        from . import mcf as mcf_mod
+        func = partial(mcf_mod.scrypt_mcf, _deadline_scrypt(deadline))
+    if _metrics is not None:
+        backend = _metrics_backend(N, r, p, partial(_mcf_salt, salt, prefix))
+        return _metrics.call('scrypt_mcf', backend, (N, r, p),
+                             func, password, salt, N, r, p, prefix)
+    return func(password, salt, N, r, p, prefix)
+
+
+def scrypt_mcf_check(mcf, password, deadline=None):
+    """Returns True if the password matches the given MCF hash
+
+    Consults the check cache first, if one is set with set_check_cache().
+    Raises TimeoutError once the deadline passes, see scrypt().
+    """
+    check = (_backend or _resolve()).scrypt_mcf_check
+    if deadline is not None:
+        from . import mcf as mcf_mod
+        check = partial(mcf_mod.scrypt_mcf_check, _deadline_scrypt(deadline))
+    if _check_cache is not None:
+        check = partial(_check_cache.check, check)
+    if _metrics is not None:
+        h = _mcf_hash(mcf)
+        if h is None:
+            return _metrics.call('scrypt_mcf_check', _backend_info['backend'],
+                                 None, check, mcf, password)
+        return _metrics.call('scrypt_mcf_check',
+                             _metrics_backend(h.N, h.r, h.p, h.salt),
+                             (h.N, h.r, h.p), check, mcf, password)
+    return check(mcf, password)
+
 
-# Next: libsodium
-if not _done:
+def _metrics_backend(N, r, p, salt):
+    # The implementation a call is recorded for; the one the router picks for
+    # it rather than the router itself. salt can be a function returning it.
+    name = _backend_info['backend']
+    if name == 'router':
+        try:
+            if callable(salt):
+                salt = salt()
+            module = _backend.route(N, r, p, len(salt))
+        except (TypeError, ValueError):
+            return name
+        name = module.__name__.rsplit('.', 1)[-1]
+    return name
+
+
+def _mcf_salt(salt, prefix):
+    # The salt scrypt gets for the hash, or one as long, see pylibscrypt.mcf
+    if prefix == _common.SCRYPT_MCF_PREFIX_s1:
+        return b'.' * 16 if salt is None else salt
+    if salt is None:
+        return b'.' * 43
+    from .mcf import _cb64enc
+    return _cb64enc(_common.to_bytes(salt))
+
+
+def _mcf_hash(mcf):
+    # The parsed hash, or None if malformed
+    from .mcf import ScryptHash
     try:
-        from .pylibsodium import *
-    except ImportError:
-        pass
-    else:
-        _done = True
+        return mcf if isinstance(mcf, ScryptHash) else ScryptHash.parse(mcf)
+    except (TypeError, ValueError):
+        return None
+
+
+def _mcf_params(mcf):
+    # N, r and p of a hash for the metrics, or None if malformed
+    h = _mcf_hash(mcf)
+    if h is None:
+        return None
+    return h.N, h.r, h.p
+
+
+def needs_rehash(mcf, N=_common.SCRYPT_N, r=_common.SCRYPT_r,
+                 p=_common.SCRYPT_p, prefix=_common.SCRYPT_MCF_PREFIX_ANY):
+    """Returns True if the MCF hash has N, r or p below those given
+
+    Also True if a prefix is given and the hash is in the other format.
+    Only parses the hash, so this is fast.
+    """
+    from . import mcf as mcf_mod
+    return mcf_mod.needs_rehash(mcf, N, r, p, prefix)
+
+
+def scrypt_mcf_check_and_upgrade(mcf, password, policy=None, executor=None):
+    """Checks the password and rehashes it if the hash is below the policy
+
+    The policy is a dict of the minimum N, r and p, and the prefix, to use.
+    Returns (ok, new_mcf), where new_mcf is None unless a new hash is needed.
+    With a concurrent.futures executor, new_mcf is a Future of it instead.
+
+    See pylibscrypt.mcf.scrypt_mcf_check_and_upgrade for details.
+    """
+    from . import mcf as mcf_mod
+    return mcf_mod.scrypt_mcf_check_and_upgrade(
+        scrypt_mcf_check, scrypt_mcf, mcf, password, policy, executor)
+
+
+def set_check_cache(cache=None):
+    """Sets the pylibscrypt.checkcache.CheckCache used by scrypt_mcf_check
+
+    None, the default, turns caching off.
+    """
+    global _check_cache
+    _check_cache = cache
+
+
+def get_check_cache():
+    """Returns the check cache in use, or None"""
+    return _check_cache
+
+
+def set_metrics(registry=None):
+    """Sets the pylibscrypt.metrics.Registry that calls are recorded in
+
+    Covers scrypt, scrypt_mcf and scrypt_mcf_check. None, the default, turns
+    recording off.
+    """
+    global _metrics
+    _metrics = registry
+
+
+def get_metrics():
+    """Returns the metrics registry in use, or None"""
+    return _metrics
+
+
+def scrypt_many(passwords, salts, N=_common.SCRYPT_N, r=_common.SCRYPT_r,
+                p=_common.SCRYPT_p, olen=64):
+    """Returns a list of keys derived using the scrypt KDF
+
+    Batches are computed as lanes by numpy, other implementations do them in
+    turn.
+    """
+    many = getattr(_backend or _resolve(), 'scrypt_many', None)
+    if many is not None:
+        return many(passwords, salts, N, r, p, olen)
+    return _common.scrypt_many(scrypt, passwords, salts, N, r, p, olen)
+
+
+def scrypt_mcf_check_many(mcfs, passwords):
+    """Returns a list of booleans, True where the password matches"""
+    many = getattr(_backend or _resolve(), 'scrypt_mcf_check_many', None)
+    if many is not None:
+        return many(mcfs, passwords)
+    from . import mcf
+    return mcf.scrypt_mcf_check_many(scrypt_many, mcfs, passwords)
+
+
+def calibrate(target_seconds, max_memory_bytes, backend=None,
+              r=_common.SCRYPT_r, refresh=False):
+    """Returns scrypt parameters that fit the given time and memory
+
+    See pylibscrypt.tuning.calibrate for details.
+    """
+    from . import tuning
+    return tuning.calibrate(target_seconds, max_memory_bytes, backend, r,
+                            refresh)
+
+
+__all__ = ['scrypt', 'scrypt_into', 'scrypt_mcf', 'scrypt_mcf_check',
+           'scrypt_many', 'scrypt_mcf_check_many', 'backend_info', 'backends',
+           'calibrate', 'set_check_cache', 'get_check_cache', 'set_metrics',
+           'get_metrics', 'needs_rehash', 'scrypt_mcf_check_and_upgrade']
+
+# Batches run on a thread pool, see pylibscrypt.batch. They need
+# concurrent.futures, which Python 2 only has with the futures backport.
+try:
+    import concurrent.futures
+except ImportError:
+    pass
+else:
+    def set_pool_size(size=None):
+        """Sets the number of threads in the pool, by default the number of
+        cores
+
+        Calls already running finish in the old pool.
+        """
+        from . import batch
+        batch.set_pool_size(size)
+
+    def get_pool_size():
+        """Returns the number of threads in the pool"""
+        from . import batch
+        return batch.get_pool_size()
 
-# If that didn't work either, the inlined Python version
-if not _done:
-    from .pypyscrypt_inline import *
+    def scrypt_batch(passwords, salts, N=_common.SCRYPT_N,
+                     r=_common.SCRYPT_r, p=_common.SCRYPT_p, olen=64):
+        """Returns a list of keys derived using scrypt on the thread pool"""
+        from . import batch
+        return batch.scrypt_batch(scrypt, passwords, salts, N, r, p, olen)
 
-__all__ = ['scrypt', 'scrypt_mcf', 'scrypt_mcf_check']
+    def scrypt_mcf_batch(passwords, salts=None, N=_common.SCRYPT_N,
+                         r=_common.SCRYPT_r, p=_common.SCRYPT_p,
+                         prefix=_common.SCRYPT_MCF_PREFIX_DEFAULT):
+        """Returns a list of MCF hashes derived on the thread pool"""
+        from . import batch
+        return batch.scrypt_mcf_batch(scrypt_mcf, passwords, salts, N, r, p,
+                                      prefix)
 
+    def scrypt_mcf_check_batch(mcfs, passwords):
+        """Returns a list of booleans, True where the password matches"""
+        from . import batch
+        return batch.scrypt_mcf_check_batch(scrypt_mcf_check, mcfs,
+                                            passwords)
 
+    __all__ += ['scrypt_batch', 'scrypt_mcf_batch', 'scrypt_mcf_check_batch',
+                'set_pool_size', 'get_pool_size']
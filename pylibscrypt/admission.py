@@ -0,0 +1,190 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Admission control for the memory used by concurrent scrypt calls
+
+Every implementation reserves the memory its call needs before hashing. While
+the reservations would exceed the budget, further calls wait in line, until
+their deadline if they have one. A call that needs more than the whole budget
+runs once nothing else is running.
+
+The budget is set with set_memory_budget(). By default it is half of the
+cgroup memory limit of the process, or unlimited if there is none.
+"""
+
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+# Share of the cgroup memory limit that scrypt calls may use by default
+CGROUP_FRACTION = 0.5
+
+_CGROUP_LIMIT_FILES = (
+    '/sys/fs/cgroup/memory.max',                    # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroup v1
+)
+
+# Seconds between checks for cancellation while waiting with a deadline
+_POLL = 0.05
+
+_cond = threading.Condition()
+_local = threading.local()
+_budget = None
+_budget_set = False
+_queue = deque()
+_in_use = 0
+_running = 0
+_admitted = 0
+_waited = 0
+_wait_time = 0.0
+_max_wait = 0.0
+
+
+def cgroup_memory_limit():
+    """Returns the cgroup memory limit in bytes, or None if not limited"""
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except (IOError, OSError):
+            continue
+        if limit == 'max':
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            continue
+        # cgroup v1 reports no limit as a huge page-aligned number
+        if limit >= 2**62:
+            return None
+        return limit
+    return None
+
+
+def set_memory_budget(budget=None):
+    """Sets the number of bytes concurrent scrypt calls may reserve
+
+    None reads the budget from the cgroup memory limit again, 0 removes it.
+    """
+    global _budget, _budget_set
+    if budget is not None and budget < 0:
+        raise ValueError('memory budget must not be negative')
+    with _cond:
+        _budget = budget or None
+        _budget_set = budget is not None
+        _cond.notify_all()
+
+
+def get_memory_budget():
+    """Returns the memory budget in bytes, or None if unlimited"""
+    global _budget, _budget_set
+    with _cond:
+        if not _budget_set:
+            limit = cgroup_memory_limit()
+            _budget = limit and int(limit * CGROUP_FRACTION)
+            _budget_set = True
+        return _budget
+
+
+def stats():
+    """Returns a dict describing the reservations and the waiting calls
+
+    budget     -- memory budget in bytes, None if unlimited
+    in_use     -- bytes reserved by running calls
+    running    -- number of running calls
+    queued     -- number of calls waiting for memory
+    admitted   -- number of calls admitted in total
+    waited     -- number of those that had to wait
+    wait_time  -- total seconds spent waiting
+    max_wait   -- longest wait in seconds
+    """
+    budget = get_memory_budget()
+    with _cond:
+        return {
+            'budget': budget,
+            'in_use': _in_use,
+            'running': _running,
+            'queued': len(_queue),
+            'admitted': _admitted,
+            'waited': _waited,
+            'wait_time': _wait_time,
+            'max_wait': _max_wait,
+        }
+
+
+def _fits(size, budget):
+    return budget is None or _running == 0 or _in_use + size <= budget
+
+
+@contextmanager
+def reserve(size, deadline=None):
+    """Context manager that waits until size bytes fit in the budget
+
+    With a Deadline from pylibscrypt.deadline, raises TimeoutError if it
+    passes first. Reservations nest: an implementation that falls back to
+    another reserves the memory only once.
+    """
+    global _in_use, _running, _admitted, _waited, _wait_time, _max_wait
+    if getattr(_local, 'depth', 0):
+        _local.depth += 1
+        try:
+            yield
+        finally:
+            _local.depth -= 1
+        return
+
+    budget = get_memory_budget()
+    with _cond:
+        if _queue or not _fits(size, budget):
+            ticket = object()
+            _queue.append(ticket)
+            start = _clock()
+            try:
+                while _queue[0] is not ticket or not _fits(size, _budget):
+                    if deadline is None:
+                        _cond.wait()
+                        continue
+                    deadline.check()
+                    remaining = deadline.remaining()
+                    _cond.wait(_POLL if remaining is None
+                               else min(_POLL, remaining))
+            finally:
+                _queue.remove(ticket)
+                # The next one in line may fit as well
+                _cond.notify_all()
+            wait = _clock() - start
+            _waited += 1
+            _wait_time += wait
+            _max_wait = max(_max_wait, wait)
+        _in_use += size
+        _running += 1
+        _admitted += 1
+
+    _local.depth = 1
+    try:
+        yield
+    finally:
+        _local.depth = 0
+        with _cond:
+            _in_use -= size
+            _running -= 1
+            _cond.notify_all()
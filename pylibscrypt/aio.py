@@ -0,0 +1,187 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Scrypt for asyncio (Python 3.5+)
+
+The coroutines run the scrypt functions of the package in an executor, so the
+event loop keeps serving other tasks. C implementations release the GIL and
+run on the thread pool of pylibscrypt.batch. Pure Python implementations run
+on a pool of processes instead, while the check cache, metrics and memory
+budget of the package still apply in this process.
+
+At most set_concurrency() calls run at a time, the rest wait their turn.
+A cancelled call stops waiting at once, but a hash that has already started
+holds its slot until it finishes.
+"""
+
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import weakref
+from functools import partial
+
+from . import (
+    admission, backend_info, batch, get_check_cache, get_metrics, registry,
+    _mcf_params)
+from . import scrypt as _scrypt
+from . import scrypt_mcf as _scrypt_mcf
+from . import scrypt_mcf_check as _scrypt_mcf_check
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, is_buffer,
+    scrypt_memory, to_bytes)
+
+
+_concurrency = None
+_semaphores = weakref.WeakKeyDictionary()
+_process_executor = None
+_lock = threading.Lock()
+
+
+def set_concurrency(limit=None):
+    """Sets the number of calls run at a time, by default the pool size"""
+    global _concurrency
+    if limit is not None and limit < 1:
+        raise ValueError('concurrency limit must be positive')
+    with _lock:
+        _concurrency = limit
+        _semaphores.clear()
+
+
+def _pure_python(backend):
+    # True for implementations that hold the GIL and need processes
+    return (backend in registry.names() and
+            registry.capabilities(backend)['pure_python'])
+
+
+def _process_pool():
+    global _process_executor
+    with _lock:
+        if _process_executor is None:
+            _process_executor = ProcessPoolExecutor(
+                multiprocessing.cpu_count())
+        return _process_executor
+
+
+def get_executor():
+    """Returns the executor used for the implementation of the package"""
+    if not _pure_python(backend_info()['backend']):
+        return batch.get_executor()
+    return _process_pool()
+
+
+def _backend_call(backend, op, *args):
+    # Runs in a worker process; calls the implementation directly, as the
+    # cache, metrics and memory budget of the package are handled by the
+    # parent
+    admission._local.depth = 1
+    try:
+        return getattr(registry.load(backend), op)(*args)
+    finally:
+        admission._local.depth = 0
+
+
+def _memory(params):
+    # Bytes a call needs, or 0 if its parameters are invalid, leaving the
+    # error to the call
+    try:
+        return max(0, scrypt_memory(*params))
+    except TypeError:
+        return 0
+
+
+def _in_process(backend, op, params, *args):
+    # Runs on the thread pool, waiting for the hash from a worker process
+    def func(*args):
+        # Buffers such as memoryviews can't be pickled, byte strings can
+        args = [to_bytes(a) if is_buffer(a) else a for a in args]
+        with admission.reserve(_memory(params)):
+            future = _process_pool().submit(_backend_call, backend, op,
+                                            *args)
+            return future.result()
+    cache = get_check_cache()
+    if op == 'scrypt_mcf_check' and cache is not None:
+        func = partial(cache.check, func)
+    metrics = get_metrics()
+    if metrics is not None:
+        return metrics.call(op, backend, params, func, *args)
+    return func(*args)
+
+
+def _submit(func, params, *args):
+    backend = backend_info()['backend']
+    if not _pure_python(backend):
+        return batch.submit(func, *args)
+    return batch.submit(_in_process, backend, func.__name__, params, *args)
+
+
+# Python 3.7 has get_running_loop, older versions only get_event_loop
+_get_running_loop = getattr(asyncio, 'get_running_loop',
+                            asyncio.get_event_loop)
+
+
+def _semaphore(loop):
+    with _lock:
+        sem = _semaphores.get(loop)
+        if sem is None:
+            sem = asyncio.Semaphore(_concurrency or batch.get_pool_size())
+            _semaphores[loop] = sem
+        return sem
+
+
+def _release(loop, sem):
+    try:
+        loop.call_soon_threadsafe(sem.release)
+    except RuntimeError: # loop closed
+        pass
+
+
+async def _run(func, params, *args):
+    loop = _get_running_loop()
+    sem = _semaphore(loop)
+    await sem.acquire()
+    try:
+        future = _submit(func, params, *args)
+    except:
+        sem.release()
+        raise
+    # The slot is freed when the work is done, even if the caller gave up
+    future.add_done_callback(lambda f: _release(loop, sem))
+    return await asyncio.wrap_future(future, loop=loop)
+
+
+async def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+    """Returns a key derived using the scrypt key-derivarion function
+
+    See pylibscrypt.scrypt for the parameters.
+    """
+    return await _run(_scrypt, (N, r, p), password, salt, N, r, p, olen)
+
+
+async def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                     prefix=SCRYPT_MCF_PREFIX_DEFAULT):
+    """Derives a Modular Crypt Format hash using the scrypt KDF
+
+    See pylibscrypt.scrypt_mcf for the parameters.
+    """
+    return await _run(_scrypt_mcf, (N, r, p), password, salt, N, r, p, prefix)
+
+
+async def scrypt_mcf_check(mcf, password):
+    """Returns True if the password matches the given MCF hash"""
+    return await _run(_scrypt_mcf_check, _mcf_params(mcf), mcf, password)
+
+
+__all__ = ['scrypt', 'scrypt_mcf', 'scrypt_mcf_check', 'set_concurrency']
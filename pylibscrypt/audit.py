@@ -0,0 +1,252 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Audit of stored MCF hashes
+
+Run as: python -m pylibscrypt.audit [options] [file ...], see --help.
+
+Reads one hash per line, optionally preceded by a row ID and a delimiter, from
+the files or standard input. Reports how the parameters are distributed and
+lists the rows that are malformed or below the given minimum parameters.
+
+Lines are parsed in chunks, in worker processes if asked to, and only the
+counts are kept in memory, so any number of hashes can be audited.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import Counter
+from itertools import islice
+import json
+import multiprocessing
+import sys
+
+from .mcf import ScryptHash
+
+
+# Lines parsed at a time, and per task in worker processes
+CHUNK_SIZE = 10000
+
+MALFORMED = 'malformed'
+WEAK = 'weak'
+
+
+def _parse_chunk(args):
+    start, lines, delimiter = args
+    out = []
+    for i, line in enumerate(lines):
+        line = line.rstrip(b'\r\n')
+        row, mcf = start + i, line
+        if delimiter is not None and delimiter in line:
+            row, _, mcf = line.partition(delimiter)
+        try:
+            h = ScryptHash.parse(mcf, memoize=False)
+        except (TypeError, ValueError):
+            h = None
+        out.append((row, h))
+    return out
+
+
+def _chunks(lines, delimiter, chunk_size):
+    lines = iter(lines)
+    start = 1
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk, delimiter
+        start += len(chunk)
+
+
+def parse_stream(lines, delimiter=None, chunk_size=CHUNK_SIZE, jobs=1):
+    """Yields (row ID, ScryptHash or None if malformed) for each line
+
+    Lines are byte strings. If a delimiter is given, the row ID is the part
+    of each line before it; otherwise, or if a line has no delimiter, it is
+    the line number, from 1. With jobs > 1, chunks are parsed in that many
+    worker processes. At most two chunks per process are read ahead.
+    """
+    chunks = _chunks(lines, delimiter, chunk_size)
+    if jobs <= 1:
+        for chunk in chunks:
+            for row in _parse_chunk(chunk):
+                yield row
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        while True:
+            window = list(islice(chunks, 2 * jobs))
+            if not window:
+                break
+            for parsed in pool.map(_parse_chunk, window):
+                for row in parsed:
+                    yield row
+    finally:
+        pool.terminate()
+
+
+class AuditReport(object):
+    """Counts of the hashes seen by audit()"""
+
+    def __init__(self):
+        self.rows = 0
+        self.malformed = 0
+        self.weak = 0
+        self.formats = Counter()
+        self.N = Counter()
+        self.r = Counter()
+        self.p = Counter()
+        self.params = Counter()
+        self.salt_len = Counter()
+        self.hash_len = Counter()
+
+    def add(self, h):
+        """Counts a ScryptHash, or a malformed hash if None"""
+        self.rows += 1
+        if h is None:
+            self.malformed += 1
+            return
+        self.formats[h.format.decode()] += 1
+        self.N[h.N] += 1
+        self.r[h.r] += 1
+        self.p[h.p] += 1
+        self.params[(h.N, h.r, h.p)] += 1
+        self.salt_len[len(h.salt)] += 1
+        self.hash_len[len(h.hash)] += 1
+
+    def as_dict(self):
+        """Returns the counts as a dict that can be dumped as JSON"""
+        def hist(c):
+            return dict((str(k), v) for k, v in sorted(c.items()))
+        return {
+            'rows': self.rows,
+            'malformed': self.malformed,
+            'weak': self.weak,
+            'formats': hist(self.formats),
+            'N': hist(self.N),
+            'r': hist(self.r),
+            'p': hist(self.p),
+            'params': dict(('%d,%d,%d' % k, v)
+                           for k, v in sorted(self.params.items())),
+            'salt_len': hist(self.salt_len),
+            'hash_len': hist(self.hash_len),
+        }
+
+
+def audit(lines, report, N=None, r=None, p=None, delimiter=None,
+          chunk_size=CHUNK_SIZE, jobs=1):
+    """Yields (row ID, reason) for each offending hash, counting all in report
+
+    The reason is MALFORMED for lines that don't parse, and WEAK for hashes
+    with N, r or p below the minimums given. See parse_stream for the rest of
+    the arguments.
+    """
+    for row, h in parse_stream(lines, delimiter, chunk_size, jobs):
+        report.add(h)
+        if h is None:
+            yield row, MALFORMED
+        elif ((N and h.N < N) or (r and h.r < r) or (p and h.p < p)):
+            report.weak += 1
+            yield row, WEAK
+
+
+def _lines(paths):
+    if not paths:
+        for line in getattr(sys.stdin, 'buffer', sys.stdin):
+            yield line
+        return
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                yield line
+
+
+def _print_histogram(title, hist, total, out):
+    print('%s:' % title, file=out)
+    for k, v in hist.items():
+        print('  %-20s %12d %6.2f%%' % (k, v, 100.0 * v / total), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pylibscrypt.audit',
+        description='Audits scrypt MCF hashes, one per line.')
+    parser.add_argument('files', nargs='*',
+                        help='files to read, default standard input')
+    parser.add_argument('-d', '--delimiter', default=None,
+                        help='lines are <row ID><delimiter><hash>, default '
+                             'lines are hashes and row IDs line numbers')
+    parser.add_argument('-N', type=int, default=None,
+                        help='minimum acceptable N')
+    parser.add_argument('-r', type=int, default=None,
+                        help='minimum acceptable r')
+    parser.add_argument('-p', type=int, default=None,
+                        help='minimum acceptable p')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes (%(default)s)')
+    parser.add_argument('-o', '--offenders', default='-',
+                        help='file to list offending rows in, - for standard '
+                             'output (default)')
+    parser.add_argument('--json', default=None,
+                        help='write the counts as JSON to this file, - for '
+                             'standard output')
+    args = parser.parse_args(argv)
+    if args.json == '-' and args.offenders == '-':
+        parser.error('--json - needs --offenders to name a file')
+
+    delimiter = args.delimiter
+    if delimiter is not None:
+        delimiter = delimiter.encode()
+
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    if args.offenders == '-':
+        offenders = stdout
+    else:
+        offenders = open(args.offenders, 'wb')
+    try:
+        report = AuditReport()
+        for row, reason in audit(_lines(args.files), report, args.N, args.r,
+                                 args.p, delimiter, jobs=args.jobs):
+            if not isinstance(row, bytes):
+                row = str(row).encode()
+            offenders.write(row + b'\t' + reason.encode() + b'\n')
+        offenders.flush()
+    finally:
+        if offenders is not stdout:
+            offenders.close()
+
+    counts = report.as_dict()
+    if args.json:
+        if args.json == '-':
+            json.dump(counts, sys.stdout, indent=1, sort_keys=True)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(counts, f, indent=1, sort_keys=True)
+        return
+
+    out = sys.stderr if args.offenders == '-' else sys.stdout
+    print('rows: %d, malformed: %d, weak: %d' % (
+        report.rows, report.malformed, report.weak), file=out)
+    valid = report.rows - report.malformed
+    if valid:
+        for key in ('formats', 'N', 'r', 'p', 'params', 'salt_len',
+                    'hash_len'):
+            _print_histogram(key, counts[key], valid, out)
+
+
+if __name__ == "__main__":
+    main()
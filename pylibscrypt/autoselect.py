@@ -0,0 +1,194 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Selects the scrypt implementation measured fastest on this host
+
+The package uses this instead of its fixed order when the environment has
+PYLIBSCRYPT_SELECT=fastest. Parameters to measure with can be given as
+PYLIBSCRYPT_SELECT_PARAMS=N,r,p and default to SCRYPT_N, SCRYPT_r, SCRYPT_p.
+
+The ranking is cached per host, interpreter and parameters in a JSON file,
+by default ~/.cache/pylibscrypt/backends.json, or PYLIBSCRYPT_CACHE if set.
+"""
+
+
+import base64
+import json
+import os
+import platform
+import sys
+import time
+
+from . import registry
+from .bench import measure
+from .common import SCRYPT_N, SCRYPT_r, SCRYPT_p
+
+
+# Measurements are first made with at most this N, then slow ones are skipped
+_PROBE_N = 256
+
+# Skip full measurements predicted to take this many times the best one
+_SKIP_FACTOR = 4
+
+# Calls per measurement, the best of which is kept
+_REPEAT = 3
+
+# From http://www.tarsnap.com/scrypt/scrypt.pdf Appendix B
+_VECTOR = (b'', b'', 16, 1, 1, base64.b16decode(
+    b'77D6576238657B203B19CA42C18A0497F16B4844E3074AE8DFDFFA3FEDE21442'
+    b'FCD0069DED0948F8326A753A0FC81F17E8D3E0FB2E0D3628CF35E20C38D18906'
+))
+
+
+def cache_path():
+    """Returns the path of the calibration cache file"""
+    path = os.environ.get('PYLIBSCRYPT_CACHE')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pylibscrypt', 'backends.json')
+
+
+def load_cache():
+    """Returns the contents of the cache file, or an empty dict"""
+    try:
+        with open(cache_path()) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_cache(cache):
+    """Writes the cache file, ignoring failures"""
+    path = cache_path()
+    try:
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def host_key():
+    """Returns the cache key of this host and interpreter"""
+    return '%s %s %s' % (platform.node(), sys.executable,
+                         sys.version.split()[0])
+
+
+def _load(name):
+    module = registry.load(name)
+    if module is None:
+        return None
+    pw, s, N, r, p, h = _VECTOR
+    try:
+        if module.scrypt(pw, s, N, r, p) != h:
+            return None
+    except ValueError:
+        return None
+    return module
+
+
+def _pure_python(name):
+    return (name in registry.names() and
+            registry.capabilities(name)['pure_python'])
+
+
+def calibrate(N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, modules=None):
+    """Measures the available implementations, returns a ranking
+
+    The ranking is a list of (seconds, module name) pairs, fastest first.
+    By default the implementations are those of pylibscrypt.registry.
+    Implementations that fail the test vector are left out, as are those
+    predicted to be much slower than the fastest one.
+
+    Pure Python ones are only measured if no native one passes, and then
+    once at a small N, their time for N predicted from that.
+    """
+    if modules is None:
+        modules = registry.names()
+    native = [name for name in modules if not _pure_python(name)]
+    loaded = [(name, _load(name)) for name in native]
+    loaded = [(name, module) for name, module in loaded if module]
+    repeat = _REPEAT
+    if not loaded:
+        loaded = [(name, _load(name)) for name in modules
+                  if name not in native]
+        loaded = [(name, module) for name, module in loaded if module]
+        repeat = 1
+
+    probe_N = min(N, _PROBE_N)
+    probes = sorted(
+        (measure(module.scrypt, probe_N, r, p, repeat=repeat)[0], name,
+         module)
+        for name, module in loaded
+    )
+
+    ranking = []
+    for t, name, module in probes:
+        if ranking and t * N / probe_N > _SKIP_FACTOR * ranking[0][0]:
+            continue
+        if repeat == 1:
+            t = t * N / probe_N
+        elif probe_N != N:
+            t = measure(module.scrypt, N, r, p, repeat=repeat)[0]
+        ranking.append((t, name))
+        ranking.sort()
+    return ranking
+
+
+def ranking(N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, refresh=False):
+    """Returns the cached ranking of implementations, calibrating if needed"""
+    key = '%d,%d,%d' % (N, r, p)
+    cache = load_cache()
+    host = cache.get(host_key(), {})
+    if not refresh and key in host:
+        return [tuple(entry) for entry in host[key]['ranking']]
+
+    result = calibrate(N, r, p)
+    cache = load_cache()
+    cache.setdefault(host_key(), {})[key] = {
+        'ranking': result,
+        'time': time.time(),
+    }
+    save_cache(cache)
+    return result
+
+
+def select(N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, refresh=False):
+    """Returns the fastest correct implementation module for the parameters"""
+    names = registry.names()
+    for t, name in ranking(N, r, p, refresh):
+        if name in names:
+            module = _load(name)
+            if module is not None:
+                return module
+    return None
+
+
+def select_from_env():
+    """Returns the module selected by the environment, or None"""
+    if os.environ.get('PYLIBSCRYPT_SELECT') != 'fastest':
+        return None
+    params = os.environ.get('PYLIBSCRYPT_SELECT_PARAMS')
+    try:
+        N, r, p = [int(v) for v in params.split(',')]
+    except (AttributeError, ValueError):
+        N, r, p = SCRYPT_N, SCRYPT_r, SCRYPT_p
+    return select(N, r, p)
@@ -0,0 +1,155 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Batches of scrypt calls run on a shared thread pool
+
+The C implementations release the GIL while hashing, so a batch runs on as
+many cores as there are threads. Pure Python implementations hold the GIL and
+gain nothing from threads.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import multiprocessing
+import threading
+
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT)
+
+
+# A pool replaced by set_pool_size is shut down once nothing submits to it
+_executor = None
+_size = None
+_users = {}
+_lock = threading.Lock()
+
+
+def set_pool_size(size=None):
+    """Sets the number of threads in the pool, by default the number of cores
+
+    Calls already running finish in the old pool.
+    """
+    global _executor, _size
+    if size is not None and size < 1:
+        raise ValueError('pool size must be positive')
+    with _lock:
+        old = _executor
+        _executor = None
+        _size = size
+        if old is not None and old not in _users:
+            old.shutdown(wait=False)
+
+
+def get_pool_size():
+    """Returns the number of threads in the pool"""
+    return _size or multiprocessing.cpu_count()
+
+
+def get_executor():
+    """Returns the shared concurrent.futures thread pool
+
+    set_pool_size shuts it down, so submit work with submit() instead.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(get_pool_size())
+        return _executor
+
+
+@contextmanager
+def _use_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(get_pool_size())
+        executor = _executor
+        _users[executor] = _users.get(executor, 0) + 1
+    try:
+        yield executor
+    finally:
+        with _lock:
+            _users[executor] -= 1
+            if not _users[executor]:
+                del _users[executor]
+                if executor is not _executor:
+                    executor.shutdown(wait=False)
+
+
+def submit(func, *args):
+    """Runs func(*args) on the shared thread pool, returning a Future"""
+    with _use_executor() as executor:
+        return executor.submit(func, *args)
+
+
+def scrypt_batch(scrypt, passwords, salts, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                 olen=64):
+    """Returns a list of keys derived using the scrypt KDF given
+
+    Expects the signature:
+    scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64)
+
+    Results are in the order of the inputs.
+    """
+    passwords = list(passwords)
+    salts = list(salts)
+    if len(passwords) != len(salts):
+        raise ValueError('passwords and salts must be of the same length')
+    with _use_executor() as executor:
+        keys = executor.map(
+            lambda args: scrypt(args[0], args[1], N, r, p, olen),
+            zip(passwords, salts)
+        )
+    return list(keys)
+
+
+def scrypt_mcf_batch(scrypt_mcf, passwords, salts=None, N=SCRYPT_N,
+                     r=SCRYPT_r, p=SCRYPT_p, prefix=SCRYPT_MCF_PREFIX_DEFAULT):
+    """Returns a list of MCF hashes derived using the scrypt_mcf given
+
+    Expects the signature:
+    scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               prefix=SCRYPT_MCF_PREFIX_DEFAULT)
+
+    If no salts are given, each hash gets a random salt. (Recommended.)
+    """
+    passwords = list(passwords)
+    if salts is None:
+        salts = [None] * len(passwords)
+    else:
+        salts = list(salts)
+    if len(passwords) != len(salts):
+        raise ValueError('passwords and salts must be of the same length')
+    with _use_executor() as executor:
+        mcfs = executor.map(
+            lambda args: scrypt_mcf(args[0], args[1], N, r, p, prefix),
+            zip(passwords, salts)
+        )
+    return list(mcfs)
+
+
+def scrypt_mcf_check_batch(scrypt_mcf_check, mcfs, passwords):
+    """Returns a list of booleans, True where the password matches the hash
+
+    Expects the signature:
+    scrypt_mcf_check(mcf, password)
+    """
+    mcfs = list(mcfs)
+    passwords = list(passwords)
+    if len(mcfs) != len(passwords):
+        raise ValueError('mcfs and passwords must be of the same length')
+    with _use_executor() as executor:
+        results = executor.map(scrypt_mcf_check, mcfs, passwords)
+    return list(results)
@@ -1,4 +1,4 @@
-# Copyright (c) 2014-2015, Jan Varho
+# Copyright (c) 2014-2026, Jan Varho
 #
 # Permission to use, copy, modify, and/or distribute this software for any
 # purpose with or without fee is hereby granted, provided that the above
@@ -12,33 +12,278 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-"""Simple benchmark of python vs c scrypt"""
+"""Benchmark of the scrypt implementations over a grid of parameters
 
+Run as: python -m pylibscrypt.bench [options], see --help.
+
+Each measurement runs in a fresh interpreter, so that the peak memory use
+reported is that of the implementation and parameters measured.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
 import time
 
-from .pylibscrypt import scrypt
-from .pypyscrypt_inline import scrypt as pyscrypt
+from . import registry
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    _clock = time.perf_counter
+    _cpu_clock = time.process_time
+except AttributeError:
+    _clock = time.time
+    _cpu_clock = time.clock
+
+
+def _without_ll(module):
+    if not module._scrypt_ll:
+        raise ImportError('libsodium has no low-level scrypt')
+    module._scrypt_ll = None
+
+
+# Short names of the built-in implementations; others go by their own name
+_ALIASES = {
+    'hashlibscrypt': 'hashlib',
+    'pylibscrypt': 'libscrypt',
+    'pyscrypt': 'scrypt',
+    'pylibsodium': 'libsodium',
+    'numpyscrypt': 'numpy',
+    'pypyscrypt_inline': 'inline',
+}
+
+
+def known_backends():
+    """Returns (name, registry name, setup function) of each implementation
+
+    These are those of pylibscrypt.registry, plus libsodium-nol: libsodium
+    without its low-level scrypt.
+    """
+    out = []
+    for regname in registry.names():
+        out.append((_ALIASES.get(regname, regname), regname, None))
+        if regname == 'pylibsodium':
+            out.append(('libsodium-nol', regname, _without_ll))
+    return out
+
+
+def _load(regname):
+    module = registry.load(regname)
+    if module is None:
+        raise ImportError(registry.error(regname))
+    return module
+
+
+def load_backend(name):
+    """Returns the module of the named implementation, ready for use
+
+    Raises ImportError if it isn't available.
+    """
+    for bname, regname, setup in known_backends():
+        if bname == name:
+            module = _load(regname)
+            if setup is not None:
+                setup(module)
+            return module
+    raise ImportError('Unknown scrypt implementation: ' + name)
+
+
+def available_backends():
+    """Returns the names of implementations that can be imported here
+
+    Note that libsodium-nol modifies the pylibsodium module when loaded, so
+    this runs each check in a fresh interpreter.
+    """
+    out = subprocess.check_output([
+        sys.executable, '-c',
+        'from pylibscrypt import bench; bench._print_available()'
+    ])
+    return json.loads(out.decode())
+
+
+def _print_available():
+    names = []
+    for name, regname, setup in known_backends():
+        try:
+            module = _load(regname)
+        except ImportError:
+            continue
+        if setup is _without_ll and not module._scrypt_ll:
+            continue
+        names.append(name)
+    print(json.dumps(names))
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(scrypt, N, r, p, olen=64, repeat=1):
+    """Returns wall and CPU seconds taken by one call to scrypt
+
+    The best of repeat calls is reported.
+    """
+    wall = cpu = None
+    for i in range(repeat):
+        w, c = _clock(), _cpu_clock()
+        scrypt(b'password', b'NaCl', N, r, p, olen)
+        w, c = _clock() - w, _cpu_clock() - c
+        wall = w if wall is None else min(wall, w)
+        cpu = c if cpu is None else min(cpu, c)
+    return wall, cpu
+
+
+def _child(name, N, r, p, olen, repeat):
+    result = {'backend': name, 'N': N, 'r': r, 'p': p, 'olen': olen}
+    try:
+        scrypt = load_backend(name).scrypt
+        result['base_rss'] = _peak_rss()
+        result['wall'], result['cpu'] = measure(scrypt, N, r, p, olen, repeat)
+        result['peak_rss'] = _peak_rss()
+    except (ImportError, ValueError, MemoryError) as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    print(json.dumps(result))
+
+
+def run_one(name, N, r, p, olen=64, repeat=1):
+    """Measures an implementation in a fresh interpreter, returns a dict"""
+    args = [sys.executable, '-m', 'pylibscrypt.bench', '--child', name,
+            str(N), str(r), str(p), str(olen), str(repeat)]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    try:
+        return json.loads(out.decode().strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return {'backend': name, 'N': N, 'r': r, 'p': p, 'olen': olen,
+                'error': 'exit status %d' % proc.returncode}
+
+
+def run(backends, Ns, rs, ps, olens=(64,), repeat=1, max_time=None,
+        report=None):
+    """Measures each implementation over the grid, returns a list of dicts
+
+    Once a measurement takes longer than max_time seconds, larger N are
+    skipped for that implementation and r, p, olen. Each result is also
+    passed to report, if given.
+    """
+    results = []
+    for name in backends:
+        for r in rs:
+            for p in ps:
+                for olen in olens:
+                    slow = False
+                    for N in sorted(Ns):
+                        if slow:
+                            res = {'backend': name, 'N': N, 'r': r, 'p': p,
+                                   'olen': olen, 'skipped': True}
+                        else:
+                            res = run_one(name, N, r, p, olen, repeat)
+                            if max_time and res.get('wall', 0) > max_time:
+                                slow = True
+                        results.append(res)
+                        if report:
+                            report(res)
+    return results
+
+
+def _format_row(res):
+    def ms(t):
+        return '%10.2f' % (t * 1000) if t is not None else '%10s' % '-'
+    def mib(b):
+        return '%9.1f' % (b / 2.0**20) if b is not None else '%9s' % '-'
+    row = '%-14s %10d %4d %4d %5d ' % (res['backend'], res['N'], res['r'],
+                                       res['p'], res['olen'])
+    if res.get('skipped'):
+        return row + 'skipped'
+    if 'error' in res:
+        return row + res['error']
+    return row + '%s %s %s' % (ms(res['wall']), ms(res['cpu']),
+                               mib(res['peak_rss']))
+
+
+def _int_list(s, log2=False):
+    vals = [int(v) for v in s.split(',') if v]
+    return [2**v for v in vals] if log2 else vals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pylibscrypt.bench',
+        description='Benchmarks the scrypt implementations available.')
+    parser.add_argument('-b', '--backends', default=None,
+                        help='comma-separated implementations, default all '
+                             'available of: ' +
+                             ', '.join(b[0] for b in known_backends()))
+    parser.add_argument('-N', '--logN', default='4,8,10,12,14',
+                        help='comma-separated log2 of N (%(default)s)')
+    parser.add_argument('-r', default='8', help='comma-separated r values '
+                                                '(%(default)s)')
+    parser.add_argument('-p', default='1', help='comma-separated p values '
+                                                '(%(default)s)')
+    parser.add_argument('-o', '--olen', default='64',
+                        help='comma-separated output lengths (%(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='calls per measurement, best is kept '
+                             '(%(default)s)')
+    parser.add_argument('--max-time', type=float, default=5.0,
+                        help='skip larger N after a call takes this many '
+                             'seconds (%(default)s)')
+    parser.add_argument('--json', default=None,
+                        help='write results as JSON to this file, - for '
+                             'standard output')
+    parser.add_argument('--child', nargs=6, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        name = args.child[0]
+        _child(name, *[int(v) for v in args.child[1:]])
+        return
 
+    if args.backends:
+        backends = args.backends.split(',')
+    else:
+        backends = available_backends()
 
-# Benchmark time in seconds
-tmin = 5
-Nmax = 20
+    table = sys.stderr if args.json == '-' else sys.stdout
+    print('%-14s %10s %4s %4s %5s %10s %10s %9s' % (
+        'backend', 'N', 'r', 'p', 'olen', 'wall ms', 'cpu ms', 'peak MiB'),
+        file=table)
+    def report(res):
+        print(_format_row(res), file=table)
+        table.flush()
 
-t1 = time.time()
-for i in xrange(1, Nmax+1):
-    pyscrypt(b'password', b'NaCl', N=2**i)
-    if time.time() - t1 > tmin:
-        Nmax = i
-        break
-t1 = time.time() - t1
-print('Using N = 2,4,..., 2**%d' % Nmax)
-print('Python scrypt took %.2fs' % t1)
+    results = run(backends, _int_list(args.logN, True), _int_list(args.r),
+                  _int_list(args.p), _int_list(args.olen), args.repeat,
+                  args.max_time, report)
 
-t3 = time.time()
-for i in xrange(1, Nmax+1):
-    scrypt(b'password', b'NaCl', N=2**i)
-t3 = time.time() - t3
-print('C scrypt took      %.2fs' % t3)
+    if args.json:
+        doc = {
+            'time': time.time(),
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'python': platform.python_implementation(),
+            'python_version': platform.python_version(),
+            'results': results,
+        }
+        if args.json == '-':
+            json.dump(doc, sys.stdout, indent=1, sort_keys=True)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(doc, f, indent=1, sort_keys=True)
 
-print('Python scrypt took %.2f times as long as C' % (t1 / t3))
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Cache of successful MCF hash checks
+
+Clients that authenticate with the same password over and over need not pay
+for scrypt every time. The cache remembers only passwords that matched, for
+a limited time, by an HMAC of the hash and password under a key generated
+for the process. Neither the password nor anything faster to attack than the
+hash itself is kept.
+
+Note that a cached check is much faster, which tells a timing attacker that
+the same password was checked successfully a short while ago.
+
+The package uses a cache for scrypt_mcf_check once given one:
+    pylibscrypt.set_check_cache(CheckCache(maxsize=1024, ttl=300))
+"""
+
+
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+
+from .common import unicode
+from .mcf import ScryptHash
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+class CheckCache(object):
+    """LRU cache of successful checks, which expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        if maxsize < 1:
+            raise ValueError('maxsize must be positive')
+        if not ttl > 0:
+            raise ValueError('ttl must be positive')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, mcf, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf8')
+        msg = struct.pack('>I', len(mcf)) + mcf + password
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def check(self, scrypt_mcf_check, mcf, password):
+        """Returns True if the password matches, using the scrypt_mcf_check
+        given unless the same check succeeded recently
+
+        Expects the signature:
+        scrypt_mcf_check(mcf, password)
+        """
+        encoded = mcf.encode() if isinstance(mcf, ScryptHash) else mcf
+        if not isinstance(encoded, bytes) or not isinstance(password,
+                                                            (bytes, unicode)):
+            return scrypt_mcf_check(mcf, password)
+
+        key = self._digest(encoded, password)
+        now = _clock()
+        with self._lock:
+            expires = self._entries.pop(key, None)
+            if expires is not None and expires > now:
+                self._entries[key] = expires
+                self.hits += 1
+                return True
+            self.misses += 1
+
+        if not scrypt_mcf_check(mcf, password):
+            return False
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = _clock() + self.ttl
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        """Forgets all cached checks"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns a dict with the hits, misses and size of the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+
+__all__ = ['CheckCache']
@@ -0,0 +1,287 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Client of the scrypt daemon of pylibscrypt.server (Python 3)
+
+scrypt, scrypt_mcf and scrypt_mcf_check have the signatures of those of the
+package, but the hashing is done by the daemon at the address in the
+environment variable PYLIBSCRYPT_SERVER: a Unix socket path, or host:port of
+a loopback TCP port. Each thread has a connection of its own. A Client can
+also be made for a given address.
+
+Protocol: each message is a 4-byte big-endian length followed by that many
+bytes of a JSON object. A request has the keys id, op and the arguments of
+the op, with byte strings in base64; it may also have a timeout in seconds.
+The response has the same id and either result or error and message. Byte
+strings in results are base64 as well, except for MCF hashes.
+
+If the daemon is busy, calls raise ServerBusy at once rather than wait.
+"""
+
+
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, TimeoutError,
+    is_buffer, to_bytes, unicode)
+from .deadline import as_deadline
+from .mcf import ScryptHash
+
+
+# Largest message accepted, which bounds the length of passwords
+MAX_MESSAGE = 1 << 20
+
+_HEADER = struct.Struct('>I')
+
+
+class ServerBusy(RuntimeError):
+    """The daemon refused a request because its queues are full"""
+
+
+class ServerError(RuntimeError):
+    """The daemon failed a request for a reason the client doesn't know"""
+
+
+_ERRORS = {
+    'TypeError': TypeError,
+    'ValueError': ValueError,
+    'TimeoutError': TimeoutError,
+    'ServerBusy': ServerBusy,
+}
+
+
+def parse_address(address):
+    """Returns a Unix socket path or a (host, port) tuple for an address
+
+    Addresses with a colon and no slash are host:port, IPv6 hosts in
+    brackets, and the rest paths.
+    """
+    if not isinstance(address, str) or '/' in address or ':' not in address:
+        return address
+    host, _, port = address.rpartition(':')
+    return host.strip('[]') or 'localhost', int(port)
+
+
+def b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def unb64(data):
+    if not isinstance(data, str):
+        raise TypeError('expected a base64 string')
+    return base64.b64decode(data.encode('ascii'), validate=True)
+
+
+def send_message(sock, message, lock=None):
+    """Sends a message as a length-prefixed JSON object"""
+    data = json.dumps(message, separators=(',', ':')).encode('utf8')
+    data = _HEADER.pack(len(data)) + data
+    if lock is None:
+        sock.sendall(data)
+    else:
+        with lock:
+            sock.sendall(data)
+
+
+def _recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock, max_size=MAX_MESSAGE):
+    """Returns the next message, or None once the connection is closed
+
+    Raises ValueError if it is too large or not a JSON object.
+    """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    size = _HEADER.unpack(header)[0]
+    if size > max_size:
+        raise ValueError('message of %d bytes is too large' % size)
+    data = _recv_exactly(sock, size)
+    if data is None:
+        return None
+    message = json.loads(data.decode('utf8'))
+    if not isinstance(message, dict):
+        raise ValueError('message is not an object')
+    return message
+
+
+def _timeout(deadline):
+    deadline = as_deadline(deadline)
+    return None if deadline is None else deadline.remaining()
+
+
+def _password(password):
+    if isinstance(password, unicode):
+        return password.encode('utf8')
+    if not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
+    return to_bytes(password)
+
+
+class Client(object):
+    """Connection to a scrypt daemon, used by one thread at a time
+
+    address  -- Unix socket path, or (host, port) of a loopback TCP port
+    timeout  -- seconds to wait for the daemon to connect or answer
+    """
+
+    def __init__(self, address, timeout=None):
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self._sock = None
+        self._id = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if isinstance(self.address, tuple):
+            sock = socket.create_connection(self.address, self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except:
+                sock.close()
+                raise
+        return sock
+
+    def close(self):
+        """Closes the connection; the next call opens a new one"""
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def request(self, op, timeout=None, **args):
+        """Sends a request and returns the result, raising its error"""
+        with self._lock:
+            self._id += 1
+            message = dict(args, id=self._id, op=op)
+            if timeout is not None:
+                message['timeout'] = timeout
+            if self._sock is None:
+                self._sock = self._connect()
+            try:
+                send_message(self._sock, message)
+                response = recv_message(self._sock)
+                if response is None:
+                    raise ServerError('connection closed by the daemon')
+            except:
+                self._sock.close()
+                self._sock = None
+                raise
+        if response.get('id') != message['id']:
+            raise ServerError('response to another request')
+        if 'error' in response:
+            error = _ERRORS.get(response['error'], ServerError)
+            raise error(response.get('message', response['error']))
+        return response['result']
+
+    def scrypt(self, password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               olen=64, deadline=None):
+        """Returns a key derived using the scrypt key-derivarion function
+
+        See pylibscrypt.scrypt for the parameters. The deadline includes the
+        time spent waiting in line at the daemon.
+        """
+        if not is_buffer(password):
+            raise TypeError('password must be a byte string or buffer')
+        if not is_buffer(salt):
+            raise TypeError('salt must be a byte string or buffer')
+        return unb64(self.request('scrypt', _timeout(deadline),
+                                  password=b64(password), salt=b64(salt),
+                                  N=N, r=r, p=p, olen=olen))
+
+    def scrypt_mcf(self, password, salt=None, N=SCRYPT_N, r=SCRYPT_r,
+                   p=SCRYPT_p, prefix=SCRYPT_MCF_PREFIX_DEFAULT,
+                   deadline=None):
+        """Derives a Modular Crypt Format hash using the scrypt KDF
+
+        See pylibscrypt.scrypt_mcf for the parameters.
+        """
+        if salt is not None:
+            if not is_buffer(salt):
+                raise TypeError('salt must be a byte string or buffer')
+            salt = b64(salt)
+        if prefix is not None:
+            prefix = prefix.decode('ascii')
+        mcf = self.request('scrypt_mcf', _timeout(deadline),
+                           password=b64(_password(password)), salt=salt,
+                           N=N, r=r, p=p, prefix=prefix)
+        return mcf.encode('ascii')
+
+    def scrypt_mcf_check(self, mcf, password, deadline=None):
+        """Returns True if the password matches the given MCF hash"""
+        if isinstance(mcf, ScryptHash):
+            mcf = mcf.encode()
+        elif not isinstance(mcf, bytes):
+            raise TypeError('MCF must be a byte string')
+        try:
+            mcf = mcf.decode('ascii')
+        except UnicodeDecodeError:
+            raise ValueError('Unrecognized MCF hash')
+        return self.request('scrypt_mcf_check', _timeout(deadline), mcf=mcf,
+                            password=b64(_password(password)))
+
+    def stats(self):
+        """Returns a dict describing the load of the daemon"""
+        return self.request('stats')
+
+
+_local = threading.local()
+
+
+def get_client():
+    """Returns the Client of the thread for PYLIBSCRYPT_SERVER"""
+    address = os.environ.get('PYLIBSCRYPT_SERVER')
+    if not address:
+        raise ValueError('PYLIBSCRYPT_SERVER is not set')
+    client = getattr(_local, 'client', None)
+    if client is None or client.address != parse_address(address):
+        client = _local.client = Client(address)
+    return client
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
+    """Returns a key derived using scrypt by the daemon, see Client.scrypt"""
+    return get_client().scrypt(password, salt, N, r, p, olen, deadline)
+
+
+def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               prefix=SCRYPT_MCF_PREFIX_DEFAULT, deadline=None):
+    """Derives an MCF hash by the daemon, see Client.scrypt_mcf"""
+    return get_client().scrypt_mcf(password, salt, N, r, p, prefix, deadline)
+
+
+def scrypt_mcf_check(mcf, password, deadline=None):
+    """Returns True if the password matches the given MCF hash"""
+    return get_client().scrypt_mcf_check(mcf, password, deadline)
+
+
+__all__ = ['Client', 'ServerBusy', 'ServerError', 'get_client', 'scrypt',
+           'scrypt_mcf', 'scrypt_mcf_check']
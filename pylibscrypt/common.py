@@ -15,6 +15,7 @@
 """Common constants and functions used by scrypt implementations"""
 
 import numbers
+import threading
 
 
 SCRYPT_MCF_PREFIX_7 = b'$7$'
@@ -41,12 +42,76 @@ try:
 except:
     unicode = str
 
+try:
+    TimeoutError = TimeoutError
+except NameError:
+    class TimeoutError(OSError):
+        """The builtin TimeoutError of Python 3"""
+
+
+def scrypt_memory(N, r, p):
+    """Returns the number of bytes scrypt needs for the parameters"""
+    return 128 * r * (N + p + 2)
+
+
+def is_buffer(data):
+    """Returns True if data is a byte string or a contiguous buffer of bytes
+
+    Such buffers include bytearray, mmap and memoryview objects of them.
+    """
+    if isinstance(data, bytes):
+        return True
+    if isinstance(data, unicode):
+        return False
+    try:
+        view = memoryview(data)
+    except TypeError:
+        return False
+    return (view.ndim == 1 and view.itemsize == 1 and
+            getattr(view, 'c_contiguous', True))
+
+
+def to_bytes(data):
+    """Returns a byte string or buffer of bytes as a byte string"""
+    if isinstance(data, bytes):
+        return data
+    return memoryview(data).tobytes()
+
+
+def has_nul(data):
+    """Returns True if a byte string or buffer of bytes has a zero byte"""
+    find = getattr(data, 'find', None)
+    if find is not None:
+        return find(b'\0') >= 0
+    view = memoryview(data)
+    if hasattr(view, 'cast'):
+        return 0 in view.cast('B')
+    return b'\0' in view
+
+
+def c_buffer(data):
+    """Returns a byte string or buffer of bytes as a ctypes argument
+
+    The result can be passed as a c_void_p. Byte strings are passed as they
+    are and writable buffers by their address; other buffers are copied.
+    """
+    if isinstance(data, bytes):
+        return data
+    import ctypes
+    view = memoryview(data)
+    obj = getattr(view, 'obj', None)
+    if isinstance(obj, bytes) and len(obj) == len(view):
+        return obj
+    if view.readonly:
+        return (ctypes.c_char * len(view)).from_buffer_copy(view)
+    return (ctypes.c_char * len(view)).from_buffer(view)
+
 
 def check_args(password, salt, N, r, p, olen=64):
-    if not isinstance(password, bytes):
-        raise TypeError('password must be a byte string')
-    if not isinstance(salt, bytes):
-        raise TypeError('salt must be a byte string')
+    if not is_buffer(password):
+        raise TypeError('password must be a byte string or buffer')
+    if not is_buffer(salt):
+        raise TypeError('salt must be a byte string or buffer')
     if not isinstance(N, numbers.Integral):
         raise TypeError('N must be an integer')
     if not isinstance(r, numbers.Integral):
@@ -68,3 +133,65 @@ def check_args(password, salt, N, r, p, olen=64):
     if olen <= 0:
         raise ValueError('length must be positive')
 
+
+
+def scrypt_many(scrypt, passwords, salts, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                olen=64):
+    """Returns a list of keys derived using the scrypt KDF given, in turn"""
+    passwords = list(passwords)
+    salts = list(salts)
+    if len(passwords) != len(salts):
+        raise ValueError('passwords and salts must be of the same length')
+    return [scrypt(pw, s, N, r, p, olen) for pw, s in zip(passwords, salts)]
+
+
+def out_view(out):
+    """Returns a flat, writable memoryview of the buffer out"""
+    try:
+        view = memoryview(out)
+    except TypeError:
+        raise TypeError('out must be a writable buffer')
+    if view.readonly:
+        raise TypeError('out must be a writable buffer')
+    if not getattr(view, 'c_contiguous', True):
+        raise TypeError('out must be a contiguous buffer')
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast('B')
+    return view
+
+
+def scrypt_into(scrypt, password, salt, out, N=SCRYPT_N, r=SCRYPT_r,
+                p=SCRYPT_p):
+    """Writes a key derived using the scrypt KDF given into the buffer out"""
+    view = out_view(out)
+    view[:] = scrypt(password, salt, N, r, p, len(view))
+
+
+_local = threading.local()
+
+# Sizes of ctypes buffers kept per thread, beyond which they are dropped
+_BUFFERS = 16
+
+# Largest buffer kept; larger keys are rare enough to allocate every time
+_BUFFER_MAX = 1024
+
+
+def thread_buffer(size):
+    """Returns a ctypes char buffer of size bytes reused by the thread
+
+    Only one call at a time can use the buffer of a size; clear anything
+    secret from it before returning. Buffers over _BUFFER_MAX bytes are not
+    reused.
+    """
+    import ctypes
+    if size > _BUFFER_MAX:
+        return ctypes.create_string_buffer(size)
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    buf = buffers.get(size)
+    if buf is None:
+        if len(buffers) >= _BUFFERS:
+            buffers.clear()
+        buf = buffers[size] = ctypes.create_string_buffer(size)
+    return buf
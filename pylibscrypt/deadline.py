@@ -0,0 +1,152 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Deadlines and cancellation for scrypt calls
+
+The scrypt functions take a deadline argument: seconds from now, or a Deadline
+that can also be cancelled from another thread. Once it passes, the call
+raises TimeoutError.
+
+Pure Python implementations check the deadline as they run. The others can't
+be interrupted, so with a deadline they run in a worker process of their own,
+which is killed if the deadline passes first. The worker is started by a fork
+server, as forking a process with other threads can deadlock the child. That
+takes several milliseconds, and the first call also starts the server.
+"""
+
+
+import multiprocessing
+import threading
+import time
+
+from . import admission
+from .common import TimeoutError
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+# Seconds between checks for cancellation while waiting for a worker
+_POLL = 0.05
+
+_preloaded = False
+
+
+class Deadline(object):
+    """A time limit for scrypt calls, which can also be cancelled
+
+    Deadline(0.5) expires half a second from now, Deadline() only if
+    cancelled. One deadline can be shared by many calls.
+    """
+
+    def __init__(self, timeout=None):
+        self.expires = None if timeout is None else _clock() + timeout
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Makes calls using the deadline give up"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """Returns the seconds left, or None if there is no time limit"""
+        if self.cancelled:
+            return 0
+        if self.expires is None:
+            return None
+        return max(0, self.expires - _clock())
+
+    def expired(self):
+        """Returns True if cancelled or out of time"""
+        return self.remaining() == 0
+
+    def check(self):
+        """Raises TimeoutError if cancelled or out of time"""
+        if self.expired():
+            raise TimeoutError('scrypt deadline passed')
+
+
+def as_deadline(deadline):
+    """Returns a Deadline for a deadline argument, or None"""
+    if deadline is None or isinstance(deadline, Deadline):
+        return deadline
+    return Deadline(deadline)
+
+
+def _child(conn, func, args):
+    # The parent has reserved the memory
+    admission._local.depth = 1
+    try:
+        result = (True, func(*args))
+    except Exception as e:
+        result = (False, e)
+    conn.send(result)
+    conn.close()
+
+
+def _context(func):
+    # Python 2 has only fork, Windows only spawn
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    global _preloaded
+    context = multiprocessing.get_context('forkserver')
+    if not _preloaded:
+        # The server imports the implementation once for all workers
+        context.set_forkserver_preload([func.__module__])
+        _preloaded = True
+    return context
+
+
+def run_in_process(func, args, deadline):
+    """Returns func(*args) computed in a new worker process
+
+    If the deadline passes first, the worker is killed and TimeoutError
+    raised. func must be a module level function.
+    """
+    deadline.check()
+    context = _context(func)
+    recv, send = context.Pipe(False)
+    proc = context.Process(target=_child, args=(send, func, args))
+    proc.daemon = True
+    proc.start()
+    send.close()
+    try:
+        while True:
+            remaining = deadline.remaining()
+            wait = _POLL if remaining is None else min(_POLL, remaining)
+            if recv.poll(wait):
+                break
+            if deadline.expired():
+                proc.terminate()
+                raise TimeoutError('scrypt deadline passed')
+        try:
+            ok, value = recv.recv()
+        except EOFError:
+            raise ValueError('scrypt worker process died')
+    finally:
+        recv.close()
+        proc.join()
+    if ok:
+        return value
+    raise value
+
+
+__all__ = ['Deadline', 'TimeoutError']
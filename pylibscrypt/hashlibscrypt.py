@@ -22,12 +22,25 @@ except ImportError:
 except:
     raise ImportError('hashlib.scrypt failed to import')
 
+from . import hooks
 from . import mcf as mcf_mod
+from . import registry
+from .admission import reserve
+from .deadline import as_deadline, run_in_process
 from .common import (
-    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, check_args)
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, check_args,
+    scrypt_memory, to_bytes)
+from .common import scrypt_into as _scrypt_into
 
 
-def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+def supports(N, r, p, salt_len=16):
+    """Returns True if OpenSSL can compute scrypt with the parameters"""
+    # N must be below 2**(16*r), and maxmem below 2**31 - 1 for hashlib
+    return N < 2 ** (16 * r) and scrypt_memory(N, r, p) < 2**31 - 1
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
     """Returns a key derived using the scrypt key-derivarion function
 
     N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
@@ -45,17 +58,44 @@ def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
     work factor from the original paper. For long term storage where runtime of
     key derivation is not a problem, you could use 16 as in libscrypt or better
     yet increase N if memory is plentiful.
+
+    With a deadline, seconds or a Deadline from pylibscrypt.deadline, the call
+    runs in a worker process that is killed once the deadline passes, raising
+    TimeoutError.
     """
     check_args(password, salt, N, r, p, olen)
+    if not supports(N, r, p):
+        raise ValueError('OpenSSL scrypt needs N < 2**(16*r) and less than '
+                         '2 GiB of memory')
 
-    # Set the memory required based on parameter values
-    m = 128 * r * (N + p + 2)
+    deadline = as_deadline(deadline)
 
-    try:
-        return _scrypt(
-            password=password, salt=salt, n=N, r=r, p=p, maxmem=m, dklen=olen)
-    except:
-        raise ValueError
+    # Set the memory required based on parameter values
+    m = scrypt_memory(N, r, p)
+
+    with reserve(m, deadline):
+        prof = hooks.timer('hashlibscrypt', N, r, p)
+        if deadline is not None:
+            key = run_in_process(scrypt, (to_bytes(password), to_bytes(salt),
+                                          N, r, p, olen),
+                                 deadline)
+        else:
+            try:
+                key = _scrypt(password=password, salt=salt, n=N, r=r, p=p,
+                              maxmem=m, dklen=olen)
+            except Exception as e:
+                raise ValueError('hashlib.scrypt failed: %s' % e)
+        if prof is not None:
+            prof.phase(hooks.NATIVE, m)
+        return key
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out. See scrypt for the parameters.
+    """
+    _scrypt_into(scrypt, password, salt, out, N, r, p)
 
 
 def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
@@ -77,6 +117,10 @@ def scrypt_mcf_check(mcf, password):
     return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
 
+registry.register('hashlibscrypt', 'pylibscrypt.hashlibscrypt',
+                  supports=supports)
+
+
 if __name__ == "__main__":
     import sys
     from . import tests
@@ -0,0 +1,99 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Profiling hooks for the phases of scrypt
+
+A hook is called after each phase of a scrypt call as:
+    hook(phase, seconds, nbytes, params)
+where params is a dict with the keys backend, N, r and p. The pure Python and
+numpy implementations report the phases:
+    PBKDF2_IN   -- the first PBKDF2, nbytes is its output length
+    ALLOC       -- allocating the buffers, nbytes is their size
+    ROMIX_FILL  -- the first ROMix loop of a lane, filling V
+    ROMIX_MIX   -- the second ROMix loop of a lane, reading V at random
+    ROMIX       -- all lanes, when run by worker processes
+    PBKDF2_OUT  -- the final PBKDF2, nbytes is the key length
+The others only report NATIVE, the whole native call, with the memory it
+needs as nbytes.
+
+Hooks run in the calling thread, and their time is not counted in the next
+phase. Exceptions they raise propagate to the caller. With no hooks added,
+the cost is a function call per scrypt call.
+"""
+
+
+import threading
+import time
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+
+PBKDF2_IN = 'pbkdf2_in'
+ALLOC = 'alloc'
+ROMIX_FILL = 'romix_fill'
+ROMIX_MIX = 'romix_mix'
+ROMIX = 'romix'
+PBKDF2_OUT = 'pbkdf2_out'
+NATIVE = 'native'
+
+# Replaced, not modified, so that calls can iterate it without the lock
+_hooks = ()
+_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Calls hook(phase, seconds, nbytes, params) after each scrypt phase"""
+    global _hooks
+    with _lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook):
+    """Stops calling a hook added with add_hook"""
+    global _hooks
+    with _lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+class Timer(object):
+    """Reports the phases of one scrypt call to the hooks"""
+
+    __slots__ = ('params', 'start')
+
+    def __init__(self, backend, N, r, p):
+        self.params = {'backend': backend, 'N': N, 'r': r, 'p': p}
+        self.start = _clock()
+
+    def phase(self, phase, nbytes):
+        """Reports the time since the previous phase, or the start"""
+        seconds = _clock() - self.start
+        for hook in _hooks:
+            hook(phase, seconds, nbytes, self.params)
+        self.start = _clock()
+
+
+def timer(backend, N, r, p):
+    """Returns a Timer for a scrypt call, or None if there are no hooks"""
+    if not _hooks:
+        return None
+    return Timer(backend, N, r, p)
+
+
+__all__ = ['add_hook', 'remove_hook', 'PBKDF2_IN', 'ALLOC', 'ROMIX_FILL',
+           'ROMIX_MIX', 'ROMIX', 'PBKDF2_OUT', 'NATIVE']
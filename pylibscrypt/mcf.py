@@ -37,17 +37,23 @@ hash  - crypt base64 encoded 32-byte scrypt hash (43 bytes)
 When reading, we are more lax, allowing salts and hashes to be longer and
 incorrectly encoded, since the worst that can happen is that the password does
 not verify.
+
+ScryptHash.parse() gives the parsed form of a hash, which the check functions
+accept too. Recently parsed hashes are remembered.
 """
 
 
 import base64
 import binascii
+from collections import OrderedDict
 import os
 import struct
+import threading
 
 from .common import (
     SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_7, SCRYPT_MCF_PREFIX_s1,
-    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, unicode)
+    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, has_nul, is_buffer,
+    to_bytes, unicode)
 
 
 def _scrypt_mcf_encode_s1(N, r, p, salt, hash):
@@ -94,33 +100,43 @@ def _scrypt_mcf_decode_s1(mcf):
 
 
 # Crypt base 64
+#
+# This is base64 with another alphabet and the bits of each byte and character
+# in the opposite order. So it is coded with the C base64 codec and tables that
+# translate between the alphabets and reverse the bits.
 _cb64 = b'./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
 _cb64a = bytearray(_cb64)
-_icb64 = (
-    [None] * 46 +
-    [
-        0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, None, None, None, None, None,
-        None, None, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25,
-        26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, None, None, None,
-        None, None, None, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49,
-        50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 60, 61, 62, 63
-    ] +
-    [None] * 133
-)
+_b64a = bytearray(
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+
+
+def _reverse_bits(v, bits):
+    return int(bin(v)[2:].zfill(bits)[::-1], 2)
+
+
+def _tables():
+    rev8 = bytearray(_reverse_bits(i, 8) for i in range(256))
+    enc = bytearray(range(256))
+    dec = bytearray(range(256))
+    values = bytearray([0xff] * 256)
+    for i in range(64):
+        c = _cb64a[_reverse_bits(i, 6)]
+        enc[_b64a[i]] = c
+        dec[c] = _b64a[i]
+        values[_cb64a[i]] = i
+    return bytes(rev8), bytes(enc), bytes(dec), bytes(values)
+
+_REV8, _B64_TO_CB64, _CB64_TO_B64, _CB64_VALUES = _tables()
 
 
 def _cb64enc(arr):
-    arr = bytearray(arr)
-    out = bytearray()
-    val = bits = pos = 0
-    for b in arr:
-        val += b << bits
-        bits += 8
-    while bits >= 0:
-        out.append(_cb64a[val & 0x3f])
-        bits -= 6
-        val = val >> 6
-    return bytes(out)
+    arr = bytes(arr)
+    out = base64.b64encode(arr.translate(_REV8)).rstrip(b'=')
+    out = out.translate(_B64_TO_CB64)
+    # The bits are terminated by an extra character when they end evenly
+    if len(arr) % 3 == 0:
+        out += b'.'
+    return out
 
 
 def _scrypt_mcf_encode_7(N, r, p, salt, hash):
@@ -146,16 +162,14 @@ def _scrypt_mcf_encode_7(N, r, p, salt, hash):
 
 
 def _cb64dec(arr):
-    out = bytearray()
-    val = bits = pos = 0
-    for b in arr:
-        val += _icb64[b] << bits
-        bits += 6
-        if bits >= 8:
-            out.append(val & 0xff)
-            bits -= 8
-            val >>= 8
-    return out
+    arr = bytes(arr)
+    if arr.translate(None, _cb64):
+        raise ValueError('Incorrect crypt base64 in MCF')
+    # A lone character in the last group holds no whole byte
+    if len(arr) % 4 == 1:
+        arr = arr[:-1]
+    arr = arr.translate(_CB64_TO_B64) + b'=' * (-len(arr) % 4)
+    return bytearray(base64.b64decode(arr).translate(_REV8))
 
 
 def _scrypt_mcf_decode_7(mcf):
@@ -163,18 +177,14 @@ def _scrypt_mcf_decode_7(mcf):
     if not (mcf.startswith(b'$7$') and len(s) == 4):
         return None
 
-    s64 = bytearray(s[2])
-    h64 = bytearray(s[3])
-    try:
-        N = 2 ** _icb64[s64[0]]
-        r = (_icb64[s64[1]] + (_icb64[s64[2]] << 6) + (_icb64[s64[3]] << 12) +
-             (_icb64[s64[4]] << 18) + (_icb64[s64[5]] << 24))
-        p = (_icb64[s64[6]] + (_icb64[s64[7]] << 6) + (_icb64[s64[8]] << 12) +
-             (_icb64[s64[9]] << 18) + (_icb64[s64[10]] << 24))
-        salt = bytes(s64[11:])
-        hash = bytes(_cb64dec(h64))
-    except (IndexError, TypeError):
+    v = bytearray(s[2][:11].translate(_CB64_VALUES))
+    if len(v) != 11 or 0xff in v:
         raise ValueError('Unrecognized MCF format')
+    N = 2 ** v[0]
+    r = v[1] + (v[2] << 6) + (v[3] << 12) + (v[4] << 18) + (v[5] << 24)
+    p = v[6] + (v[7] << 6) + (v[8] << 12) + (v[9] << 18) + (v[10] << 24)
+    salt = s[2][11:]
+    hash = bytes(_cb64dec(s[3]))
 
     return N, r, p, salt, hash, len(hash)
 
@@ -187,13 +197,102 @@ def _scrypt_mcf_7_is_standard(mcf):
     return len(salt) == 43 and hlen == 32
 
 
-def _scrypt_mcf_decode(mcf):
-    params = _scrypt_mcf_decode_s1(mcf)
-    if params is None:
-        params = _scrypt_mcf_decode_7(mcf)
-    if params is None:
-        raise ValueError('Unrecognized MCF hash')
-    return params
+# Number of parsed hashes remembered by ScryptHash.parse
+_PARSED_SIZE = 1024
+
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+
+
+class ScryptHash(object):
+    """A parsed MCF hash
+
+    N, r, p  -- scrypt parameters
+    salt     -- salt as given to scrypt
+    hash     -- the scrypt output
+    format   -- SCRYPT_MCF_PREFIX_s1 or SCRYPT_MCF_PREFIX_7
+
+    The check functions accept these in place of MCF byte strings. Instances
+    are immutable, so that parse() can return the same one for the same hash.
+    """
+    __slots__ = ('N', 'r', 'p', 'salt', 'hash', 'format')
+
+    def __init__(self, N, r, p, salt, hash, format=SCRYPT_MCF_PREFIX_DEFAULT):
+        if format not in (SCRYPT_MCF_PREFIX_s1, SCRYPT_MCF_PREFIX_7):
+            raise ValueError('Unrecognized MCF format')
+        for name, value in zip(self.__slots__, (N, r, p, salt, hash, format)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ScryptHash is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ScryptHash is immutable')
+
+    def _key(self):
+        return (self.N, self.r, self.p, self.salt, self.hash, self.format)
+
+    def __eq__(self, other):
+        if not isinstance(other, ScryptHash):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'ScryptHash(N=%d, r=%d, p=%d, format=%r)' % (
+            self.N, self.r, self.p, self.format)
+
+    def __reduce__(self):
+        return (ScryptHash, self._key())
+
+    @staticmethod
+    def parse(mcf, memoize=True):
+        """Returns the ScryptHash of an MCF byte string
+
+        Raises ValueError if it is not an scrypt MCF hash. With memoize=False
+        the hash is neither looked up nor remembered, which suits scanning
+        many hashes once.
+        """
+        if not isinstance(mcf, bytes):
+            raise TypeError('MCF must be a byte string')
+        if memoize:
+            with _parsed_lock:
+                h = _parsed.pop(mcf, None)
+                if h is not None:
+                    _parsed[mcf] = h
+                    return h
+
+        params = _scrypt_mcf_decode_s1(mcf)
+        format = SCRYPT_MCF_PREFIX_s1
+        if params is None:
+            params = _scrypt_mcf_decode_7(mcf)
+            format = SCRYPT_MCF_PREFIX_7
+        if params is None:
+            raise ValueError('Unrecognized MCF hash')
+        h = ScryptHash(params[0], params[1], params[2], params[3], params[4],
+                       format)
+        if not memoize:
+            return h
+
+        with _parsed_lock:
+            _parsed[mcf] = h
+            while len(_parsed) > _PARSED_SIZE:
+                _parsed.popitem(last=False)
+        return h
+
+    def encode(self):
+        """Returns the MCF byte string of the hash"""
+        if self.format == SCRYPT_MCF_PREFIX_s1:
+            return _scrypt_mcf_encode_s1(self.N, self.r, self.p, self.salt,
+                                         self.hash)
+        return _scrypt_mcf_encode_7(self.N, self.r, self.p, self.salt,
+                                    self.hash)
 
 
 def scrypt_mcf(scrypt, password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
@@ -207,10 +306,10 @@ def scrypt_mcf(scrypt, password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
     """
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
-    if salt is not None and not isinstance(salt, bytes):
-        raise TypeError('salt must be a byte string')
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
+    if salt is not None and not is_buffer(salt):
+        raise TypeError('salt must be a byte string or buffer')
     if salt is not None and not (1 <= len(salt) <= 16):
         raise ValueError('salt must be 1-16 bytes')
     if r > 255:
@@ -219,9 +318,11 @@ def scrypt_mcf(scrypt, password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
         raise ValueError('scrypt_mcf p out of range [1,255]')
     if N > 2**31:
         raise ValueError('scrypt_mcf N out of range [2,2**31]')
-    if b'\0' in password:
+    if has_nul(password):
         raise ValueError('scrypt_mcf password must not contain zero bytes')
 
+    if salt is not None:
+        salt = to_bytes(salt)
     if prefix == SCRYPT_MCF_PREFIX_s1:
         if salt is None:
             salt = os.urandom(16)
@@ -240,19 +341,118 @@ def scrypt_mcf(scrypt, password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
 def scrypt_mcf_check(scrypt, mcf, password):
     """Returns True if the password matches the given MCF hash
 
-    Supports both the libscrypt $s1$ format and the $7$ format.
+    Supports both the libscrypt $s1$ format and the $7$ format. The hash may
+    be given as a byte string or a ScryptHash.
     """
-    if not isinstance(mcf, bytes):
+    if not isinstance(mcf, (bytes, ScryptHash)):
         raise TypeError('MCF must be a byte string')
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
+    if not isinstance(mcf, ScryptHash):
+        mcf = ScryptHash.parse(mcf)
+
+    h = scrypt(password, mcf.salt, N=mcf.N, r=mcf.r, p=mcf.p,
+               olen=len(mcf.hash))
+    return _hash_equal(h, mcf.hash)
 
-    N, r, p, salt, hash, hlen = _scrypt_mcf_decode(mcf)
-    h = scrypt(password, salt, N=N, r=r, p=p, olen=hlen)
+
+def _hash_equal(h, hash):
     cmp = 0
     for i, j in zip(bytearray(h), bytearray(hash)):
         cmp |= i ^ j
     return cmp == 0
 
+
+def scrypt_mcf_check_many(scrypt_many, mcfs, passwords):
+    """Returns a list of booleans, True where the password matches the hash
+
+    Expects the signature:
+    scrypt_many(passwords, salts, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64)
+
+    Hashes with the same parameters are computed with one scrypt_many call.
+    The hashes may be given as byte strings or ScryptHash objects.
+    """
+    mcfs = list(mcfs)
+    passwords = list(passwords)
+    if len(mcfs) != len(passwords):
+        raise ValueError('mcfs and passwords must be of the same length')
+
+    groups = {}
+    for i, (mcf, password) in enumerate(zip(mcfs, passwords)):
+        if not isinstance(mcf, (bytes, ScryptHash)):
+            raise TypeError('MCF must be a byte string')
+        if isinstance(password, unicode):
+            password = password.encode('utf8')
+        elif not is_buffer(password):
+            raise TypeError('password must be a unicode or byte string or '
+                            'buffer')
+        if not isinstance(mcf, ScryptHash):
+            mcf = ScryptHash.parse(mcf)
+        N, r, p, salt, hash = mcf.N, mcf.r, mcf.p, mcf.salt, mcf.hash
+        hlen = len(hash)
+        groups.setdefault((N, r, p, hlen), []).append(
+            (i, password, salt, hash))
+
+    result = [False] * len(mcfs)
+    for (N, r, p, hlen), group in groups.items():
+        hs = scrypt_many([g[1] for g in group], [g[2] for g in group],
+                         N=N, r=r, p=p, olen=hlen)
+        for (i, password, salt, hash), h in zip(group, hs):
+            result[i] = _hash_equal(h, hash)
+    return result
+
+
+
+def needs_rehash(mcf, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                 prefix=SCRYPT_MCF_PREFIX_ANY):
+    """Returns True if the MCF hash has N, r or p below those given
+
+    Also True if a prefix is given and the hash is in the other format.
+    Only parses the hash, so this is fast.
+    """
+    if not isinstance(mcf, ScryptHash):
+        mcf = ScryptHash.parse(mcf)
+    if prefix is not SCRYPT_MCF_PREFIX_ANY and mcf.format != prefix:
+        return True
+    return mcf.N < N or mcf.r < r or mcf.p < p
+
+
+def scrypt_mcf_check_and_upgrade(scrypt_mcf_check, scrypt_mcf, mcf, password,
+                                 policy=None, executor=None):
+    """Checks the password and rehashes it if the hash is below the policy
+
+    Expects the signatures:
+    scrypt_mcf_check(mcf, password)
+    scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               prefix=SCRYPT_MCF_PREFIX_DEFAULT)
+
+    The policy is a dict of the N, r, p and prefix to require, see
+    needs_rehash. Missing ones default as there; without a prefix the new
+    hash keeps the format of the old one.
+
+    Returns (ok, new_mcf), where new_mcf is None unless the password matched
+    and the hash needs rehashing. If a concurrent.futures executor is given,
+    the new hash is computed there and new_mcf is a Future of it.
+    """
+    if not scrypt_mcf_check(mcf, password):
+        return False, None
+
+    policy = policy or {}
+    N = policy.get('N', SCRYPT_N)
+    r = policy.get('r', SCRYPT_r)
+    p = policy.get('p', SCRYPT_p)
+    prefix = policy.get('prefix', SCRYPT_MCF_PREFIX_ANY)
+    if not isinstance(mcf, ScryptHash):
+        mcf = ScryptHash.parse(mcf)
+    if not needs_rehash(mcf, N, r, p, prefix):
+        return True, None
+
+    # Never lower a parameter that is above the policy already
+    N, r, p = max(N, mcf.N), max(r, mcf.r), max(p, mcf.p)
+    if prefix is SCRYPT_MCF_PREFIX_ANY:
+        prefix = mcf.format
+    if executor is None:
+        return True, scrypt_mcf(password, None, N, r, p, prefix)
+    return True, executor.submit(scrypt_mcf, password, None, N, r, p, prefix)
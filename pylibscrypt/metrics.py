@@ -0,0 +1,199 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Call counts and latencies of the package functions
+
+The package records scrypt, scrypt_mcf and scrypt_mcf_check calls in a
+registry once given one:
+    registry = pylibscrypt.metrics.Registry()
+    pylibscrypt.set_metrics(registry)
+
+Calls are counted per function, implementation, N, r, p and result, and
+their latencies kept as histograms with the same labels except result. The
+calls in progress are kept per function and implementation. With
+PYLIBSCRYPT_BACKEND=router the implementation is the one the router picks
+for the call. A registry can be exported in the Prometheus text format with
+as_prometheus(), or as JSON with as_json().
+
+Results are 'ok' or 'error', or for checks 'match', 'mismatch' or 'error'.
+Checks of malformed hashes have empty N, r and p.
+"""
+
+
+from bisect import bisect_left
+import json
+import threading
+import time
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+OK = 'ok'
+ERROR = 'error'
+MATCH = 'match'
+MISMATCH = 'mismatch'
+
+_PARAMS = ('op', 'backend', 'N', 'r', 'p')
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (k, '' if v is None else v)
+                    for k, v in zip(names, values))
+
+
+def _float(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry(object):
+    """Counters, latency histograms and in-flight gauges of scrypt calls"""
+
+    def __init__(self, buckets=BUCKETS, prefix='pylibscrypt'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._latency = {}
+        self._in_flight = {}
+
+    def reset(self):
+        """Forgets the counts and latencies, but not the calls in progress"""
+        with self._lock:
+            self._calls = {}
+            self._latency = {}
+
+    def call(self, op, backend, params, func, *args):
+        """Returns func(*args), recording it as a call of op
+
+        params is (N, r, p), or None if unknown. If op is a check, the result
+        is recorded as a match or mismatch.
+        """
+        key = (op, backend)
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        start = _clock()
+        result = ERROR
+        try:
+            ret = func(*args)
+            if op == 'scrypt_mcf_check':
+                result = MATCH if ret else MISMATCH
+            else:
+                result = OK
+            return ret
+        finally:
+            self.observe(op, backend, params, result, _clock() - start)
+            with self._lock:
+                self._in_flight[key] -= 1
+
+    def observe(self, op, backend, params, result, seconds):
+        """Records a call that took seconds"""
+        key = (op, backend) + tuple(params or (None, None, None))
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            calls = key + (result,)
+            self._calls[calls] = self._calls.get(calls, 0) + 1
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            latency[0][i] += 1
+            latency[1] += seconds
+            latency[2] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return (sorted(self._calls.items(), key=repr),
+                    sorted(((k, (list(v[0]), v[1], v[2]))
+                            for k, v in self._latency.items()), key=repr),
+                    sorted(self._in_flight.items()))
+
+    def as_dict(self):
+        """Returns everything recorded as a dict that can be dumped as JSON"""
+        calls, latency, in_flight = self._snapshot()
+        bounds = [_float(b) for b in self.buckets] + ['+Inf']
+        out = {'calls': [], 'latency': [], 'in_flight': []}
+        for key, count in calls:
+            entry = dict(zip(_PARAMS + ('result',), key))
+            entry['count'] = count
+            out['calls'].append(entry)
+        for key, (counts, total, count) in latency:
+            entry = dict(zip(_PARAMS, key))
+            cumulative = 0
+            entry['buckets'] = buckets = {}
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                buckets[bound] = cumulative
+            entry['sum'] = total
+            entry['count'] = count
+            out['latency'].append(entry)
+        for (op, backend), value in in_flight:
+            out['in_flight'].append({'op': op, 'backend': backend,
+                                     'value': value})
+        return out
+
+    def as_json(self):
+        """Returns everything recorded as a JSON string"""
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def as_prometheus(self):
+        """Returns everything recorded in the Prometheus text format"""
+        calls, latency, in_flight = self._snapshot()
+        name = self.prefix
+        lines = [
+            '# HELP %s_calls_total Calls by function, parameters and result'
+            % name,
+            '# TYPE %s_calls_total counter' % name,
+        ]
+        for key, count in calls:
+            lines.append('%s_calls_total{%s} %d' % (
+                name, _labels(_PARAMS + ('result',), key), count))
+
+        lines += [
+            '# HELP %s_call_seconds Latency by function and parameters'
+            % name,
+            '# TYPE %s_call_seconds histogram' % name,
+        ]
+        bounds = list(self.buckets) + [float('inf')]
+        for key, (counts, total, count) in latency:
+            labels = _labels(_PARAMS, key)
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append('%s_call_seconds_bucket{%s,le="%s"} %d' % (
+                    name, labels, _float(bound), cumulative))
+            lines.append('%s_call_seconds_sum{%s} %s' % (
+                name, labels, _float(total)))
+            lines.append('%s_call_seconds_count{%s} %d' % (
+                name, labels, count))
+
+        lines += [
+            '# HELP %s_in_flight Calls in progress' % name,
+            '# TYPE %s_in_flight gauge' % name,
+        ]
+        for key, value in in_flight:
+            lines.append('%s_in_flight{%s} %d' % (
+                name, _labels(('op', 'backend'), key), value))
+        return '\n'.join(lines) + '\n'
+
+
+__all__ = ['Registry', 'BUCKETS']
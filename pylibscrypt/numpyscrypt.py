@@ -0,0 +1,309 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Scrypt implementation that runs the p lanes as numpy array operations
+
+The structure is that of pypyscrypt, but every word is a row of uint32 values,
+one per lane, so each Salsa20 step is done for all lanes at once. Salsa20/8
+itself cannot be parallelized, so this only pays off with several lanes. With
+fewer than _MIN_LANES lanes the inlined Python version is used instead.
+"""
+
+
+try:
+    import numpy as np
+except ImportError:
+    raise
+except:
+    raise ImportError('numpy failed to import')
+
+from hashlib import pbkdf2_hmac as _pbkdf2
+
+from . import hooks
+from . import mcf as mcf_mod
+from .admission import reserve
+from .deadline import as_deadline
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, xrange,
+    check_args, scrypt_memory)
+from .common import scrypt_into as _scrypt_into
+from . import pypyscrypt_inline as scr_mod
+
+
+# Below this many lanes the per-operation overhead of numpy loses to Python
+_MIN_LANES = 5
+
+# Upper limit for the size of V when running lanes in parallel; every lane
+# needs its own V, so lanes are run in chunks that fit in this many bytes
+_MAX_V_BYTES = 2**28
+
+# Salsa20 state is kept as the four diagonals, so that each quarter round
+# step of a column round is one vector operation; see salsa20_8
+_DIAG_A = [0, 5, 10, 15]
+_DIAG_B = [4, 9, 14, 3]
+_DIAG_C = [8, 13, 2, 7]
+_DIAG_D = [12, 1, 6, 11]
+
+# Rotations of the diagonals between column rounds and row rounds
+_ROT_1 = np.array([3, 0, 1, 2])
+_ROT_2 = np.array([2, 3, 0, 1])
+_ROT_3 = np.array([1, 2, 3, 0])
+
+# Shift amounts as numpy scalars to skip conversions in the inner loop
+_SHIFTS = dict((b, (np.uint32(b), np.uint32(32 - b))) for b in (7, 9, 13, 18))
+
+
+def R(dest, s1, s2, b):
+    """A Salsa20 quarter round step on four words of every lane"""
+
+    l, r = _SHIFTS[b]
+    a = s1 + s2
+    # The two halves of the rotation share no bits, so xor them in one by one
+    dest ^= a << l
+    dest ^= a >> r
+
+
+def salsa20_8(B):
+    """Salsa20/8 http://en.wikipedia.org/wiki/Salsa20
+
+    B is a 16 x lanes array, modified in place.
+    """
+
+    a = B[_DIAG_A]
+    b = B[_DIAG_B]
+    c = B[_DIAG_C]
+    d = B[_DIAG_D]
+
+    # Four double rounds, with the row round done on rotated diagonals
+    for i in xrange(4):
+        R(b, a, d, 7)
+        R(c, b, a, 9)
+        R(d, c, b, 13)
+        R(a, d, c, 18)
+        b = b.take(_ROT_1, 0)
+        c = c.take(_ROT_2, 0)
+        d = d.take(_ROT_3, 0)
+        R(d, a, b, 7)
+        R(c, d, a, 9)
+        R(b, c, d, 13)
+        R(a, b, c, 18)
+        b = b.take(_ROT_3, 0)
+        c = c.take(_ROT_2, 0)
+        d = d.take(_ROT_1, 0)
+
+    B[_DIAG_A] += a
+    B[_DIAG_B] += b
+    B[_DIAG_C] += c
+    B[_DIAG_D] += d
+
+
+def blockmix_salsa8(B, Y, r):
+    """Blockmix; Used by SMix"""
+
+    X = B[(2 * r - 1) * 16:].copy()                    # BlockMix - 1
+
+    for i in xrange(2 * r):                            # BlockMix - 2
+        X ^= B[i * 16:(i + 1) * 16]                    # BlockMix - 3(inner)
+        salsa20_8(X)                                   # BlockMix - 3(outer)
+        Y[i * 16:(i + 1) * 16] = X                     # BlockMix - 4
+
+    for i in xrange(r):                                # BlockMix - 6
+        B[i * 16:(i + 1) * 16] = Y[(i * 2) * 16:(i * 2 + 1) * 16]
+        B[(i + r) * 16:(i + r + 1) * 16] = Y[(i*2 + 1) * 16:(i*2 + 2) * 16]
+
+
+def smix(X, r, N, V, Y, deadline=None, prof=None):
+    """SMix; a specific case of ROMix based on Salsa20/8
+
+    X is a 32r x lanes array, modified in place. The deadline, if given, is
+    checked every 64 iterations. The profiling timer, if given, is told of
+    the two loops.
+    """
+
+    lanes = np.arange(X.shape[1])
+
+    for i in xrange(N):                                # ROMix - 2
+        if deadline is not None and not i & 63:
+            deadline.check()
+        V[i] = X                                       # ROMix - 3
+        blockmix_salsa8(X, Y, r)                       # ROMix - 4
+
+    if prof is not None:
+        prof.phase(hooks.ROMIX_FILL, 128 * r * N * X.shape[1])
+
+    for i in xrange(N):                                # ROMix - 6
+        if deadline is not None and not i & 63:
+            deadline.check()
+        j = X[(2 * r - 1) * 16] & (N - 1)              # ROMix - 7
+        X ^= V[j, :, lanes].T                          # ROMix - 8(inner)
+        blockmix_salsa8(X, Y, r)                       # ROMix - 9(outer)
+
+    if prof is not None:
+        prof.phase(hooks.ROMIX_MIX, 128 * r * N * X.shape[1])
+
+
+def _chunk(N, r, lanes):
+    return max(1, min(lanes, _MAX_V_BYTES // (128 * r * N)))
+
+
+def lanes_memory(N, r, lanes):
+    """Returns the number of bytes needed to run SMix on the lanes"""
+    return scrypt_memory(N * _chunk(N, r, lanes), r, 2 * lanes)
+
+
+def smix_lanes(B, r, N, deadline=None, prof=None):
+    """Runs SMix on each 128*r byte lane of the byte string B"""
+
+    lanes = len(B) // (128 * r)
+    chunk = _chunk(N, r, lanes)
+
+    # Words first, lanes last, so that a word of every lane is contiguous
+    try:
+        X = np.frombuffer(B, dtype='<u4').reshape(lanes, 32 * r).T
+        X = X.astype(np.uint32)
+        Y = np.empty((32 * r, chunk), dtype=np.uint32)
+        V = np.empty((N, 32 * r, chunk), dtype=np.uint32)
+    except (MemoryError, OverflowError, ValueError):
+        raise ValueError("scrypt parameters don't fit in memory")
+    if prof is not None:
+        prof.phase(hooks.ALLOC, X.nbytes + Y.nbytes + V.nbytes)
+
+    for i in xrange(0, lanes, chunk):
+        Xc = X[:, i:i + chunk].copy()
+        n = Xc.shape[1]
+        smix(Xc, r, N, V[:, :, :n], Y[:, :n], deadline, prof)
+        X[:, i:i + chunk] = Xc
+
+    return X.T.astype('<u4').tobytes()
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
+    """Returns a key derived using the scrypt key-derivarion function
+
+    N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
+    r and p must be positive numbers such that r * p < 2 ** 30
+
+    The default values are:
+    N -- 2**14 (~16k)
+    r -- 8
+    p -- 1
+
+    Memory usage is proportional to N*r. Defaults require about 16 MiB.
+    Time taken is proportional to N*p. Defaults take <100ms of a recent x86.
+
+    The last one differs from libscrypt defaults, but matches the 'interactive'
+    work factor from the original paper. For long term storage where runtime of
+    key derivation is not a problem, you could use 16 as in libscrypt or better
+    yet increase N if memory is plentiful.
+
+    The call raises TimeoutError once the deadline, seconds or a Deadline from
+    pylibscrypt.deadline, passes.
+    """
+    check_args(password, salt, N, r, p, olen)
+    deadline = as_deadline(deadline)
+
+    if p < _MIN_LANES:
+        return scr_mod.scrypt(password, salt, N, r, p, olen,
+                              deadline=deadline)
+
+    with reserve(lanes_memory(N, r, p), deadline):
+        prof = hooks.timer('numpyscrypt', N, r, p)
+        try:
+            B = _pbkdf2('sha256', password, salt, 1, p * 128 * r)
+        except (MemoryError, OverflowError):
+            raise ValueError("scrypt parameters don't fit in memory")
+        if prof is not None:
+            prof.phase(hooks.PBKDF2_IN, len(B))
+        B = smix_lanes(B, r, N, deadline, prof)
+    key = _pbkdf2('sha256', password, B, 1, olen)
+    if prof is not None:
+        prof.phase(hooks.PBKDF2_OUT, olen)
+    return key
+
+
+def scrypt_many(passwords, salts, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+    """Returns a list of keys derived using the scrypt key-derivarion function
+
+    The result for each password and salt pair equals scrypt(password, salt,
+    N, r, p, olen), but all p lanes of every hash are computed together, so
+    the time taken grows slowly with the number of passwords. Memory usage is
+    proportional to N*r*p times the number of passwords, up to a limit.
+    """
+    passwords = list(passwords)
+    salts = list(salts)
+    if len(passwords) != len(salts):
+        raise ValueError('passwords and salts must be of the same length')
+    for password, salt in zip(passwords, salts):
+        check_args(password, salt, N, r, p, olen)
+
+    if len(passwords) * p < _MIN_LANES:
+        return [scr_mod.scrypt(password, salt, N, r, p, olen)
+                for password, salt in zip(passwords, salts)]
+
+    with reserve(lanes_memory(N, r, p * len(passwords))):
+        try:
+            B = b''.join(_pbkdf2('sha256', password, salt, 1, p * 128 * r)
+                         for password, salt in zip(passwords, salts))
+        except (MemoryError, OverflowError):
+            raise ValueError("scrypt parameters don't fit in memory")
+        B = smix_lanes(B, r, N)
+    n = p * 128 * r
+    return [_pbkdf2('sha256', password, B[i * n:(i + 1) * n], 1, olen)
+            for i, password in enumerate(passwords)]
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out. See scrypt for the parameters.
+    """
+    _scrypt_into(scrypt, password, salt, out, N, r, p)
+
+
+def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               prefix=SCRYPT_MCF_PREFIX_DEFAULT):
+    """Derives a Modular Crypt Format hash using the scrypt KDF
+
+    Parameter space is smaller than for scrypt():
+    N must be a power of two larger than 1 but no larger than 2 ** 31
+    r and p must be positive numbers between 1 and 255
+    Salt must be a byte string 1-16 bytes long.
+
+    If no salt is given, a random salt of 128+ bits is used. (Recommended.)
+    """
+    return mcf_mod.scrypt_mcf(scrypt, password, salt, N, r, p, prefix)
+
+
+def scrypt_mcf_check(mcf, password):
+    """Returns True if the password matches the given MCF hash"""
+    return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
+
+
+def scrypt_mcf_check_many(mcfs, passwords):
+    """Returns a list of booleans, True where the password matches the hash
+
+    Hashes with the same parameters are computed together, see scrypt_many.
+    """
+    return mcf_mod.scrypt_mcf_check_many(scrypt_many, mcfs, passwords)
+
+
+__all__ = ['scrypt', 'scrypt_into', 'scrypt_mcf', 'scrypt_mcf_check',
+           'scrypt_many', 'scrypt_mcf_check_many']
+
+
+if __name__ == "__main__":
+    import sys
+    from . import tests
+    tests.run_scrypt_suite(sys.modules[__name__])
@@ -17,14 +17,21 @@
 
 import base64
 import ctypes
-from ctypes import c_char_p, c_size_t, c_uint64, c_uint32
+from ctypes import c_char_p, c_size_t, c_uint64, c_uint32, c_void_p
 from ctypes.util import find_library
 import os
 
+from .admission import reserve
+from .deadline import as_deadline, run_in_process
 from .common import (
     SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_s1,
-    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, check_args, unicode)
+    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, c_buffer, check_args,
+    has_nul, is_buffer, out_view, scrypt_memory, thread_buffer, to_bytes,
+    unicode)
+from .common import scrypt_into as _scrypt_into
+from . import hooks
 from . import mcf as mcf_mod
+from . import registry
 
 
 _libscrypt_soname = find_library('scrypt')
@@ -42,9 +49,9 @@ except AttributeError:
     raise ImportError('Incompatible libscrypt: ' + _libscrypt_soname)
 
 _libscrypt_scrypt.argtypes = [
-    c_char_p,  # password
+    c_void_p,  # password
     c_size_t,  # password length
-    c_char_p,  # salt
+    c_void_p,  # salt
     c_size_t,  # salt length
     c_uint64,  # N
     c_uint32,  # r
@@ -68,7 +75,13 @@ _libscrypt_check.argtypes = [
 ]
 
 
-def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+def supports(N, r, p, salt_len=16):
+    """Returns True if libscrypt can compute scrypt with the parameters"""
+    return True
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
     """Returns a key derived using the scrypt key-derivarion function
 
     N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
@@ -86,17 +99,61 @@ def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
     work factor from the original paper. For long term storage where runtime of
     key derivation is not a problem, you could use 16 as in libscrypt or better
     yet increase N if memory is plentiful.
+
+    With a deadline, seconds or a Deadline from pylibscrypt.deadline, the call
+    runs in a worker process that is killed once the deadline passes, raising
+    TimeoutError.
     """
     check_args(password, salt, N, r, p, olen)
-
-    out = ctypes.create_string_buffer(olen)
-    ret = _libscrypt_scrypt(password, len(password), salt, len(salt),
-                          N, r, p, out, len(out))
+    deadline = as_deadline(deadline)
+
+    m = scrypt_memory(N, r, p)
+    with reserve(m, deadline):
+        prof = hooks.timer('pylibscrypt', N, r, p)
+        if deadline is not None:
+            key = run_in_process(scrypt, (to_bytes(password), to_bytes(salt),
+                                          N, r, p, olen),
+                                 deadline)
+        else:
+            out = thread_buffer(olen)
+            ret = _libscrypt_scrypt(c_buffer(password), len(password),
+                                    c_buffer(salt), len(salt), N, r, p, out,
+                                    olen)
+            key = out.raw
+            ctypes.memset(out, 0, olen)
+            if ret:
+                raise ValueError
+        if prof is not None:
+            prof.phase(hooks.NATIVE, m)
+
+    return key
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out, and libscrypt writes it there directly. See
+    scrypt for the parameters.
+    """
+    view = out_view(out)
+    olen = len(view)
+    check_args(password, salt, N, r, p, olen)
+    try:
+        buf = (ctypes.c_char * olen).from_buffer(view)
+    except TypeError:
+        # Python 2 ctypes can't write into memoryviews
+        return _scrypt_into(scrypt, password, salt, view, N, r, p)
+
+    m = scrypt_memory(N, r, p)
+    with reserve(m):
+        prof = hooks.timer('pylibscrypt', N, r, p)
+        ret = _libscrypt_scrypt(c_buffer(password), len(password),
+                                c_buffer(salt), len(salt), N, r, p, buf, olen)
+        if prof is not None:
+            prof.phase(hooks.NATIVE, m)
     if ret:
         raise ValueError
 
-    return out.raw
-
 
 def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
                prefix=SCRYPT_MCF_PREFIX_DEFAULT):
@@ -113,15 +170,15 @@ def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
         return mcf_mod.scrypt_mcf(scrypt, password, salt, N, r, p, prefix)
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
     if salt is None:
         salt = os.urandom(16)
     elif not (1 <= len(salt) <= 16):
         raise ValueError('salt must be 1-16 bytes')
     if N > 2**31:
         raise ValueError('N > 2**31 not supported')
-    if b'\0' in password:
+    if has_nul(password):
         raise ValueError('scrypt_mcf password must not contain zero bytes')
 
     hash = scrypt(password, salt, N, r, p)
@@ -129,12 +186,12 @@ def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
     h64 = base64.b64encode(hash)
     s64 = base64.b64encode(salt)
 
-    out = ctypes.create_string_buffer(125)
+    out = thread_buffer(125)
     ret = _libscrypt_mcf(N, r, p, s64, h64, out)
     if not ret:
         raise ValueError
 
-    out = out.raw.strip(b'\0')
+    out = out.value
     # XXX: Hack to support old libscrypt (like in Ubuntu 14.04)
     if len(out) == 123:
         out = out + b'='
@@ -144,23 +201,42 @@ def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
 
 def scrypt_mcf_check(mcf, password):
     """Returns True if the password matches the given MCF hash"""
+    if isinstance(mcf, mcf_mod.ScryptHash):
+        return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
     if not isinstance(mcf, bytes):
         raise TypeError('MCF must be a byte string')
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
-    if len(mcf) != 124 or b'\0' in password:
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
+    # libscrypt_check takes the password NUL-terminated
+    if (len(mcf) != 124 or not isinstance(password, bytes) or
+            b'\0' in password):
         return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
-    mcfbuf = ctypes.create_string_buffer(mcf)
-    ret = _libscrypt_check(mcfbuf, password)
+    try:
+        N, r, p = mcf_mod._scrypt_mcf_decode_s1(mcf)[:3]
+    except (TypeError, ValueError):
+        return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
+    # libscrypt_check modifies the string, so it gets a copy
+    mcfbuf = thread_buffer(125)
+    ctypes.memmove(mcfbuf, mcf, 124)
+    mcfbuf[124] = b'\0'
+    m = scrypt_memory(N, r, p)
+    with reserve(m):
+        prof = hooks.timer('pylibscrypt', N, r, p)
+        ret = _libscrypt_check(mcfbuf, password)
+        if prof is not None:
+            prof.phase(hooks.NATIVE, m)
     if ret < 0:
         return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
     return bool(ret)
 
 
+registry.register('pylibscrypt', 'pylibscrypt.pylibscrypt', supports=supports)
+
+
 if __name__ == "__main__":
     import sys
     from . import tests
@@ -20,11 +20,17 @@ from ctypes import c_char_p, c_size_t, c_uint64, c_uint32, c_void_p
 import platform
 from warnings import catch_warnings, filterwarnings
 
+from . import hooks
 from . import mcf as mcf_mod
 from . import libsodium_load
+from . import registry
+from .admission import reserve
+from .deadline import as_deadline, run_in_process
 from .common import (
     SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_7, SCRYPT_MCF_PREFIX_s1,
-    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, check_args, unicode)
+    SCRYPT_MCF_PREFIX_DEFAULT, SCRYPT_MCF_PREFIX_ANY, c_buffer, check_args,
+    is_buffer, out_view, scrypt_memory, thread_buffer, to_bytes, unicode)
+from .common import scrypt_into as _scrypt_into
 from . import pypyscrypt_inline as scr_mod
 
 
@@ -95,7 +101,22 @@ _scrypt_str_chk.argtypes = [
 ]
 
 
-def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+def supports(N, r, p, salt_len=16):
+    """Returns True if libsodium can compute scrypt with the parameters
+
+    Without crypto_pwhash_scryptsalsa208sha256_ll, only the parameters that
+    opslimit and memlimit map to are supported.
+    """
+    if _scrypt_ll:
+        return True
+    s = N.bit_length() - 1
+    t = p.bit_length() - 1
+    return (salt_len == _scrypt_salt and r == 8 and not p & (p - 1) and
+            N * p > 512 and s <= 53 and t + s <= 58)
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
     """Returns a key derived using the scrypt key-derivarion function
 
     N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
@@ -113,29 +134,78 @@ def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
     work factor from the original paper. For long term storage where runtime of
     key derivation is not a problem, you could use 16 as in libscrypt or better
     yet increase N if memory is plentiful.
+
+    With a deadline, seconds or a Deadline from pylibscrypt.deadline, the call
+    runs in a worker process that is killed once the deadline passes, raising
+    TimeoutError.
     """
     check_args(password, salt, N, r, p, olen)
-
+    deadline = as_deadline(deadline)
+
+    m = scrypt_memory(N, r, p)
+    with reserve(m, deadline):
+        if deadline is not None:
+            prof = hooks.timer('pylibsodium', N, r, p)
+            key = run_in_process(scrypt, (to_bytes(password), to_bytes(salt),
+                                          N, r, p, olen),
+                                 deadline)
+            if prof is not None:
+                prof.phase(hooks.NATIVE, m)
+            return key
+        return _scrypt_reserved(password, salt, N, r, p, olen)
+
+
+def _scrypt_reserved(password, salt, N, r, p, olen, into=None):
+    # Writes the key into the ctypes buffer into if given, else returns it
+    if not _scrypt_ll and (len(salt) != _scrypt_salt or r != 8 or
+                           (p & (p - 1)) or (N*p <= 512)):
+        key = scr_mod.scrypt(password, salt, N, r, p, olen)
+        if into is None:
+            return key
+        ctypes.memmove(into, key, olen)
+        return None
+
+    out = thread_buffer(olen) if into is None else into
+    prof = hooks.timer('pylibsodium', N, r, p)
     if _scrypt_ll:
-        out = ctypes.create_string_buffer(olen)
-        if _scrypt_ll(password, len(password), salt, len(salt),
-                      N, r, p, out, olen):
+        ret = _scrypt_ll(c_buffer(password), len(password), c_buffer(salt),
+                         len(salt), N, r, p, out, olen)
+    else:
+        s = next(i for i in range(1, 64) if 2**i == N)
+        t = next(i for i in range(0, 30) if 2**i == p)
+        m = 2**(10 + s)
+        o = 2**(5 + t + s)
+        if s > 53 or t + s > 58:
             raise ValueError
-        return out.raw
+        ret = _scrypt(out, olen, c_buffer(password), len(password),
+                      c_buffer(salt), o, m)
+    key = None
+    if into is None:
+        key = out.raw
+        ctypes.memset(out, 0, olen)
+    if ret != 0:
+        raise ValueError
+    if prof is not None:
+        prof.phase(hooks.NATIVE, scrypt_memory(N, r, p))
+    return key
 
-    if len(salt) != _scrypt_salt or r != 8 or (p & (p - 1)) or (N*p <= 512):
-        return scr_mod.scrypt(password, salt, N, r, p, olen)
 
-    s = next(i for i in range(1, 64) if 2**i == N)
-    t = next(i for i in range(0, 30) if 2**i == p)
-    m = 2**(10 + s)
-    o = 2**(5 + t + s)
-    if s > 53 or t + s > 58:
-        raise ValueError
-    out = ctypes.create_string_buffer(olen)
-    if _scrypt(out, olen, password, len(password), salt, o, m) != 0:
-        raise ValueError
-    return out.raw
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out, and libsodium writes it there directly. See
+    scrypt for the parameters.
+    """
+    view = out_view(out)
+    olen = len(view)
+    check_args(password, salt, N, r, p, olen)
+    try:
+        buf = (ctypes.c_char * olen).from_buffer(view)
+    except TypeError:
+        # Python 2 ctypes can't write into memoryviews
+        return _scrypt_into(scrypt, password, salt, view, N, r, p)
+    with reserve(scrypt_memory(N, r, p)):
+        _scrypt_reserved(password, salt, N, r, p, olen, buf)
 
 
 def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
@@ -151,8 +221,8 @@ def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
     """
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
     if N < 2 or (N & (N - 1)):
         raise ValueError('scrypt N must be a power of 2 greater than 1')
     if p > 255 or p < 1:
@@ -170,14 +240,20 @@ def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
     t = next(i for i in range(0, 8) if 2**i == p)
     m = 2**(10 + s)
     o = 2**(5 + t + s)
-    mcf = ctypes.create_string_buffer(102)
-    if _scrypt_str(mcf, password, len(password), o, m) != 0:
+    mcf = thread_buffer(102)
+    with reserve(scrypt_memory(N, r, p)):
+        prof = hooks.timer('pylibsodium', N, r, p)
+        ret = _scrypt_str(mcf, c_buffer(password), len(password), o, m)
+        if prof is not None:
+            prof.phase(hooks.NATIVE, scrypt_memory(N, r, p))
+    if ret != 0:
         return mcf_mod.scrypt_mcf(scrypt, password, salt, N, r, p, prefix)
 
+    mcf = mcf.value
     if prefix in (SCRYPT_MCF_PREFIX_7, SCRYPT_MCF_PREFIX_ANY):
-        return mcf.raw.strip(b'\0')
+        return mcf
 
-    _N, _r, _p, salt, hash, olen = mcf_mod._scrypt_mcf_decode_7(mcf.raw[:-1])
+    _N, _r, _p, salt, hash, olen = mcf_mod._scrypt_mcf_decode_7(mcf)
     assert _N == N and _r == r and _p == p, (_N, _r, _p, N, r, p, o, m)
     return mcf_mod._scrypt_mcf_encode_s1(N, r, p, salt, hash)
 
@@ -186,15 +262,36 @@ def scrypt_mcf_check(mcf, password):
     """Returns True if the password matches the given MCF hash"""
     if isinstance(password, unicode):
         password = password.encode('utf8')
-    elif not isinstance(password, bytes):
-        raise TypeError('password must be a unicode or byte string')
+    elif not is_buffer(password):
+        raise TypeError('password must be a unicode or byte string or buffer')
+    if isinstance(mcf, mcf_mod.ScryptHash):
+        if _scrypt_ll or mcf.format != SCRYPT_MCF_PREFIX_7:
+            return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
+        mcf = mcf.encode()
     if not isinstance(mcf, bytes):
         raise TypeError('MCF must be a byte string')
     if mcf_mod._scrypt_mcf_7_is_standard(mcf) and not _scrypt_ll:
-        return _scrypt_str_chk(mcf, password, len(password)) == 0
+        N, r, p = mcf_mod._scrypt_mcf_decode_7(mcf)[:3]
+        with reserve(scrypt_memory(N, r, p)):
+            prof = hooks.timer('pylibsodium', N, r, p)
+            ret = _scrypt_str_chk(mcf, c_buffer(password), len(password))
+            if prof is not None:
+                prof.phase(hooks.NATIVE, scrypt_memory(N, r, p))
+            return ret == 0
     return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
 
+if _scrypt_ll:
+    registry.register('pylibsodium', 'pylibscrypt.pylibsodium',
+                      supports=supports)
+else:
+    registry.register('pylibsodium', 'pylibscrypt.pylibsodium',
+                      native_mcf=(SCRYPT_MCF_PREFIX_7,),
+                      limits='salt of %d bytes, r=8, p a power of 2, '
+                             'N*p > 512' % _scrypt_salt,
+                      supports=supports)
+
+
 if __name__ == "__main__":
     import sys
     from . import tests
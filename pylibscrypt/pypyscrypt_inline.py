@@ -34,13 +34,100 @@
 # https://github.com/wg/scrypt
 
 
+from array import array
+from contextlib import contextmanager
 from hashlib import pbkdf2_hmac as _pbkdf2
-import struct
+import mmap
+import multiprocessing
+import sys
+import tempfile
+import threading
 
+from . import hooks
 from . import mcf as mcf_mod
+from .admission import reserve
+from .deadline import _POLL, Deadline, as_deadline
 from .common import (
     SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, xrange,
-    check_args)
+    check_args, scrypt_memory)
+from .common import scrypt_into as _scrypt_into
+
+
+# Unsigned 32-bit words hold the state, 4 bytes per word. On little-endian
+# Python 3 they are memoryviews of bytearrays, elsewhere arrays.
+_WORD = 'I' if array('I').itemsize == 4 else 'L'
+_CAST = hasattr(memoryview, 'cast') and sys.byteorder == 'little'
+
+
+def words(b, n=None):
+    """Returns the little-endian words of b, or n zero words
+
+    A bytearray is used as it is, other bytes are copied once.
+    """
+    if _CAST:
+        if n is not None:
+            b = bytearray(4 * n)
+        elif not isinstance(b, bytearray):
+            b = bytearray(b)
+        return memoryview(b).cast(_WORD)
+    if n is not None:
+        return array(_WORD, [0]) * n
+    a = array(_WORD)
+    if hasattr(a, 'frombytes'):
+        a.frombytes(b)
+    else:
+        a.fromstring(b)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def words_to_bytes(a):
+    """Returns the bytes of an array of words, little-endian"""
+    if sys.byteorder == 'big':
+        a = array(_WORD, a)
+        a.byteswap()
+    if hasattr(a, 'tobytes'):
+        return a.tobytes()
+    return a.tostring()
+
+
+@contextmanager
+def vstorage(n, vstore=None, vpath=None):
+    """Context manager that gives the n words of V
+
+    vstore -- None for an array in memory, 'mmap' for a memory map (Python 3)
+    vpath  -- with 'mmap', a directory to back the map with a temporary file
+              in; by default the map is anonymous
+    """
+    if vstore is None:
+        try:
+            V = words(None, n)
+        except (MemoryError, OverflowError):
+            raise ValueError("scrypt parameters don't fit in memory")
+        yield V
+        return
+    if vstore != 'mmap':
+        raise ValueError('Unknown vstore: %r' % (vstore,))
+    if not hasattr(memoryview, 'cast'):
+        raise ValueError("vstore='mmap' needs Python 3")
+
+    try:
+        if vpath is None:
+            m = mmap.mmap(-1, 4 * n)
+        else:
+            # The map keeps the deleted file until it is closed
+            with tempfile.TemporaryFile(dir=vpath) as f:
+                f.truncate(4 * n)
+                m = mmap.mmap(f.fileno(), 4 * n)
+    except (OverflowError, mmap.error):
+        raise ValueError("scrypt parameters don't fit in memory")
+    V = memoryview(m).cast(_WORD)
+    try:
+        yield V
+    finally:
+        V.release()
+        m.close()
 
 
 def blockxor(source, s_start, dest, d_start, length):
@@ -139,7 +226,7 @@ def blockmix_salsa8(BY, Yi, r):
     """Blockmix; Used by SMix"""
 
     start = (2 * r - 1) * 16
-    X = BY[start:start+16]                             # BlockMix - 1
+    X = list(BY[start:start+16])                       # BlockMix - 1
     tmp = [0]*16
 
     for i in xrange(2 * r):                            # BlockMix - 2
@@ -152,24 +239,102 @@ def blockmix_salsa8(BY, Yi, r):
         BY[(i + r) * 16:((i + r) * 16)+(16)] = BY[Yi + (i*2 + 1) * 16:(Yi + (i*2 + 1) * 16)+(16)]
 
 
-def smix(B, Bi, r, N, V, X):
-    """SMix; a specific case of ROMix based on Salsa20/8"""
+def smix(B, Bi, r, N, V, X, deadline=None, prof=None):
+    """SMix; a specific case of ROMix based on Salsa20/8
+
+    The deadline, if given, is checked every 64 iterations. The profiling
+    timer, if given, is told of the two loops.
+    """
 
     X[0:(0)+(32 * r)] = B[Bi:(Bi)+(32 * r)]
 
     for i in xrange(N):                                # ROMix - 2
+        if deadline is not None and not i & 63:
+            deadline.check()
         V[i * (32 * r):(i * (32 * r))+(32 * r)] = X[0:(0)+(32 * r)]
         blockmix_salsa8(X, 32 * r, r)                  # ROMix - 4
 
+    if prof is not None:
+        prof.phase(hooks.ROMIX_FILL, 128 * r * N)
+
     for i in xrange(N):                                # ROMix - 6
+        if deadline is not None and not i & 63:
+            deadline.check()
         j = integerify(X, r) & (N - 1)                 # ROMix - 7
         blockxor(V, j * (32 * r), X, 0, 32 * r)        # ROMix - 8(inner)
         blockmix_salsa8(X, 32 * r, r)                  # ROMix - 9(outer)
 
     B[Bi:(Bi)+(32 * r)] = X[0:(0)+(32 * r)]
 
+    if prof is not None:
+        prof.phase(hooks.ROMIX_MIX, 128 * r * N)
+
+
+def smix_lane(args):
+    """SMix on one 128*r byte lane with its own V; run by worker processes"""
+
+    Bi, r, N, vstore, vpath, timeout = args
+    deadline = None if timeout is None else Deadline(timeout)
+    try:
+        B  = words(Bi)
+        XY = words(None, 64 * r)
+    except (MemoryError, OverflowError):
+        raise ValueError("scrypt parameters don't fit in memory")
+
+    with vstorage(32 * r * N, vstore, vpath) as V:
+        smix(B, 0, r, N, V, XY, deadline)
+    return words_to_bytes(B)
+
 
-def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+# Name of the implementation, as reported to profiling hooks
+_NAME = __name__.rpartition('.')[2]
+
+
+# Worker processes are kept around between calls with the same workers value.
+# A pool replaced by one of another size is terminated once no call uses it.
+_pool = None
+_pool_size = 0
+_pool_users = {}
+_pool_lock = threading.Lock()
+
+
+@contextmanager
+def _use_pool(workers):
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool_size != workers:
+            old = _pool
+            _pool = multiprocessing.Pool(workers)
+            _pool_size = workers
+            if old is not None and old not in _pool_users:
+                old.terminate()
+        pool = _pool
+        _pool_users[pool] = _pool_users.get(pool, 0) + 1
+    try:
+        yield pool
+    finally:
+        with _pool_lock:
+            _pool_users[pool] -= 1
+            if not _pool_users[pool]:
+                del _pool_users[pool]
+                if pool is not _pool:
+                    pool.terminate()
+
+
+@contextmanager
+def _own_pool(workers):
+    # Calls with a deadline don't share workers, so that the ones of a call
+    # that gives up can be killed before its memory is released
+    pool = multiprocessing.Pool(workers)
+    try:
+        yield pool
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           workers=None, vstore=None, vpath=None, deadline=None):
     """Returns a key derived using the scrypt key-derivarion function
 
     N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
@@ -187,24 +352,96 @@ def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
     work factor from the original paper. For long term storage where runtime of
     key derivation is not a problem, you could use 16 as in libscrypt or better
     yet increase N if memory is plentiful.
+
+    With workers > 1, the p lanes are computed in parallel by that many worker
+    processes, each needing its own N*r memory.
+
+    With vstore='mmap', the N*r memory is a memory map that the OS pages in
+    and out, so that very large N can be used on small hosts (Python 3). The
+    map is anonymous and backed by swap, unless vpath gives a directory to
+    back it with a temporary file in.
+
+    The call raises TimeoutError once the deadline, seconds or a Deadline from
+    pylibscrypt.deadline, passes. Workers only check the time limit, so after
+    a cancel they run their lanes to the end in the background.
     """
 
     check_args(password, salt, N, r, p, olen)
+    deadline = as_deadline(deadline)
 
-    # Everything is lists of 32-bit uints for all but pbkdf2
+    # Memory maps are left out of admission, as the OS pages them
+    v = 128 * r * N if vstore is None else 0
+    if workers is not None and workers > 1 and p > 1:
+        # Every worker has a V of its own
+        m = scrypt_memory(N, r, p) - 128 * r * N + v * min(workers, p)
+        with reserve(m, deadline):
+            return _scrypt_workers(password, salt, N, r, p, olen, workers,
+                                   vstore, vpath, deadline)
+
+    with reserve(scrypt_memory(N, r, p) - 128 * r * N + v, deadline):
+        return _scrypt(password, salt, N, r, p, olen, vstore, vpath, deadline)
+
+
+def _scrypt(password, salt, N, r, p, olen, vstore=None, vpath=None,
+            deadline=None):
+    prof = hooks.timer(_NAME, N, r, p)
+
+    # Everything is arrays of 32-bit uints for all but pbkdf2
     try:
         B  = _pbkdf2('sha256', password, salt, 1, p * 128 * r)
-        B  = list(struct.unpack('<%dI' % (len(B) // 4), B))
-        XY = [0] * (64 * r)
-        V  = [0] * (32 * r * N)
+        if prof is not None:
+            prof.phase(hooks.PBKDF2_IN, len(B))
+        B  = words(B)
+        XY = words(None, 64 * r)
     except (MemoryError, OverflowError):
         raise ValueError("scrypt parameters don't fit in memory")
 
-    for i in xrange(p):
-        smix(B, i * 32 * r, r, N, V, XY)
+    with vstorage(32 * r * N, vstore, vpath) as V:
+        if prof is not None:
+            prof.phase(hooks.ALLOC, 128 * r * (p + 2 + N))
+        for i in xrange(p):
+            smix(B, i * 32 * r, r, N, V, XY, deadline, prof)
+
+    key = _pbkdf2('sha256', password, words_to_bytes(B), 1, olen)
+    if prof is not None:
+        prof.phase(hooks.PBKDF2_OUT, olen)
+    return key
+
 
-    B = struct.pack('<%dI' % len(B), *B)
-    return _pbkdf2('sha256', password, B, 1, olen)
+def _scrypt_workers(password, salt, N, r, p, olen, workers, vstore=None,
+                    vpath=None, deadline=None):
+    prof = hooks.timer(_NAME, N, r, p)
+    try:
+        B  = _pbkdf2('sha256', password, salt, 1, p * 128 * r)
+    except (MemoryError, OverflowError):
+        raise ValueError("scrypt parameters don't fit in memory")
+    if prof is not None:
+        prof.phase(hooks.PBKDF2_IN, len(B))
+    timeout = None if deadline is None else deadline.remaining()
+    lanes = [(B[i * 128 * r:(i + 1) * 128 * r], r, N, vstore, vpath, timeout)
+             for i in xrange(p)]
+    use_pool = _use_pool if deadline is None else _own_pool
+    with use_pool(workers) as pool:
+        result = pool.map_async(smix_lane, lanes)
+        while deadline is not None and not result.ready():
+            deadline.check()
+            result.wait(_POLL)
+        B = b''.join(result.get())
+    if prof is not None:
+        prof.phase(hooks.ROMIX, 128 * r * N * p)
+
+    key = _pbkdf2('sha256', password, B, 1, olen)
+    if prof is not None:
+        prof.phase(hooks.PBKDF2_OUT, olen)
+    return key
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out. See scrypt for the parameters.
+    """
+    _scrypt_into(scrypt, password, salt, out, N, r, p)
 
 
 def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
@@ -226,7 +463,7 @@ def scrypt_mcf_check(mcf, password):
     return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
 
-__all__ = ['scrypt', 'scrypt_mcf', 'scrypt_mcf_check']
+__all__ = ['scrypt', 'scrypt_into', 'scrypt_mcf', 'scrypt_mcf_check']
 
 
 if __name__ == "__main__":
@@ -22,9 +22,15 @@ except ImportError:
 except:
     raise ImportError('scrypt module failed to import')
 
+from . import hooks
 from . import mcf as mcf_mod
+from . import registry
+from .admission import reserve
+from .deadline import as_deadline, run_in_process
 from .common import (
-    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, check_args)
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, check_args,
+    scrypt_memory, to_bytes)
+from .common import scrypt_into as _scrypt_into
 
 
 # scrypt < 0.6 doesn't support hash length
@@ -34,7 +40,13 @@ except TypeError:
     raise ImportError('scrypt module version unsupported, 0.6+ required')
 
 
-def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
+def supports(N, r, p, salt_len=16):
+    """Returns True if py-scrypt can compute scrypt with the parameters"""
+    return True
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
     """Returns a key derived using the scrypt key-derivarion function
 
     N must be a power of two larger than 1 but no larger than 2 ** 63 (insane)
@@ -52,13 +64,39 @@ def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64):
     work factor from the original paper. For long term storage where runtime of
     key derivation is not a problem, you could use 16 as in libscrypt or better
     yet increase N if memory is plentiful.
+
+    With a deadline, seconds or a Deadline from pylibscrypt.deadline, the call
+    runs in a worker process that is killed once the deadline passes, raising
+    TimeoutError.
     """
     check_args(password, salt, N, r, p, olen)
-
-    try:
-        return _scrypt(password=password, salt=salt, N=N, r=r, p=p, buflen=olen)
-    except:
-        raise ValueError
+    deadline = as_deadline(deadline)
+
+    m = scrypt_memory(N, r, p)
+    with reserve(m, deadline):
+        prof = hooks.timer('pyscrypt', N, r, p)
+        if deadline is not None:
+            key = run_in_process(scrypt, (to_bytes(password), to_bytes(salt),
+                                          N, r, p, olen),
+                                 deadline)
+        else:
+            try:
+                # The scrypt module only takes byte strings
+                key = _scrypt(password=to_bytes(password),
+                              salt=to_bytes(salt), N=N, r=r, p=p, buflen=olen)
+            except:
+                raise ValueError
+        if prof is not None:
+            prof.phase(hooks.NATIVE, m)
+        return key
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out. See scrypt for the parameters.
+    """
+    _scrypt_into(scrypt, password, salt, out, N, r, p)
 
 
 def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
@@ -80,6 +118,9 @@ def scrypt_mcf_check(mcf, password):
     return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
 
 
+registry.register('pyscrypt', 'pylibscrypt.pyscrypt', supports=supports)
+
+
 if __name__ == "__main__":
     import sys
     from . import tests
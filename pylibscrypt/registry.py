@@ -0,0 +1,173 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Registry of scrypt implementations and what they can do
+
+Each implementation has these capabilities:
+    releases_gil -- True if other threads run while it computes
+    pure_python  -- True if written in Python, with or without numpy
+    native_mcf   -- MCF prefixes it creates and checks natively, e.g. (b'$7$',)
+    limits       -- description of the parameters it supports, None if all
+    supports     -- supports(N, r, p, salt_len) function, None if all
+
+Those of the built-in implementations are declared below, so that they are
+known without importing them. The modules register their supports functions
+when imported, and pylibsodium the limits of the libsodium it finds.
+backends() imports all of them and reports the capabilities, whether they
+could be imported and how long that took.
+
+Other implementations can join by registering their module, which must have
+the scrypt, scrypt_mcf and scrypt_mcf_check functions. Its scrypt only gets
+a deadline keyword argument in calls given one:
+    pylibscrypt.registry.register('myscrypt', 'mypackage.myscrypt',
+                                  releases_gil=True)
+The router then considers it after the built-in ones, unless autoselect has
+ranked it faster, and PYLIBSCRYPT_BACKEND can name it.
+"""
+
+
+from collections import OrderedDict
+import importlib
+import threading
+import time
+
+from .common import SCRYPT_MCF_PREFIX_s1
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+
+CAPABILITIES = {
+    'releases_gil': False,
+    'pure_python': False,
+    'native_mcf': (),
+    'limits': None,
+    'supports': None,
+}
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+# Incremented on every registration, so that users can notice changes
+version = 0
+
+
+def register(name, module, **capabilities):
+    """Adds an implementation, or updates the capabilities of one"""
+    global version
+    unknown = set(capabilities) - set(CAPABILITIES)
+    if unknown:
+        raise TypeError('unknown capabilities: %s'
+                        % ', '.join(sorted(unknown)))
+    with _lock:
+        entry = _entries.get(name)
+        if entry is None:
+            entry = _entries[name] = dict(CAPABILITIES, loaded=None,
+                                          load_time=None, error=None)
+        entry['module'] = module
+        entry.update(capabilities)
+        version += 1
+
+
+def unregister(name):
+    """Removes an implementation"""
+    global version
+    with _lock:
+        del _entries[name]
+        version += 1
+
+
+def names():
+    """Returns the names of the implementations, in order of preference"""
+    with _lock:
+        return list(_entries)
+
+
+def capabilities(name):
+    """Returns a dict of the capabilities of an implementation"""
+    entry = _entries[name]
+    return dict((k, entry[k]) for k in CAPABILITIES)
+
+
+def load(name):
+    """Returns the module of an implementation, or None if it can't be used
+
+    Raises KeyError if the implementation is not registered.
+    """
+    entry = _entries[name]
+    if entry['loaded'] is None and entry['error'] is None:
+        start = _clock()
+        try:
+            entry['loaded'] = importlib.import_module(entry['module'])
+        except ImportError as e:
+            entry['error'] = str(e) or e.__class__.__name__
+        entry['load_time'] = _clock() - start
+    return entry['loaded']
+
+
+def error(name):
+    """Returns why an implementation could not be imported, or None"""
+    return _entries[name]['error']
+
+
+def backends():
+    """Returns a list of dicts describing the implementations
+
+    Each has the keys name, module, available, load_time and error, besides
+    the capabilities. Prefixes in native_mcf are strings. Imports all of the
+    implementations that have not been yet.
+    """
+    out = []
+    for name in names():
+        load(name)
+        entry = _entries[name]
+        info = capabilities(name)
+        del info['supports']
+        info['native_mcf'] = [p.decode('ascii') for p in info['native_mcf']]
+        info.update({
+            'name': name,
+            'module': entry['module'],
+            'available': entry['loaded'] is not None,
+            'load_time': entry['load_time'],
+            'error': entry['error'],
+        })
+        out.append(info)
+    return out
+
+
+# The built-in implementations, in the order of preference of the package
+_BUILTIN = (
+    ('hashlibscrypt', {
+        'releases_gil': True,
+        'limits': 'N < 2**(16*r), less than 2 GiB of memory',
+    }),
+    ('pylibscrypt', {
+        'releases_gil': True,
+        'native_mcf': (SCRYPT_MCF_PREFIX_s1,),
+        'limits': 'native MCF only for 124 byte $s1$ hashes',
+    }),
+    ('pyscrypt', {'releases_gil': True}),
+    ('pylibsodium', {'releases_gil': True}),
+    ('numpyscrypt', {'pure_python': True}),
+    ('pypyscrypt_inline', {'pure_python': True}),
+    ('pypyscrypt', {'pure_python': True}),
+)
+for _name, _capabilities in _BUILTIN:
+    register(_name, 'pylibscrypt.' + _name, **_capabilities)
+
+
+__all__ = ['register', 'unregister', 'names', 'capabilities', 'load',
+           'backends']
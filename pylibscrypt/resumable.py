@@ -0,0 +1,267 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Scrypt derivations that can be checkpointed and resumed (Python 3)
+
+Derivation runs the pure Python SMix in steps. Its state, i.e. the lane, the
+ROMix phase and loop counter, X and V, can be saved to a checkpoint file and
+the derivation resumed from it later, with the same result. V is kept in a
+memory map of the file path + '.v' while the derivation runs.
+
+scrypt_resumable() is the simple way to use it:
+    key = scrypt_resumable(password, salt, 2**22, 8, 1, path='key.ckpt')
+If killed, calling it again with the same arguments continues from the last
+checkpoint.
+
+The password is not saved, but the checkpoint allows guessing it much faster
+than scrypt does. Keep checkpoint files as secret as the password.
+"""
+
+
+import base64
+from hashlib import pbkdf2_hmac as _pbkdf2
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import time
+
+from . import pypyscrypt_inline as scr_mod
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, check_args, to_bytes, xrange)
+
+
+# Format of the checkpoint file
+_VERSION = 1
+
+# ROMix iterations run between checks of the checkpoint interval
+_STEP = 64
+
+# ROMix phases: filling V (steps 2-4) and mixing with it (steps 6-9)
+FILL = 1
+MIX = 2
+
+
+def _b64(b):
+    return base64.b64encode(b).decode('ascii')
+
+
+def _verifier(password, salt):
+    return hmac.new(password, b'pylibscrypt checkpoint ' + salt,
+                    hashlib.sha256).digest()
+
+
+def _open_v(path, size, create):
+    flags = os.O_RDWR | (os.O_CREAT if create else 0)
+    fd = os.open(path, flags, 0o600)
+    try:
+        if create:
+            os.ftruncate(fd, size)
+        elif os.fstat(fd).st_size != size:
+            raise ValueError('V file does not match the checkpoint')
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class Derivation(object):
+    """A scrypt derivation that runs in steps and can be checkpointed
+
+    State:
+    lane     -- index of the lane SMix is running on, p when done
+    phase    -- FILL or MIX
+    counter  -- ROMix loop counter of the phase
+    X        -- copy of the 32*r words of X
+    V        -- memoryview of the N*32*r words of V
+    """
+
+    def __init__(self, password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                 olen=64, path=None, _state=None):
+        if not hasattr(memoryview, 'cast'):
+            raise ValueError('resumable derivations need Python 3')
+        check_args(password, salt, N, r, p, olen)
+        if path is None:
+            raise ValueError('a checkpoint path is needed')
+        self.password, self.salt = password, to_bytes(salt)
+        self.N, self.r, self.p, self.olen = N, r, p, olen
+        self.path = path
+
+        n = 32 * r
+        self.XY = scr_mod.words(None, 2 * n)
+        if _state is None:
+            self.B = scr_mod.words(_pbkdf2('sha256', password, salt, 1,
+                                           p * 4 * n))
+            self.lane, self.phase, self.counter = 0, FILL, 0
+            self.XY[0:n] = self.B[0:n]
+        else:
+            self.B = scr_mod.words(base64.b64decode(_state['B']))
+            self.lane = _state['lane']
+            self.phase = _state['phase']
+            self.counter = _state['counter']
+            self.XY[0:n] = scr_mod.words(base64.b64decode(_state['X']))
+        try:
+            self._map = _open_v(path + '.v', 4 * n * N, _state is None)
+        except OverflowError:
+            raise ValueError("scrypt parameters don't fit in memory")
+        self.V = memoryview(self._map).cast(scr_mod._WORD)
+        self.last_checkpoint = None if _state is None else time.time()
+
+    @classmethod
+    def resume(cls, path, password):
+        """Returns the derivation saved in the checkpoint file at path
+
+        Raises ValueError if the password is not the one it was started with.
+        """
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('version') != _VERSION:
+            raise ValueError('Unsupported checkpoint version')
+        salt = base64.b64decode(state['salt'])
+        expected = base64.b64decode(state['verifier'])
+        if not hmac.compare_digest(_verifier(password, salt), expected):
+            raise ValueError('password does not match the checkpoint')
+        return cls(password, salt, state['N'], state['r'], state['p'],
+                   state['olen'], path, state)
+
+    @property
+    def done(self):
+        return self.lane >= self.p
+
+    @property
+    def X(self):
+        return self.XY[0:32 * self.r].tolist()
+
+    def step(self, count=_STEP):
+        """Runs up to count ROMix iterations, returns True when done"""
+        N, r = self.N, self.r
+        n = 32 * r
+        XY, V, B = self.XY, self.V, self.B
+        blockmix_salsa8 = scr_mod.blockmix_salsa8
+        while count > 0 and not self.done:
+            k = self.counter
+            end = min(N, k + count)
+            if self.phase == FILL:
+                for i in xrange(k, end):                     # ROMix - 2
+                    V[i * n:(i + 1) * n] = XY[0:n]           # ROMix - 3
+                    blockmix_salsa8(XY, n, r)                # ROMix - 4
+            else:
+                for i in xrange(k, end):                     # ROMix - 6
+                    j = scr_mod.integerify(XY, r) & (N - 1)  # ROMix - 7
+                    scr_mod.blockxor(V, j * n, XY, 0, n)     # ROMix - 8
+                    blockmix_salsa8(XY, n, r)                # ROMix - 9
+            count -= end - k
+            self.counter = end
+            if end < N:
+                continue
+
+            if self.phase == FILL:
+                self.phase, self.counter = MIX, 0
+                continue
+            Bi = self.lane * n
+            B[Bi:Bi + n] = XY[0:n]                           # ROMix - 10
+            self.lane += 1
+            self.phase, self.counter = FILL, 0
+            if not self.done:
+                XY[0:n] = B[Bi + n:Bi + 2 * n]               # ROMix - 1
+                # The next lane overwrites V, which the last checkpoint needs
+                if self.last_checkpoint is not None:
+                    self.checkpoint()
+        return self.done
+
+    def checkpoint(self):
+        """Saves the state to the checkpoint file"""
+        n = 32 * self.r
+        self._map.flush()
+        state = {
+            'version': _VERSION,
+            'N': self.N,
+            'r': self.r,
+            'p': self.p,
+            'olen': self.olen,
+            'salt': _b64(self.salt),
+            'verifier': _b64(_verifier(self.password, self.salt)),
+            'lane': self.lane,
+            'phase': self.phase,
+            'counter': self.counter,
+            'X': _b64(scr_mod.words_to_bytes(self.XY[0:n])),
+            'B': _b64(scr_mod.words_to_bytes(self.B)),
+        }
+        tmp = '%s.%d' % (self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        self.last_checkpoint = time.time()
+
+    def run(self, interval=None):
+        """Runs to the end, checkpointing every interval seconds if given"""
+        if interval is not None and self.last_checkpoint is None:
+            self.checkpoint()
+        while not self.step():
+            if (interval is not None and
+                    time.time() - self.last_checkpoint >= interval):
+                self.checkpoint()
+        return self.result()
+
+    def result(self):
+        """Returns the derived key; the derivation must be done"""
+        if not self.done:
+            raise ValueError('derivation is not done')
+        B = scr_mod.words_to_bytes(self.B)
+        return _pbkdf2('sha256', self.password, B, 1, self.olen)
+
+    def close(self):
+        """Unmaps V, keeping the files"""
+        if self._map is not None:
+            self.V.release()
+            self._map.close()
+            self._map = None
+
+    def remove(self):
+        """Unmaps V and deletes the files"""
+        self.close()
+        for path in (self.path, self.path + '.v'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def scrypt_resumable(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+                     olen=64, path=None, interval=60):
+    """Returns a key derived using scrypt, checkpointing to path as it runs
+
+    If a checkpoint exists at path, continues from it. The files are deleted
+    once the key is derived. See pylibscrypt.scrypt for the parameters.
+    """
+    if path is not None and os.path.exists(path):
+        d = Derivation.resume(path, password)
+        if (d.salt, d.N, d.r, d.p, d.olen) != (to_bytes(salt), N, r, p, olen):
+            d.close()
+            raise ValueError('parameters do not match the checkpoint')
+    else:
+        d = Derivation(password, salt, N, r, p, olen, path)
+    try:
+        key = d.run(interval)
+    except:
+        d.close()
+        raise
+    d.remove()
+    return key
+
+
+__all__ = ['Derivation', 'scrypt_resumable', 'FILL', 'MIX']
@@ -0,0 +1,175 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Scrypt that picks the implementation for each call
+
+Each call goes to the fastest native implementation whose supports function
+accepts its parameters. E.g. hashlib refuses N of 2**(16*r) or more and calls
+needing 2 GiB, and older libsodium anything but r=8 and p a power of two.
+Only if no native implementation can serve the call is it computed with
+numpy, for many lanes, or pure Python.
+
+The fastest is the first in the ranking pylibscrypt.autoselect has cached for
+this host and the parameters, or else the one it calibrated most recently.
+The router doesn't calibrate itself, so without a cached ranking it goes by
+the order of pylibscrypt.registry, as do implementations left out of the
+ranking. The cache is read again when the registry changes.
+
+The package uses this with PYLIBSCRYPT_BACKEND=router.
+"""
+
+
+import platform
+import threading
+
+from . import autoselect
+from . import mcf as mcf_mod
+from . import registry
+from .common import (
+    SCRYPT_N, SCRYPT_r, SCRYPT_p, SCRYPT_MCF_PREFIX_DEFAULT, check_args,
+    out_view)
+from .common import scrypt_into as _scrypt_into
+
+
+# Routes remembered, by N, r, p and salt length
+_ROUTES_SIZE = 1024
+
+_native = None
+_rankings = None
+_version = None
+_routes = {}
+_lock = threading.Lock()
+
+
+def _load():
+    global _native, _rankings, _version
+    with _lock:
+        if _native is None or _version != registry.version:
+            native = []
+            for name in registry.names():
+                if registry.capabilities(name)['pure_python']:
+                    continue
+                module = registry.load(name)
+                if module is not None:
+                    # Loading registered the rest of the capabilities
+                    supports = registry.capabilities(name)['supports']
+                    native.append((module, supports, name))
+            _native = native
+            _rankings = autoselect.load_cache().get(autoselect.host_key())
+            _version = registry.version
+            _routes.clear()
+    return _native
+
+
+def _ranked(N, r, p):
+    # The native implementations, fastest first by the cached ranking
+    native = _load()
+    rankings = _rankings
+    if not rankings:
+        return native
+    try:
+        entry = rankings.get('%d,%d,%d' % (N, r, p))
+        if entry is None:
+            entry = max(rankings.values(), key=lambda e: e.get('time', 0))
+        order = dict((name, i) for i, (t, name) in enumerate(entry['ranking']))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return native
+    return sorted(native, key=lambda n: order.get(n[2], len(order)))
+
+
+def _fallback(p):
+    if platform.python_implementation() != 'PyPy':
+        try:
+            from . import numpyscrypt
+            if p >= numpyscrypt._MIN_LANES:
+                return numpyscrypt
+        except ImportError:
+            pass
+    from . import pypyscrypt_inline
+    return pypyscrypt_inline
+
+
+def route(N, r, p, salt_len=16):
+    """Returns the implementation module calls with the parameters go to"""
+    key = (N, r, p, salt_len)
+    module = _routes.get(key)
+    if module is not None and _version == registry.version:
+        return module
+    for module, supports, name in _ranked(N, r, p):
+        if supports is None or supports(N, r, p, salt_len):
+            break
+    else:
+        module = _fallback(p)
+    if len(_routes) < _ROUTES_SIZE:
+        _routes[key] = module
+    return module
+
+
+def scrypt(password, salt, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p, olen=64,
+           deadline=None):
+    """Returns a key derived using the scrypt key-derivarion function
+
+    Computed by the implementation route() picks for the parameters. See
+    pylibscrypt.scrypt for the rest.
+    """
+    check_args(password, salt, N, r, p, olen)
+    module = route(N, r, p, len(salt))
+    if deadline is None:
+        # Registered implementations need not take a deadline
+        return module.scrypt(password, salt, N, r, p, olen)
+    return module.scrypt(password, salt, N, r, p, olen, deadline=deadline)
+
+
+def scrypt_into(password, salt, out, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p):
+    """Writes a key derived using scrypt into the writable buffer out
+
+    The key is as long as out. See scrypt for the parameters.
+    """
+    view = out_view(out)
+    check_args(password, salt, N, r, p, len(view))
+    module = route(N, r, p, len(salt))
+    into = getattr(module, 'scrypt_into', None)
+    if into is None:
+        _scrypt_into(module.scrypt, password, salt, view, N, r, p)
+    else:
+        into(password, salt, view, N, r, p)
+
+
+def scrypt_mcf(password, salt=None, N=SCRYPT_N, r=SCRYPT_r, p=SCRYPT_p,
+               prefix=SCRYPT_MCF_PREFIX_DEFAULT):
+    """Derives a Modular Crypt Format hash using the scrypt KDF
+
+    Parameter space is smaller than for scrypt():
+    N must be a power of two larger than 1 but no larger than 2 ** 31
+    r and p must be positive numbers between 1 and 255
+    Salt must be a byte string 1-16 bytes long.
+
+    If no salt is given, a random salt of 128+ bits is used. (Recommended.)
+    """
+    return mcf_mod.scrypt_mcf(scrypt, password, salt, N, r, p, prefix)
+
+
+def scrypt_mcf_check(mcf, password):
+    """Returns True if the password matches the given MCF hash"""
+    return mcf_mod.scrypt_mcf_check(scrypt, mcf, password)
+
+
+__all__ = ['scrypt', 'scrypt_into', 'scrypt_mcf', 'scrypt_mcf_check',
+           'route']
+
+
+if __name__ == "__main__":
+    import sys
+    from . import tests
+    tests.run_scrypt_suite(sys.modules[__name__])
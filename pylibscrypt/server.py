@@ -0,0 +1,486 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Scrypt daemon shared by the processes of a host (Python 3)
+
+Run as: python -m pylibscrypt.server [options] address, see --help.
+
+Listens on a Unix socket or a loopback TCP port for the requests of
+pylibscrypt.client, which has the protocol, and runs them on a pool of a fixed
+size over the implementation of the package. All hashing on the host then
+shares one bound on concurrency and, with --memory, on memory.
+
+Requests wait in one queue per client, which is the peer process on Unix
+sockets where the OS tells it and the connection otherwise. Workers take
+requests from the clients in turn, so one busy client cannot starve the rest.
+A request beyond the limit of its client or of all queues is refused at once
+with ServerBusy.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import ipaddress
+import os
+import signal
+import socket
+import stat
+import struct
+import threading
+
+import pylibscrypt
+from . import admission, batch, registry
+from .admission import set_memory_budget
+from .client import (
+    MAX_MESSAGE, ServerBusy, b64, recv_message, send_message, unb64)
+from .common import TimeoutError, scrypt_memory
+from .deadline import Deadline
+from .mcf import ScryptHash
+
+
+# Requests that may wait in all queues, and in the queue of one client
+MAX_QUEUE = 1024
+CLIENT_QUEUE = 64
+
+# Seconds between checks for shutdown while accepting connections
+_POLL = 0.5
+
+_OPS = ('scrypt', 'scrypt_mcf', 'scrypt_mcf_check', 'stats')
+
+
+class _Scheduler(object):
+    # Per-client queues of requests, served in turn
+
+    def __init__(self, max_queue, client_queue):
+        self.max_queue = max_queue
+        self.client_queue = client_queue
+        self._queues = {}
+        self._turns = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, client, item):
+        """Queues an item of client, returns False if the queues are full"""
+        with self._cond:
+            queue = self._queues.get(client)
+            if (self._size >= self.max_queue or
+                    (queue is not None and len(queue) >= self.client_queue)):
+                return False
+            if queue is None:
+                queue = self._queues[client] = deque()
+                self._turns.append(client)
+            queue.append(item)
+            self._size += 1
+            self._cond.notify()
+            return True
+
+    def get(self):
+        """Returns the next item, waiting for one, or None once closed"""
+        with self._cond:
+            while not self._turns and not self._closed:
+                self._cond.wait()
+            if not self._turns:
+                return None
+            client = self._turns.popleft()
+            queue = self._queues[client]
+            item = queue.popleft()
+            self._size -= 1
+            if queue:
+                self._turns.append(client)
+            else:
+                del self._queues[client]
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return self._size
+
+    def clients(self):
+        with self._cond:
+            return len(self._queues)
+
+
+class _Connection(object):
+    # A client connection and the lock its responses are sent under
+
+    def __init__(self, sock, client):
+        self.sock = sock
+        self.client = client
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            send_message(self.sock, message, self.lock)
+        except OSError:
+            self.closed = True
+
+
+def _peer_pid(sock):
+    try:
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize('3i'))
+    except (AttributeError, OSError):
+        return None
+    return struct.unpack('3i', creds)[0] or None
+
+
+def _listen(address, mode):
+    if isinstance(address, tuple):
+        host, port = address
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        for info in infos:
+            if not ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback:
+                raise ValueError('only loopback addresses can be served')
+        family, type_, proto, _, sockaddr = infos[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    else:
+        if os.path.exists(address):
+            if not stat.S_ISSOCK(os.stat(address).st_mode):
+                raise ValueError('%s exists and is not a socket' % address)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+            except OSError:
+                os.remove(address)
+            else:
+                raise ValueError('a server is running at %s' % address)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sockaddr = address
+    try:
+        if isinstance(address, tuple):
+            sock.bind(sockaddr)
+        else:
+            # The socket is created with the mode, so it is never more open
+            umask = os.umask(0o777 & ~mode)
+            try:
+                sock.bind(sockaddr)
+            finally:
+                os.umask(umask)
+        sock.listen(128)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def _call(op, args, timeout, admitted=False):
+    # Runs in a worker thread or process; for a process, the server has
+    # reserved the memory already
+    func = getattr(pylibscrypt, op)
+    if not admitted:
+        return func(*args, deadline=timeout)
+    admission._local.depth = 1
+    try:
+        return func(*args, deadline=timeout)
+    finally:
+        admission._local.depth = 0
+
+
+def _memory(op, args):
+    # Bytes a request needs, or 0 if its parameters are invalid, leaving
+    # the error to the call
+    try:
+        if op == 'scrypt_mcf_check':
+            h = ScryptHash.parse(args[0])
+            N, r, p = h.N, h.r, h.p
+        else:
+            N, r, p = args[2:5]
+        return max(0, scrypt_memory(N, r, p))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Server(object):
+    """Scrypt daemon listening at an address
+
+    address       -- Unix socket path, or (host, port) of a loopback address;
+                     port 0 picks a free one, see the address attribute
+    workers       -- requests run at a time, by default the number of cores
+    max_queue     -- requests that may wait in all, beyond those running
+    client_queue  -- requests that may wait per client
+    mode          -- permissions of a Unix socket
+
+    Pure Python implementations run in as many worker processes, the others
+    in threads, as they release the GIL.
+    """
+
+    def __init__(self, address, workers=None, max_queue=MAX_QUEUE,
+                 client_queue=CLIENT_QUEUE, mode=0o600):
+        if workers is not None and workers < 1:
+            raise ValueError('workers must be positive')
+        if max_queue < 1 or client_queue < 1:
+            raise ValueError('queue limits must be positive')
+        self.workers = workers or batch.get_pool_size()
+        self._sock = _listen(address, mode)
+        self.address = self._sock.getsockname()
+        if isinstance(address, tuple):
+            self.address = self.address[:2]
+        self._scheduler = _Scheduler(max_queue, client_queue)
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+        self._connections = set()
+        self._threads = []
+        self._executor = None
+        self._next_client = 0
+        self.running = 0
+        self.served = 0
+        self.refused = 0
+
+        backend = pylibscrypt.backend_info()['backend']
+        if (backend in registry.names() and
+                registry.capabilities(backend)['pure_python']):
+            self._executor = ProcessPoolExecutor(self.workers)
+
+    def stats(self):
+        """Returns a dict describing the load of the server
+
+        backend    -- module name of the implementation
+        workers    -- requests run at a time
+        running    -- requests running
+        queued     -- requests waiting
+        clients    -- clients with requests waiting
+        served     -- requests answered in total
+        refused    -- requests refused as the queues were full
+        """
+        with self._lock:
+            return {
+                'backend': pylibscrypt.backend_info()['backend'],
+                'workers': self.workers,
+                'running': self.running,
+                'queued': len(self._scheduler),
+                'clients': self._scheduler.clients(),
+                'served': self.served,
+                'refused': self.refused,
+            }
+
+    def serve_forever(self):
+        """Serves requests until shutdown() is called"""
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        self._sock.settimeout(_POLL)
+        try:
+            while not self._shutdown.is_set():
+                try:
+                    sock, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    if self._shutdown.is_set():
+                        break
+                    raise
+                sock.settimeout(None)
+                t = threading.Thread(target=self._read, args=(sock,))
+                t.daemon = True
+                t.start()
+        finally:
+            self._close()
+
+    def shutdown(self):
+        """Stops serving; requests waiting are dropped"""
+        self._shutdown.set()
+
+    def _close(self):
+        self._scheduler.close()
+        self._sock.close()
+        if not isinstance(self.address, tuple):
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            conn.closed = True
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for t in self._threads:
+            t.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _read(self, sock):
+        client = None
+        if sock.family == socket.AF_UNIX:
+            pid = _peer_pid(sock)
+            if pid is not None:
+                client = ('pid', pid)
+        with self._lock:
+            if client is None:
+                self._next_client += 1
+                client = ('connection', self._next_client)
+            conn = _Connection(sock, client)
+            self._connections.add(conn)
+        try:
+            while not conn.closed:
+                try:
+                    message = recv_message(sock, MAX_MESSAGE)
+                except (OSError, ValueError):
+                    break
+                if message is None:
+                    break
+                self._accept(conn, message)
+        finally:
+            conn.closed = True
+            with self._lock:
+                self._connections.discard(conn)
+            sock.close()
+
+    def _accept(self, conn, message):
+        id = message.get('id')
+        op = message.get('op')
+        if op not in _OPS:
+            conn.send({'id': id, 'error': 'ValueError',
+                       'message': 'unknown op %r' % (op,)})
+            return
+        if op == 'stats':
+            conn.send({'id': id, 'result': self.stats()})
+            return
+        timeout = message.get('timeout')
+        deadline = None
+        if isinstance(timeout, (int, float)) and not isinstance(timeout, bool):
+            deadline = Deadline(timeout)
+        if not self._scheduler.put(conn.client, (conn, message, deadline)):
+            with self._lock:
+                self.refused += 1
+            conn.send({'id': id, 'error': 'ServerBusy',
+                       'message': 'too many requests waiting'})
+
+    def _work(self):
+        while True:
+            item = self._scheduler.get()
+            if item is None:
+                return
+            conn, message, deadline = item
+            if conn.closed:
+                continue
+            with self._lock:
+                self.running += 1
+            try:
+                response = {'id': message.get('id'),
+                            'result': self._run(message, deadline)}
+            except (TypeError, ValueError, TimeoutError) as e:
+                response = {'id': message.get('id'),
+                            'error': e.__class__.__name__, 'message': str(e)}
+            except Exception as e:
+                response = {'id': message.get('id'), 'error': 'ServerError',
+                            'message': '%s: %s' % (e.__class__.__name__, e)}
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.served += 1
+            conn.send(response)
+
+    def _run(self, message, deadline):
+        op = message['op']
+        try:
+            if op == 'scrypt':
+                args = (unb64(message['password']), unb64(message['salt']),
+                        message['N'], message['r'], message['p'],
+                        message['olen'])
+            elif op == 'scrypt_mcf':
+                salt = message['salt']
+                prefix = message['prefix']
+                args = (unb64(message['password']),
+                        None if salt is None else unb64(salt),
+                        message['N'], message['r'], message['p'],
+                        None if prefix is None else prefix.encode('ascii'))
+            else:
+                args = (message['mcf'].encode('ascii'),
+                        unb64(message['password']))
+        except KeyError as e:
+            raise ValueError('missing argument %s' % e)
+        except AttributeError:
+            raise TypeError('invalid argument')
+
+        if deadline is not None:
+            deadline.check()
+        if self._executor is not None:
+            # Worker processes have budgets of their own, so the memory is
+            # reserved here
+            with admission.reserve(_memory(op, args), deadline):
+                timeout = None if deadline is None else deadline.remaining()
+                result = self._executor.submit(_call, op, args, timeout,
+                                               True).result()
+        else:
+            result = _call(op, args, deadline)
+
+        if op == 'scrypt':
+            return b64(result)
+        if op == 'scrypt_mcf':
+            return result.decode('ascii')
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pylibscrypt.server',
+        description='Serves scrypt to the processes of this host.')
+    parser.add_argument('address',
+                        help='Unix socket path, or host:port of a loopback '
+                             'address to listen at')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='requests run at a time, default the number of '
+                             'cores')
+    parser.add_argument('-q', '--max-queue', type=int, default=MAX_QUEUE,
+                        help='requests that may wait in all (%(default)s)')
+    parser.add_argument('-c', '--client-queue', type=int,
+                        default=CLIENT_QUEUE,
+                        help='requests that may wait per client '
+                             '(%(default)s)')
+    parser.add_argument('-m', '--memory', type=int, default=None,
+                        help='bytes the running requests may use, default '
+                             'half of the cgroup memory limit')
+    parser.add_argument('--mode', type=lambda s: int(s, 8), default=0o600,
+                        help='permissions of a Unix socket (600)')
+    args = parser.parse_args(argv)
+
+    from .client import parse_address
+    address = parse_address(args.address)
+    if args.memory is not None:
+        set_memory_budget(args.memory)
+    server = Server(address, args.workers, args.max_queue, args.client_queue,
+                    args.mode)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    print('serving %s at %s with %d workers' % (
+        pylibscrypt.backend_info()['backend'], args.address, server.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+__all__ = ['Server']
+
+
+if __name__ == "__main__":
+    main()
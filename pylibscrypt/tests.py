@@ -14,6 +14,7 @@
 
 """Tests scrypt and PBKDF2 implementations"""
 
+from __future__ import absolute_import
 
 import base64
 import hashlib
@@ -171,6 +172,40 @@ class ScryptTests(unittest.TestCase):
         self.assertRaisesRegexp(TypeError, 'salt',
                                 self.module.scrypt, b'pass', None)
 
+    def test_buffers(self):
+        import array
+        import mmap
+        if not hasattr(memoryview, 'cast'):
+            self.skipTest('no memoryview.cast')
+        pw, s, N = b'password', b'NaCl', 2
+        h = self.module.scrypt(pw, s, N, olen=42)
+        for bpw, bs in ((bytearray(pw), bytearray(s)),
+                        (memoryview(b'x' + pw)[1:], memoryview(s)),
+                        (memoryview(bytearray(pw)), s)):
+            self.assertEqual(self.module.scrypt(bpw, bs, N, olen=42), h)
+        m = mmap.mmap(-1, len(pw))
+        try:
+            m[:] = pw
+            self.assertEqual(self.module.scrypt(m, s, N, olen=42), h)
+            with memoryview(m) as mv:
+                self.assertEqual(self.module.scrypt(mv, s, N, olen=42), h)
+        finally:
+            m.close()
+        self.assertRaises(TypeError, self.module.scrypt,
+                          memoryview(pw)[::2], s, N)
+        self.assertRaises(TypeError, self.module.scrypt,
+                          array.array('I', [1, 2]), s, N)
+
+        mcf = self.module.scrypt_mcf(bytearray(pw), bytearray(s), N)
+        self.assertEqual(mcf, self.module.scrypt_mcf(pw, s, N))
+        self.assertTrue(self.module.scrypt_mcf_check(mcf, bytearray(pw)))
+        self.assertTrue(self.module.scrypt_mcf_check(mcf, memoryview(pw)))
+        self.assertFalse(self.module.scrypt_mcf_check(mcf, bytearray(s)))
+        self.assertRaises(ValueError, self.module.scrypt_mcf,
+                          bytearray(b'pass\0word'), s, N)
+        self.assertRaises(ValueError, self.module.scrypt_mcf,
+                          memoryview(b'pass\0word'), s, N)
+
     def test_mcf_types_enforced(self):
         self.assertRaisesRegexp(TypeError, 'password',
                                 self.module.scrypt_mcf, object)
@@ -242,6 +277,24 @@ class ScryptTests(unittest.TestCase):
         self.assertRaises(TypeError, self.module.scrypt, pw, s, N, olen=b'7')
         self.assertRaises(ValueError, self.module.scrypt, pw, s, N, olen=-1)
 
+    def test_scrypt_into(self):
+        pw, s, N = b'password', b'salt', 2
+        out = bytearray(42)
+        self.assertEqual(self.module.scrypt_into(pw, s, out, N), None)
+        self.assertEqual(bytes(out), self.module.scrypt(pw, s, N, olen=42))
+        out = bytearray(100)
+        self.module.scrypt_into(pw, s, memoryview(out)[10:90], N, 2, 2)
+        self.assertEqual(bytes(out[10:90]),
+                         self.module.scrypt(pw, s, N, 2, 2, 80))
+        self.assertEqual(bytes(out[:10] + out[90:]), b'\0' * 20)
+        self.assertRaises(TypeError, self.module.scrypt_into, pw, s,
+                          b'\0' * 42, N)
+        self.assertRaises(TypeError, self.module.scrypt_into, pw, s, 42, N)
+        self.assertRaises(TypeError, self.module.scrypt_into, u'pw', s,
+                          bytearray(42), N)
+        self.assertRaises(ValueError, self.module.scrypt_into, pw, s,
+                          bytearray(42), 3)
+
     def test_mcf(self):
         pw = b'password'
         self.assertRaises(ValueError, self.module.scrypt_mcf_check, b'', pw)
@@ -347,6 +400,16 @@ class ScryptTests(unittest.TestCase):
         self.assertTrue(self.module.scrypt_mcf_check(m1, p))
         self.assertTrue(self.module.scrypt_mcf_check(m2, p))
 
+    def test_mcf_parsed(self):
+        from .mcf import ScryptHash
+        pw = b'pass'
+        for prefix in (b'$s1$', b'$7$'):
+            m = self.module.scrypt_mcf(pw, N=4, prefix=prefix)
+            m = ScryptHash.parse(m)
+            self.assertTrue(self.module.scrypt_mcf_check(m, pw))
+            self.assertFalse(self.module.scrypt_mcf_check(m, b'x' + pw))
+        self.assertRaises(TypeError, self.module.scrypt_mcf_check, m, 42)
+
     def test_mcf_utf(self):
         p, u = b'pass', u'pass'
         u2 = u'\xe5\xe4\xf6'
@@ -374,6 +437,1393 @@ class ScryptTests(unittest.TestCase):
         self.assertTrue(self.module.scrypt_mcf_check(m2, pw))
 
 
+class ScryptManyTests(unittest.TestCase):
+    """Tests the batched functions of a module against its scrypt"""
+    module = None
+
+    def setUp(self):
+        if not self.module:
+            self.skipTest('module not tested')
+
+    def test_scrypt_many(self):
+        pws = [b'password', b'', b'pa\0ss', b'password']
+        salts = [b'NaCl', b'salt', b'', b'NaCl']
+        for N, r, p in ((2, 1, 1), (16, 2, 3), (4, 1, 8)):
+            self.assertEqual(
+                self.module.scrypt_many(pws, salts, N, r, p, 42),
+                [self.module.scrypt(pw, s, N, r, p, 42)
+                 for pw, s in zip(pws, salts)]
+            )
+        self.assertEqual(self.module.scrypt_many([], [], 2), [])
+
+    def test_scrypt_many_invalid(self):
+        self.assertRaises(ValueError, self.module.scrypt_many,
+                          [b'pw'], [b'salt', b'salt'], 2)
+        self.assertRaises(TypeError, self.module.scrypt_many,
+                          [b'pw', u'pw'], [b'salt', b'salt'], 2)
+        self.assertRaises(ValueError, self.module.scrypt_many,
+                          [b'pw'], [b'salt'], 3)
+
+    def test_mcf_check_many(self):
+        pws = [b'pass', u'\xe5\xe4\xf6', b'pass', b'word']
+        mcfs = [
+            self.module.scrypt_mcf(b'pass', N=4),
+            self.module.scrypt_mcf(u'\xe5\xe4\xf6', N=4),
+            self.module.scrypt_mcf(b'pass', N=8, prefix=b'$7$'),
+            self.module.scrypt_mcf(b'pass', N=4, r=2),
+        ]
+        self.assertEqual(self.module.scrypt_mcf_check_many(mcfs, pws),
+                         [True, True, True, False])
+        self.assertRaises(TypeError, self.module.scrypt_mcf_check_many,
+                          [u'mcf'], [b'pass'])
+        self.assertRaises(ValueError, self.module.scrypt_mcf_check_many,
+                          [b'$s1$ffffffff$aaaa$bbbb'], [b'pass'])
+        self.assertRaises(ValueError, self.module.scrypt_mcf_check_many,
+                          mcfs, pws[1:])
+
+
+class ScryptWorkersTests(unittest.TestCase):
+    """Tests the lanes of a module computed in worker processes"""
+    module = None
+
+    def setUp(self):
+        if not self.module:
+            self.skipTest('module not tested')
+
+    def test_workers(self):
+        pw, s = b'password', b'NaCl'
+        for N, r, p, workers in ((2, 1, 2, 2), (16, 2, 3, 2), (4, 1, 4, 3)):
+            self.assertEqual(
+                self.module.scrypt(pw, s, N, r, p, workers=workers),
+                self.module.scrypt(pw, s, N, r, p)
+            )
+        self.assertEqual(self.module.scrypt(pw, s, 4, 1, 1, 42, workers=2),
+                         self.module.scrypt(pw, s, 4, 1, 1, 42))
+
+    def test_workers_concurrent(self):
+        import threading
+        pw, s = b'password', b'NaCl'
+        h = self.module.scrypt(pw, s, 16, 2, 6)
+        results = []
+        def run(workers):
+            for i in range(5):
+                results.append(
+                    self.module.scrypt(pw, s, 16, 2, 6, workers=workers))
+        threads = [threading.Thread(target=run, args=(w,))
+                   for w in (2, 3, 2, 3)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join(60)
+            self.assertFalse(t.is_alive())
+        self.assertEqual(results, [h] * 20)
+
+    def test_workers_deadline(self):
+        import multiprocessing, time
+        from .common import TimeoutError
+        pw, s = b'password', b'NaCl'
+        before = set(multiprocessing.active_children())
+        start = time.time()
+        self.assertRaises(TimeoutError, self.module.scrypt, pw, s, 2**14, 8,
+                          4, workers=5, deadline=0.1)
+        self.assertTrue(time.time() - start < 5)
+        # The workers are gone once the call returns
+        self.assertEqual(set(multiprocessing.active_children()) - before,
+                         set())
+        self.assertEqual(self.module.scrypt(pw, s, 16, 2, 3, workers=2,
+                                            deadline=30),
+                         self.module.scrypt(pw, s, 16, 2, 3))
+
+    def test_vstore_mmap(self):
+        import tempfile
+        if not hasattr(memoryview, 'cast'):
+            self.skipTest('no memoryview.cast')
+        pw, s = b'password', b'NaCl'
+        h = self.module.scrypt(pw, s, 16, 2, 2, 42)
+        self.assertEqual(self.module.scrypt(pw, s, 16, 2, 2, 42,
+                                            vstore='mmap'), h)
+        self.assertEqual(self.module.scrypt(pw, s, 16, 2, 2, 42,
+                                            vstore='mmap',
+                                            vpath=tempfile.gettempdir()), h)
+        self.assertEqual(self.module.scrypt(pw, s, 16, 2, 2, 42, workers=2,
+                                            vstore='mmap'), h)
+        self.assertRaises(ValueError, self.module.scrypt, pw, s, 16,
+                          vstore='disk')
+
+    def test_words(self):
+        b = b'\x01\x00\x00\x00\xff\xff\xff\xff'
+        a = self.module.words(b)
+        self.assertEqual(list(a), [1, 0xffffffff])
+        self.assertEqual(self.module.words_to_bytes(a), b)
+        self.assertEqual(list(self.module.words(None, 3)), [0, 0, 0])
+
+    def test_workers_memory(self):
+        self.assertRaises(ValueError, self.module.scrypt,
+                          b'password', b'NaCl', 2**40, 8, 2, workers=2)
+
+
+class ScryptBatchTests(unittest.TestCase):
+    """Tests the thread pool batch functions of the package"""
+
+    def setUp(self):
+        import pylibscrypt
+        if not hasattr(pylibscrypt, 'scrypt_batch'):
+            self.skipTest('no concurrent.futures')
+
+    def tearDown(self):
+        import pylibscrypt
+        pylibscrypt.set_pool_size()
+
+    def test_batch(self):
+        import pylibscrypt
+        pws = [b'pw%d' % i for i in range(10)]
+        salts = [b'salt%d' % i for i in range(10)]
+        hs = pylibscrypt.scrypt_batch(pws, salts, 4, 2, 2, 42)
+        self.assertEqual(hs, [pylibscrypt.scrypt(pw, s, 4, 2, 2, 42)
+                              for pw, s in zip(pws, salts)])
+        self.assertRaises(ValueError, pylibscrypt.scrypt_batch, pws, [], 4)
+        self.assertRaises(TypeError, pylibscrypt.scrypt_batch, [u'pw'], [b''])
+
+    def test_mcf_batch(self):
+        import pylibscrypt
+        pylibscrypt.set_pool_size(3)
+        self.assertEqual(pylibscrypt.get_pool_size(), 3)
+        pws = [b'pw%d' % i for i in range(10)]
+        mcfs = pylibscrypt.scrypt_mcf_batch(pws, N=4)
+        self.assertEqual(len(set(mcfs)), 10)
+        mcfs2 = pylibscrypt.scrypt_mcf_batch(pws, [b'salt'] * 10, N=4,
+                                             prefix=b'$7$')
+        self.assertEqual(mcfs2[0], pylibscrypt.scrypt_mcf(
+            b'pw0', b'salt', N=4, prefix=b'$7$'))
+        self.assertEqual(
+            pylibscrypt.scrypt_mcf_check_batch(mcfs + mcfs2, pws + pws[::-1]),
+            [True] * 10 + [False] * 10
+        )
+        self.assertRaises(ValueError, pylibscrypt.set_pool_size, 0)
+
+    def test_resize_while_running(self):
+        import threading
+        import pylibscrypt
+        errors = []
+        def run():
+            try:
+                for i in range(20):
+                    pylibscrypt.scrypt_batch([b'pw'] * 4, [b'salt'] * 4, 4)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run) for i in range(3)]
+        for t in threads:
+            t.start()
+        for i in range(50):
+            pylibscrypt.set_pool_size(i % 3 + 1)
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+
+class ScryptAioTests(unittest.TestCase):
+    """Tests the asyncio functions of the package"""
+
+    def setUp(self):
+        try:
+            from . import aio
+        except (ImportError, SyntaxError):
+            self.skipTest('asyncio not supported')
+        import asyncio
+        self.aio = aio
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.aio.set_concurrency()
+
+    def test_aio(self):
+        import pylibscrypt
+        run = self.loop.run_until_complete
+        self.assertEqual(run(self.aio.scrypt(b'pw', b'salt', 4, 2, 2, 42)),
+                         pylibscrypt.scrypt(b'pw', b'salt', 4, 2, 2, 42))
+        m = run(self.aio.scrypt_mcf(b'pw', N=4, prefix=b'$7$'))
+        self.assertTrue(run(self.aio.scrypt_mcf_check(m, b'pw')))
+        self.assertFalse(run(self.aio.scrypt_mcf_check(m, b'px')))
+        self.assertRaises(TypeError, run, self.aio.scrypt(u'pw', b'salt', 4))
+
+    def test_aio_concurrency(self):
+        self.aio.set_concurrency(1)
+        tasks = [self.loop.create_task(self.aio.scrypt(b'pw', b'salt', 4))
+                 for i in range(4)]
+        tasks[1].cancel()
+        done = self.loop.run_until_complete(
+            self.asyncio.gather(*tasks, return_exceptions=True))
+        self.assertTrue(isinstance(done[1], self.asyncio.CancelledError))
+        self.assertEqual(done[0], done[2])
+        self.assertEqual(done[0], done[3])
+        self.assertRaises(ValueError, self.aio.set_concurrency, 0)
+
+    def test_aio_processes(self):
+        import pylibscrypt
+        from .checkcache import CheckCache
+        from .metrics import Registry
+        cache, metrics = CheckCache(), Registry()
+        pylibscrypt.set_check_cache(cache)
+        pylibscrypt.set_metrics(metrics)
+        try:
+            mcf = pylibscrypt.scrypt_mcf(b'pw', N=4)
+            for i in range(2):
+                self.assertTrue(self.aio._in_process(
+                    'pypyscrypt_inline', 'scrypt_mcf_check', (4, 8, 1),
+                    mcf, b'pw'))
+        finally:
+            pylibscrypt.set_check_cache()
+            pylibscrypt.set_metrics()
+        self.assertEqual(cache.stats()['hits'], 1)
+        calls = [(c['op'], c['backend'], c['count'])
+                 for c in metrics.as_dict()['calls']]
+        self.assertTrue(('scrypt_mcf_check', 'pypyscrypt_inline', 2) in calls)
+
+    def test_aio_process_buffers(self):
+        import pylibscrypt
+        pw, salt = bytearray(b'pw'), memoryview(b'salt')
+        self.assertEqual(
+            self.aio._in_process('pypyscrypt_inline', 'scrypt', (4, 8, 1),
+                                 memoryview(pw), salt, 4, 8, 1, 64),
+            pylibscrypt.scrypt(b'pw', b'salt', 4))
+        mcf = self.aio._in_process('pypyscrypt_inline', 'scrypt_mcf',
+                                   (4, 8, 1), pw, salt, 4, 8, 1)
+        self.assertTrue(self.aio._in_process(
+            'pypyscrypt_inline', 'scrypt_mcf_check', (4, 8, 1),
+            memoryview(mcf), memoryview(pw)))
+
+    def test_aio_memory_budget(self):
+        import threading, time
+        import pylibscrypt
+        from . import admission
+        admission.set_memory_budget(1000)
+        self.addCleanup(admission.set_memory_budget)
+        held, release = threading.Event(), threading.Event()
+        def hold():
+            with admission.reserve(1000):
+                held.set()
+                release.wait()
+        keys = []
+        def call():
+            keys.append(self.aio._in_process(
+                'pypyscrypt_inline', 'scrypt', (4, 8, 1),
+                b'pw', b'salt', 4, 8, 1, 64))
+        t1 = threading.Thread(target=hold)
+        t1.start()
+        held.wait()
+        t2 = threading.Thread(target=call)
+        t2.start()
+        try:
+            for i in range(1000):
+                if admission.stats()['queued']:
+                    break
+                time.sleep(0.001)
+            self.assertEqual(admission.stats()['queued'], 1)
+            self.assertEqual(keys, [])
+        finally:
+            release.set()
+            t1.join()
+            t2.join()
+        self.assertEqual(keys, [pylibscrypt.scrypt(b'pw', b'salt', 4)])
+
+
+class AdmissionTests(unittest.TestCase):
+    """Tests the memory admission control"""
+
+    def setUp(self):
+        from . import admission
+        self.admission = admission
+
+    def tearDown(self):
+        self.admission.set_memory_budget()
+
+    def test_queue(self):
+        import threading, time
+        self.admission.set_memory_budget(1000)
+        held, release = threading.Event(), threading.Event()
+        order = []
+        def hold():
+            with self.admission.reserve(800):
+                held.set()
+                release.wait()
+                order.append('a')
+        def wait():
+            with self.admission.reserve(800):
+                order.append('b')
+        t1 = threading.Thread(target=hold)
+        t2 = threading.Thread(target=wait)
+        t1.start()
+        held.wait()
+        t2.start()
+        while self.admission.stats()['queued'] != 1:
+            time.sleep(0.001)
+        self.assertEqual(self.admission.stats()['in_use'], 800)
+        release.set()
+        t1.join()
+        t2.join()
+        self.assertEqual(order, ['a', 'b'])
+        stats = self.admission.stats()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertTrue(stats['waited'] >= 1)
+        self.assertTrue(stats['max_wait'] > 0)
+
+    def test_deadline(self):
+        import threading, time
+        import pylibscrypt
+        from .common import TimeoutError
+        from .deadline import Deadline
+        self.admission.set_memory_budget(1000)
+        held, release = threading.Event(), threading.Event()
+        def hold():
+            with self.admission.reserve(1000):
+                held.set()
+                release.wait()
+        t = threading.Thread(target=hold)
+        t.start()
+        held.wait()
+        try:
+            start = time.time()
+            self.assertRaises(TimeoutError, pylibscrypt.scrypt, b'pw', b's',
+                              4, deadline=0.1)
+            self.assertTrue(time.time() - start < 1)
+            deadline = Deadline()
+            threading.Timer(0.1, deadline.cancel).start()
+            def wait():
+                with self.admission.reserve(10, deadline):
+                    pass
+            self.assertRaises(TimeoutError, wait)
+            self.assertEqual(self.admission.stats()['queued'], 0)
+        finally:
+            release.set()
+            t.join()
+        self.assertEqual(self.admission.stats()['in_use'], 0)
+
+    def test_oversized_and_nested(self):
+        import pylibscrypt
+        self.admission.set_memory_budget(1)
+        self.assertEqual(self.admission.get_memory_budget(), 1)
+        with self.admission.reserve(100):
+            with self.admission.reserve(100):
+                self.assertEqual(self.admission.stats()['in_use'], 100)
+        self.assertEqual(len(pylibscrypt.scrypt(b'pw', b's', 4, 1, 8)), 64)
+        self.admission.set_memory_budget(0)
+        self.assertEqual(self.admission.get_memory_budget(), None)
+        self.assertRaises(ValueError, self.admission.set_memory_budget, -1)
+
+
+class AutoselectTests(unittest.TestCase):
+    """Tests selecting the fastest implementation"""
+
+    def setUp(self):
+        import os, tempfile
+        from . import autoselect
+        self.autoselect = autoselect
+        self.tmp = tempfile.mkdtemp()
+        self.old_cache = os.environ.get('PYLIBSCRYPT_CACHE')
+        os.environ['PYLIBSCRYPT_CACHE'] = os.path.join(self.tmp, 'c.json')
+
+    def tearDown(self):
+        import os, shutil
+        if self.old_cache is None:
+            del os.environ['PYLIBSCRYPT_CACHE']
+        else:
+            os.environ['PYLIBSCRYPT_CACHE'] = self.old_cache
+        shutil.rmtree(self.tmp)
+
+    def test_ranking_cached(self):
+        ranking = self.autoselect.ranking(16, 1, 1)
+        self.assertTrue(ranking)
+        self.assertEqual(ranking, sorted(ranking))
+        calibrate = self.autoselect.calibrate
+        try:
+            self.autoselect.calibrate = None
+            self.assertEqual(self.autoselect.ranking(16, 1, 1), ranking)
+        finally:
+            self.autoselect.calibrate = calibrate
+        module = self.autoselect.select(16, 1, 1)
+        self.assertEqual(module.__name__, 'pylibscrypt.' + ranking[0][1])
+        self.assertEqual(len(module.scrypt(b'pw', b'salt', 4)), 64)
+
+    def test_pure_python_last(self):
+        from . import registry
+        calibrate = self.autoselect.calibrate
+        ranking = calibrate(1024, 1, 1, ['pypyscrypt_inline'])
+        self.assertEqual([name for t, name in ranking], ['pypyscrypt_inline'])
+        if registry.load('hashlibscrypt') is None:
+            self.skipTest('hashlib has no scrypt')
+        ranking = calibrate(1024, 1, 1, ['pypyscrypt_inline', 'hashlibscrypt'])
+        self.assertEqual([name for t, name in ranking], ['hashlibscrypt'])
+
+    def test_cache_errors(self):
+        with open(self.autoselect.cache_path(), 'w') as f:
+            f.write('[broken')
+        self.assertEqual(self.autoselect.load_cache(), {})
+        self.assertTrue(self.autoselect.select(4, 1, 1) is not None)
+        self.assertEqual(len(self.autoselect.load_cache()), 1)
+
+
+class TuningTests(unittest.TestCase):
+    """Tests picking parameters for a target time and memory"""
+
+    def setUp(self):
+        import os, tempfile
+        import pylibscrypt
+        self.calibrate = pylibscrypt.calibrate
+        self.tmp = tempfile.mkdtemp()
+        self.old_cache = os.environ.get('PYLIBSCRYPT_CACHE')
+        os.environ['PYLIBSCRYPT_CACHE'] = os.path.join(self.tmp, 'c.json')
+
+    def tearDown(self):
+        import os, shutil
+        if self.old_cache is None:
+            del os.environ['PYLIBSCRYPT_CACHE']
+        else:
+            os.environ['PYLIBSCRYPT_CACHE'] = self.old_cache
+        shutil.rmtree(self.tmp)
+
+    def test_calibrate(self):
+        from . import common, tuning
+        params = self.calibrate(0.01, 2**20)
+        N, r, p = params['N'], params['r'], params['p']
+        self.assertEqual(N & (N - 1), 0)
+        self.assertEqual(r, common.SCRYPT_r)
+        self.assertTrue(common.scrypt_memory(N, r, p) <= 2**20)
+        self.assertEqual(params['memory'], common.scrypt_memory(N, r, p))
+        self.assertTrue(params['timings'])
+        measure = tuning.measure
+        try:
+            tuning.measure = None
+            self.assertEqual(self.calibrate(0.01, 2**20), params)
+        finally:
+            tuning.measure = measure
+
+    def test_memory_bound(self):
+        params = self.calibrate(0.05, 2**14, r=1)
+        self.assertEqual(params['N'], 64)
+        self.assertTrue(params['p'] > 1)
+
+    def test_calibrate_errors(self):
+        self.assertRaises(ValueError, self.calibrate, 0, 2**20)
+        self.assertRaises(ValueError, self.calibrate, 1, 0)
+        self.assertRaises(ValueError, self.calibrate, 1, 1024)
+        self.assertRaises(ImportError, self.calibrate, 1, 2**20, 'nope')
+
+    def test_registered_backend(self):
+        from . import registry
+        registry.register('mine', 'pylibscrypt.pypyscrypt_inline')
+        self.addCleanup(registry.unregister, 'mine')
+        params = self.calibrate(0.05, 2**20, 'mine')
+        self.assertEqual(params['backend'], 'mine')
+
+
+class ScryptHashTests(unittest.TestCase):
+    """Tests parsing and encoding MCF hashes"""
+
+    def test_roundtrip(self):
+        from .mcf import ScryptHash
+        for mcf in (
+            b'$s1$020101$U29kaXVtQ2hsb3JpZGU=$ux13AWxUOpn+YyycQ8YBgP0F4MrI'
+            b'spN029GFRWnLU09IckDPwGnWpZo18vpcdCiyHZvp+EMVRG1TcRGeAW/t9w==',
+            b'$7$C6..../....SodiumChloride'
+            b'$kBGj9fHznVYFQMEn/qDCfrDevf9YDtcDdKvEqHJLV8D',
+        ):
+            h = ScryptHash.parse(mcf)
+            self.assertEqual(h.encode(), mcf)
+            self.assertEqual(ScryptHash(h.N, h.r, h.p, h.salt, h.hash,
+                                        h.format), h)
+        self.assertEqual((h.N, h.r, h.p, h.salt, h.format),
+                         (2**14, 8, 1, b'SodiumChloride', b'$7$'))
+        self.assertEqual(len(h.hash), 32)
+
+    def test_memoized(self):
+        from . import mcf
+        m = b'$7$06..../....SodiumChloride$ENlyo6fGw4PCcDBOFepfSZjFUnVatH'
+        h = mcf.ScryptHash.parse(m)
+        self.assertTrue(mcf.ScryptHash.parse(m) is h)
+        self.assertRaises(AttributeError, setattr, h, 'N', 2)
+        size = mcf._PARSED_SIZE
+        try:
+            mcf._PARSED_SIZE = 2
+            mcf.ScryptHash.parse(m + b'a')
+            mcf.ScryptHash.parse(m + b'b')
+            self.assertFalse(mcf.ScryptHash.parse(m) is h)
+        finally:
+            mcf._PARSED_SIZE = size
+
+    def test_cb64(self):
+        import os
+        from . import mcf
+        for n in range(40):
+            data = os.urandom(n)
+            enc = mcf._cb64enc(data)
+            self.assertEqual(len(enc), n * 8 // 6 + 1)
+            self.assertEqual(bytes(mcf._cb64dec(enc)), data)
+        self.assertEqual(mcf._cb64enc(b'\x01\x02\x03'), b'/6k..')
+        self.assertRaises(ValueError, mcf._cb64dec, b'ab$c')
+        self.assertRaises(ValueError, mcf.ScryptHash.parse, b'$7$C6...$a')
+        self.assertRaises(TypeError, mcf.ScryptHash.parse, u'$7$')
+        self.assertRaises(ValueError, mcf.ScryptHash, 2, 1, 1, b'', b'', b'$')
+
+
+class RehashTests(unittest.TestCase):
+    """Tests detecting weak hashes and upgrading them"""
+
+    def setUp(self):
+        import pylibscrypt
+        self.pylibscrypt = pylibscrypt
+
+    def test_needs_rehash(self):
+        m = self.pylibscrypt.scrypt_mcf(b'pw', N=16, r=2, p=2)
+        needs_rehash = self.pylibscrypt.needs_rehash
+        self.assertFalse(needs_rehash(m, 16, 2, 2))
+        self.assertFalse(needs_rehash(m, 8, 1, 1, b'$s1$'))
+        self.assertTrue(needs_rehash(m, 32, 2, 2))
+        self.assertTrue(needs_rehash(m, 16, 4, 2))
+        self.assertTrue(needs_rehash(m, 16, 2, 3))
+        self.assertTrue(needs_rehash(m, 16, 2, 2, b'$7$'))
+        self.assertTrue(needs_rehash(m))
+        self.assertRaises(ValueError, needs_rehash, b'$s1$', 16)
+
+    def test_upgrade(self):
+        upgrade = self.pylibscrypt.scrypt_mcf_check_and_upgrade
+        check = self.pylibscrypt.scrypt_mcf_check
+        m = self.pylibscrypt.scrypt_mcf(b'pw', N=16, r=2, prefix=b'$7$')
+        self.assertEqual(upgrade(m, b'px', {'N': 32}), (False, None))
+        self.assertEqual(upgrade(m, b'pw', {'N': 16, 'r': 2}), (True, None))
+        ok, m2 = upgrade(m, u'pw', {'N': 32, 'r': 1})
+        self.assertTrue(ok)
+        self.assertEqual(m2[:3], b'$7$')
+        self.assertFalse(self.pylibscrypt.needs_rehash(m2, 32, 2))
+        self.assertTrue(check(m2, b'pw'))
+        ok, m3 = upgrade(m2, b'pw', {'N': 32, 'r': 2, 'prefix': b'$s1$'})
+        self.assertTrue(m3.startswith(b'$s1$') and check(m3, b'pw'))
+
+    def test_upgrade_executor(self):
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            self.skipTest('concurrent.futures not available')
+        m = self.pylibscrypt.scrypt_mcf(b'pw', N=4)
+        executor = ThreadPoolExecutor(1)
+        try:
+            upgrade = self.pylibscrypt.scrypt_mcf_check_and_upgrade
+            self.assertEqual(upgrade(m, b'pw', {'N': 4, 'r': 8}, executor),
+                             (True, None))
+            ok, future = upgrade(m, b'pw', {'N': 16}, executor)
+            self.assertTrue(ok)
+            m2 = future.result()
+            self.assertTrue(self.pylibscrypt.scrypt_mcf_check(m2, b'pw'))
+            self.assertFalse(self.pylibscrypt.needs_rehash(m2, 16))
+        finally:
+            executor.shutdown()
+
+
+class ResumableTests(unittest.TestCase):
+    """Tests checkpointing and resuming derivations"""
+
+    def setUp(self):
+        import os, tempfile
+        if not hasattr(memoryview, 'cast'):
+            self.skipTest('no memoryview.cast')
+        from . import resumable, pypyscrypt_inline
+        self.resumable = resumable
+        self.scrypt = pypyscrypt_inline.scrypt
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'ckpt')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp)
+
+    def test_resume(self):
+        import os
+        pw, s = b'password', b'NaCl'
+        d = self.resumable.Derivation(pw, s, 32, 2, 3, 42, self.path)
+        d.step(40)
+        self.assertEqual((d.lane, d.phase, d.counter),
+                         (0, self.resumable.MIX, 8))
+        X = d.X
+        d.checkpoint()
+        d.step(10)
+        d.close()
+
+        d = self.resumable.Derivation.resume(self.path, pw)
+        self.assertEqual((d.lane, d.phase, d.counter),
+                         (0, self.resumable.MIX, 8))
+        self.assertEqual(d.X, X)
+        self.assertRaises(ValueError, d.result)
+        # Crossing into the next lane checkpoints, as V gets overwritten
+        d.step(30)
+        d.close()
+        d = self.resumable.Derivation.resume(self.path, pw)
+        self.assertEqual((d.lane, d.phase), (1, self.resumable.FILL))
+        self.assertEqual(d.run(), self.scrypt(pw, s, 32, 2, 3, 42))
+        d.remove()
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_scrypt_resumable(self):
+        import mmap, os
+        pw, s = b'password', b'NaCl'
+        key = self.scrypt(pw, s, 64, 1, 2)
+        d = self.resumable.Derivation(pw, s, 64, 1, 2, 64, self.path)
+        d.checkpoint()
+        d.step(100)
+        d.checkpoint()
+        d.close()
+        self.assertRaises(ValueError, self.resumable.Derivation.resume,
+                          self.path, b'wrong')
+        self.assertRaises(ValueError, self.resumable.scrypt_resumable,
+                          pw, s, 32, 1, 2, path=self.path)
+        # Resumed with the salt in a buffer that doesn't compare to bytes
+        salt = mmap.mmap(-1, len(s))
+        salt.write(s)
+        self.assertEqual(self.resumable.scrypt_resumable(
+            pw, salt, 64, 1, 2, path=self.path, interval=0), key)
+        salt.close()
+        self.assertEqual(os.listdir(self.tmp), [])
+        self.assertEqual(self.resumable.scrypt_resumable(
+            pw, s, 64, 1, 2, path=self.path), key)
+        self.assertRaises(ValueError, self.resumable.scrypt_resumable, pw, s)
+
+
+class AuditTests(unittest.TestCase):
+    """Tests auditing stored MCF hashes"""
+
+    def setUp(self):
+        import pylibscrypt
+        self.lines = [
+            b'a:' + pylibscrypt.scrypt_mcf(b'pw', N=4) + b'\n',
+            b'b:' + pylibscrypt.scrypt_mcf(b'pw', N=16, prefix=b'$7$') + b'\n',
+            b'c:$s1$zz\r\n',
+            b'd:' + pylibscrypt.scrypt_mcf(b'pw', N=16, r=2) + b'\n',
+        ] * 3
+
+    def test_audit(self):
+        from . import audit
+        report = audit.AuditReport()
+        offenders = list(audit.audit(self.lines, report, N=16, r=8,
+                                     delimiter=b':', chunk_size=5))
+        self.assertEqual(offenders, [(b'a', audit.WEAK),
+                                     (b'c', audit.MALFORMED),
+                                     (b'd', audit.WEAK)] * 3)
+        counts = report.as_dict()
+        self.assertEqual((counts['rows'], counts['malformed'], counts['weak']),
+                         (12, 3, 6))
+        self.assertEqual(counts['formats'], {'$s1$': 6, '$7$': 3})
+        self.assertEqual(counts['params'],
+                         {'4,8,1': 3, '16,2,1': 3, '16,8,1': 3})
+
+    def test_parse_stream(self):
+        from . import audit
+        rows = list(audit.parse_stream(self.lines, chunk_size=5))
+        self.assertEqual([row for row, h in rows], list(range(1, 13)))
+        self.assertEqual([h is None for row, h in rows],
+                         [True] * 12)
+        rows = list(audit.parse_stream(self.lines, b':', 5))
+        self.assertEqual(list(audit.parse_stream(self.lines, b':', 5, 2)),
+                         rows)
+        self.assertEqual(rows[1][1].N, 16)
+        rows = list(audit.parse_stream([b'a:x\n', b'y\n'], b':'))
+        self.assertEqual([row for row, h in rows], [b'a', 2])
+
+    def test_main(self):
+        import io, json, os, shutil, tempfile
+        from . import audit
+        tmp = tempfile.mkdtemp()
+        try:
+            hashes = os.path.join(tmp, 'hashes')
+            with open(hashes, 'wb') as f:
+                f.writelines(line.split(b':', 1)[1] for line in self.lines)
+            offenders = os.path.join(tmp, 'offenders')
+            counts = os.path.join(tmp, 'counts')
+            audit.main([hashes, '-N', '16', '-o', offenders,
+                        '--json', counts])
+            with open(offenders, 'rb') as f:
+                self.assertEqual(f.read().split(b'\n')[:3],
+                                 [b'1\tweak', b'3\tmalformed', b'5\tweak'])
+            with open(counts) as f:
+                self.assertEqual(json.load(f)['N'], {'4': 3, '16': 6})
+            stderr = sys.stderr
+            sys.stderr = io.StringIO() if str is not bytes else io.BytesIO()
+            try:
+                self.assertRaises(SystemExit, audit.main,
+                                  [hashes, '--json', '-'])
+            finally:
+                sys.stderr = stderr
+        finally:
+            shutil.rmtree(tmp)
+
+
+class CheckCacheTests(unittest.TestCase):
+    """Tests the cache of successful checks"""
+
+    def setUp(self):
+        import pylibscrypt
+        from .checkcache import CheckCache
+        self.pylibscrypt = pylibscrypt
+        self.CheckCache = CheckCache
+        self.calls = []
+        def check(mcf, password):
+            self.calls.append((mcf, password))
+            return pylibscrypt.scrypt_mcf_check(mcf, password)
+        self.check = check
+        self.mcf = pylibscrypt.scrypt_mcf(b'password', N=4)
+
+    def tearDown(self):
+        self.pylibscrypt.set_check_cache()
+
+    def test_positive_only(self):
+        cache = self.CheckCache()
+        for i in range(3):
+            self.assertTrue(cache.check(self.check, self.mcf, b'password'))
+            self.assertFalse(cache.check(self.check, self.mcf, b'wrong'))
+        self.assertEqual(len(self.calls), 4)
+        self.assertTrue(cache.check(self.check, self.mcf, u'password'))
+        self.assertEqual(len(self.calls), 4)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (3, 4, 1))
+        cache.clear()
+        self.assertTrue(cache.check(self.check, self.mcf, b'password'))
+        self.assertEqual(len(self.calls), 5)
+
+    def test_lru_ttl(self):
+        from . import checkcache
+        mcfs = [self.pylibscrypt.scrypt_mcf(b'password', N=4)
+                for i in range(3)]
+        cache = self.CheckCache(maxsize=2, ttl=10)
+        for mcf in mcfs[:2] + mcfs[:1] + mcfs[2:] + mcfs[:1]:
+            cache.check(self.check, mcf, b'password')
+        # The second was least recently used
+        self.assertEqual(self.calls, [(m, b'password') for m in mcfs])
+        self.assertEqual(cache.stats()['size'], 2)
+        clock = checkcache._clock
+        try:
+            checkcache._clock = lambda: clock() + 11
+            cache.check(self.check, mcfs[0], b'password')
+        finally:
+            checkcache._clock = clock
+        self.assertEqual(len(self.calls), 4)
+
+    def test_package(self):
+        cache = self.CheckCache()
+        self.pylibscrypt.set_check_cache(cache)
+        self.assertTrue(self.pylibscrypt.get_check_cache() is cache)
+        check = self.pylibscrypt.scrypt_mcf_check
+        self.assertTrue(check(self.mcf, b'password'))
+        self.assertTrue(check(self.mcf, b'password'))
+        self.assertFalse(check(self.mcf, b'wrong'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertRaises(TypeError, check, self.mcf, 42)
+        self.assertRaises(ValueError, self.CheckCache, 0)
+        self.assertRaises(ValueError, self.CheckCache, 1, 0)
+
+
+class DeadlineTests(unittest.TestCase):
+    """Tests deadlines and cancellation"""
+
+    def setUp(self):
+        from . import deadline
+        self.deadline = deadline
+
+    def assertTimesOut(self, f, *args, **kwargs):
+        import time
+        t = time.time()
+        self.assertRaises(self.deadline.TimeoutError, f, *args, **kwargs)
+        self.assertLess(time.time() - t, 2)
+
+    def test_token(self):
+        d = self.deadline.Deadline()
+        self.assertIsNone(d.remaining())
+        self.assertFalse(d.expired())
+        d.check()
+        d.cancel()
+        self.assertTrue(d.cancelled)
+        self.assertEqual(d.remaining(), 0)
+        self.assertRaises(self.deadline.TimeoutError, d.check)
+        self.assertTrue(self.deadline.Deadline(0).expired())
+        self.assertTrue(self.deadline.as_deadline(d) is d)
+        self.assertIsNone(self.deadline.as_deadline(None))
+
+    def test_pure_python(self):
+        from . import pypyscrypt_inline
+        self.assertTimesOut(pypyscrypt_inline.scrypt, b'pw', b's', 2**14, 8,
+                            16, deadline=0.05)
+
+    def test_cancel(self):
+        import threading
+        from . import pypyscrypt_inline
+        d = self.deadline.Deadline()
+        threading.Timer(0.05, d.cancel).start()
+        self.assertTimesOut(pypyscrypt_inline.scrypt, b'pw', b's', 2**14, 8,
+                            16, deadline=d)
+
+    def test_process(self):
+        try:
+            from . import hashlibscrypt
+        except ImportError:
+            self.skipTest('hashlib.scrypt not available')
+        self.assertTimesOut(hashlibscrypt.scrypt, b'pw', b's', 2**16, 8, 128,
+                            deadline=0.1)
+        self.assertEqual(
+            hashlibscrypt.scrypt(b'pw', b's', 16, 1, 1, deadline=30),
+            hashlibscrypt.scrypt(b'pw', b's', 16, 1, 1))
+        context = self.deadline._context(hashlibscrypt.scrypt)
+        self.assertNotEqual(context.get_start_method(), 'fork')
+
+    def test_package(self):
+        import pylibscrypt
+        self.assertEqual(pylibscrypt.scrypt(b'pw', b's', 16, deadline=30),
+                         pylibscrypt.scrypt(b'pw', b's', 16))
+        mcf = pylibscrypt.scrypt_mcf(b'pw', N=16, deadline=30)
+        self.assertTrue(pylibscrypt.scrypt_mcf_check(mcf, b'pw', deadline=30))
+        self.assertFalse(pylibscrypt.scrypt_mcf_check(mcf, b'x', deadline=30))
+        d = self.deadline.Deadline()
+        d.cancel()
+        self.assertTimesOut(pylibscrypt.scrypt_mcf_check, mcf, b'pw',
+                            deadline=d)
+
+
+class HooksTests(unittest.TestCase):
+    """Tests the profiling hooks"""
+
+    def setUp(self):
+        from . import hooks
+        self.hooks = hooks
+        self.events = []
+        self.hook = lambda *args: self.events.append(args)
+        hooks.add_hook(self.hook)
+
+    def tearDown(self):
+        if self.hook in self.hooks._hooks:
+            self.hooks.remove_hook(self.hook)
+
+    def test_pure_python(self):
+        from . import pypyscrypt_inline
+        h = self.hooks
+        pypyscrypt_inline.scrypt(b'pw', b's', 16, 2, 2, 32)
+        self.assertEqual(
+            [(e[0], e[2]) for e in self.events],
+            [(h.PBKDF2_IN, 512), (h.ALLOC, 5120),
+             (h.ROMIX_FILL, 4096), (h.ROMIX_MIX, 4096),
+             (h.ROMIX_FILL, 4096), (h.ROMIX_MIX, 4096),
+             (h.PBKDF2_OUT, 32)])
+        for phase, seconds, nbytes, params in self.events:
+            self.assertGreaterEqual(seconds, 0)
+            self.assertEqual(params, {'backend': 'pypyscrypt_inline',
+                                      'N': 16, 'r': 2, 'p': 2})
+
+    def test_native(self):
+        try:
+            from . import hashlibscrypt
+        except ImportError:
+            self.skipTest('hashlib.scrypt not available')
+        hashlibscrypt.scrypt(b'pw', b's', 16, 2, 2)
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0][0], self.hooks.NATIVE)
+        self.assertEqual(self.events[0][3]['backend'], 'hashlibscrypt')
+
+    def test_remove(self):
+        from . import pypyscrypt_inline
+        self.hooks.remove_hook(self.hook)
+        self.assertIsNone(self.hooks.timer('x', 2, 1, 1))
+        pypyscrypt_inline.scrypt(b'pw', b's', 16, 2, 2)
+        self.assertEqual(self.events, [])
+
+
+class MetricsTests(unittest.TestCase):
+    """Tests the metrics registry"""
+
+    def setUp(self):
+        import pylibscrypt
+        from .metrics import Registry
+        self.pylibscrypt = pylibscrypt
+        self.registry = Registry(buckets=(0.5, 0.001))
+        pylibscrypt.set_metrics(self.registry)
+        self.backend = pylibscrypt.backend_info()['backend']
+
+    def tearDown(self):
+        self.pylibscrypt.set_metrics()
+
+    def test_calls(self):
+        mcf = self.pylibscrypt.scrypt_mcf(b'pw', N=16, r=2, p=3)
+        self.assertTrue(self.pylibscrypt.scrypt_mcf_check(mcf, b'pw'))
+        self.assertFalse(self.pylibscrypt.scrypt_mcf_check(mcf, b'x'))
+        self.assertRaises(ValueError, self.pylibscrypt.scrypt_mcf_check,
+                          b'$bad$', b'pw')
+        self.assertRaises(ValueError, self.pylibscrypt.scrypt, b'pw', b's', 3)
+        calls = dict(((c['op'], c['N'], c['result']), c['count'])
+                     for c in self.registry.as_dict()['calls'])
+        self.assertEqual(calls, {
+            ('scrypt_mcf', 16, 'ok'): 1,
+            ('scrypt_mcf_check', 16, 'match'): 1,
+            ('scrypt_mcf_check', 16, 'mismatch'): 1,
+            ('scrypt_mcf_check', None, 'error'): 1,
+            ('scrypt', 3, 'error'): 1,
+        })
+
+    def test_latency(self):
+        self.registry.observe('scrypt', 'x', (2, 1, 1), 'ok', 0.2)
+        self.registry.observe('scrypt', 'x', (2, 1, 1), 'ok', 2)
+        latency, = self.registry.as_dict()['latency']
+        self.assertEqual(latency['buckets'],
+                         {'0.001': 0, '0.5': 1, '+Inf': 2})
+        self.assertEqual(latency['count'], 2)
+        self.assertAlmostEqual(latency['sum'], 2.2)
+
+    def test_in_flight(self):
+        seen = []
+        def func():
+            seen.append(self.registry.as_dict()['in_flight'])
+        self.registry.call('scrypt', 'x', (2, 1, 1), func)
+        self.assertEqual(seen[0], [{'op': 'scrypt', 'backend': 'x',
+                                    'value': 1}])
+        self.assertEqual(self.registry.as_dict()['in_flight'][0]['value'], 0)
+
+    def test_prometheus(self):
+        import json
+        self.pylibscrypt.scrypt(b'pw', b's', 16, 1, 1)
+        text = self.registry.as_prometheus()
+        labels = 'op="scrypt",backend="%s",N="16",r="1",p="1"' % self.backend
+        self.assertIn('pylibscrypt_calls_total{%s,result="ok"} 1\n' % labels,
+                      text)
+        self.assertIn('pylibscrypt_call_seconds_bucket{%s,le="+Inf"} 1\n'
+                      % labels, text)
+        self.assertIn('pylibscrypt_call_seconds_count{%s} 1\n' % labels, text)
+        self.assertIn('# TYPE pylibscrypt_in_flight gauge\n', text)
+        self.assertEqual(json.loads(self.registry.as_json()),
+                         self.registry.as_dict())
+        self.registry.reset()
+        self.assertEqual(self.registry.as_dict()['calls'], [])
+
+    def test_router(self):
+        from . import router
+        saved = self.pylibscrypt._backend, self.pylibscrypt._backend_info
+        self.pylibscrypt._backend = router
+        self.pylibscrypt._backend_info = dict(saved[1], backend='router')
+        try:
+            mcf = self.pylibscrypt.scrypt_mcf(b'pw', N=16)
+            self.assertTrue(self.pylibscrypt.scrypt_mcf_check(mcf, b'pw'))
+            self.pylibscrypt.scrypt(b'pw', b's', 16, 1, 1)
+            self.assertRaises(ValueError, self.pylibscrypt.scrypt_mcf_check,
+                              b'$bad$', b'pw')
+        finally:
+            self.pylibscrypt._backend, self.pylibscrypt._backend_info = saved
+        name = lambda m: m.__name__.rsplit('.', 1)[-1]
+        backends = dict((c['op'], c['backend'])
+                        for c in self.registry.as_dict()['calls']
+                        if c['result'] != 'error')
+        self.assertEqual(backends, {
+            'scrypt_mcf': name(router.route(16, 8, 1, 16)),
+            'scrypt_mcf_check': name(router.route(16, 8, 1, 16)),
+            'scrypt': name(router.route(16, 1, 1, 1)),
+        })
+        self.assertNotIn('router', backends.values())
+
+
+class RouterTests(unittest.TestCase):
+    """Tests choosing the implementation per call"""
+
+    def setUp(self):
+        import os, tempfile
+        from . import router
+        self.router = router
+        # Registry order, unless a test caches a ranking
+        self.tmp = tempfile.mkdtemp()
+        self.old_cache = os.environ.get('PYLIBSCRYPT_CACHE')
+        os.environ['PYLIBSCRYPT_CACHE'] = os.path.join(self.tmp, 'c.json')
+        router._native = None
+        router._routes.clear()
+
+    def tearDown(self):
+        import os, shutil
+        if self.old_cache is None:
+            del os.environ['PYLIBSCRYPT_CACHE']
+        else:
+            os.environ['PYLIBSCRYPT_CACHE'] = self.old_cache
+        shutil.rmtree(self.tmp)
+        self.router._native = None
+
+    def test_hashlib_envelope(self):
+        try:
+            from . import hashlibscrypt
+        except ImportError:
+            self.skipTest('hashlib.scrypt not available')
+        self.assertTrue(hashlibscrypt.supports(2**15, 1, 1))
+        self.assertFalse(hashlibscrypt.supports(2**16, 1, 1))
+        self.assertFalse(hashlibscrypt.supports(2**21, 8, 1))
+        self.assertRaises(ValueError, hashlibscrypt.scrypt, b'pw', b's',
+                          2**16, 1, 1)
+        self.assertIs(self.router.route(2**14, 8, 1), hashlibscrypt)
+        self.assertIsNot(self.router.route(2**16, 1, 1), hashlibscrypt)
+
+    def test_last_resort(self):
+        from . import pypyscrypt_inline
+        self.router._load()
+        self.router._native = []
+        try:
+            self.assertIs(self.router.route(16, 1, 1), pypyscrypt_inline)
+        finally:
+            self.router._native = None
+
+    def test_ranking(self):
+        from . import autoselect
+        native = [n for m, s, n in self.router._load()]
+        if len(native) < 2:
+            self.skipTest('needs two native implementations')
+        first, last = native[0], native[-1]
+        autoselect.save_cache({autoselect.host_key(): {
+            '16,8,1': {'ranking': [[0.1, last]], 'time': 1},
+            '32,8,1': {'ranking': [[0.1, first], [0.2, last]], 'time': 2},
+        }})
+        self.router._native = None
+        self.router._routes.clear()
+        self.assertEqual(self.router.route(16, 8, 1).__name__,
+                         'pylibscrypt.' + last)
+        # The latest ranking for parameters without one
+        self.assertEqual(self.router.route(64, 8, 1).__name__,
+                         'pylibscrypt.' + first)
+        autoselect.save_cache({autoselect.host_key(): {'16,8,1': 5}})
+        self.router._native = None
+        self.router._routes.clear()
+        self.assertEqual(self.router.route(16, 8, 1).__name__,
+                         'pylibscrypt.' + first)
+
+    def test_results(self):
+        from . import pypyscrypt_inline
+        for N, r, p in ((16, 1, 1), (16, 3, 6)):
+            self.assertEqual(
+                self.router.scrypt(b'pw', b'salt', N, r, p, 20),
+                pypyscrypt_inline.scrypt(b'pw', b'salt', N, r, p, 20))
+        mcf = self.router.scrypt_mcf(b'pw', N=16)
+        self.assertTrue(self.router.scrypt_mcf_check(mcf, b'pw'))
+        self.assertFalse(self.router.scrypt_mcf_check(mcf, b'x'))
+
+
+class RegistryTests(unittest.TestCase):
+    """Tests the registry of implementations"""
+
+    def setUp(self):
+        from . import registry
+        self.registry = registry
+
+    def tearDown(self):
+        for name in ('missing', 'mine'):
+            if name in self.registry.names():
+                self.registry.unregister(name)
+
+    def test_backends(self):
+        import pylibscrypt
+        backends = dict((b['name'], b) for b in pylibscrypt.backends())
+        inline = backends['pypyscrypt_inline']
+        self.assertTrue(inline['available'])
+        self.assertTrue(inline['pure_python'])
+        self.assertFalse(inline['releases_gil'])
+        self.assertTrue(inline['load_time'] >= 0)
+        self.assertIsNone(inline['error'])
+        # Known whether or not the implementation could be imported
+        self.assertTrue(backends['hashlibscrypt']['releases_gil'])
+        self.assertTrue(backends['hashlibscrypt']['limits'])
+        self.assertTrue(backends['pylibscrypt']['releases_gil'])
+        self.assertEqual(backends['pylibscrypt']['native_mcf'], ['$s1$'])
+        self.assertTrue(backends['pyscrypt']['releases_gil'])
+        self.assertFalse(backends['pyscrypt']['pure_python'])
+        self.assertTrue(backends['numpyscrypt']['pure_python'])
+        self.assertEqual(self.registry.names()[:4],
+                         ['hashlibscrypt', 'pylibscrypt', 'pyscrypt',
+                          'pylibsodium'])
+
+    def test_register(self):
+        self.assertRaises(TypeError, self.registry.register, 'mine',
+                          'pylibscrypt.pypyscrypt', fast=True)
+        self.registry.register('missing', 'pylibscrypt.missing')
+        self.assertIsNone(self.registry.load('missing'))
+        missing = [b for b in self.registry.backends()
+                   if b['name'] == 'missing'][0]
+        self.assertFalse(missing['available'])
+        self.assertTrue(missing['error'])
+
+    def test_router(self):
+        from . import pypyscrypt, router
+        supports = lambda N, r, p, salt_len: N == 4
+        self.registry.register('mine', 'pylibscrypt.pypyscrypt',
+                               supports=supports)
+        self.assertEqual(router._load()[-1], (pypyscrypt, supports, 'mine'))
+        self.registry.unregister('mine')
+        self.assertNotIn(pypyscrypt, [m for m, s, n in router._load()])
+
+    def test_router_plain(self):
+        import types
+        from . import pypyscrypt_inline, router
+        # A third-party implementation with neither deadline nor supports
+        plain = types.ModuleType('pylibscrypt_plain')
+        plain.scrypt = lambda password, salt, N, r, p, olen: (
+            pypyscrypt_inline.scrypt(password, salt, N, r, p, olen))
+        sys.modules['pylibscrypt_plain'] = plain
+        try:
+            self.registry.register('mine', 'pylibscrypt_plain')
+            router._native = [n for n in router._load() if n[2] == 'mine']
+            router._routes.clear()
+            self.assertIs(router.route(16, 1, 1), plain)
+            self.assertEqual(router.scrypt(b'pw', b'salt', 16, 1, 1, 20),
+                             pypyscrypt_inline.scrypt(b'pw', b'salt', 16, 1,
+                                                      1, 20))
+            mcf = router.scrypt_mcf(b'pw', N=16)
+            self.assertTrue(router.scrypt_mcf_check(mcf, b'pw'))
+        finally:
+            del sys.modules['pylibscrypt_plain']
+            router._native = None
+            router._routes.clear()
+
+
+class BackendResolutionTests(unittest.TestCase):
+    """Tests choosing the implementation of the package on first use"""
+
+    def run_python(self, code, backend=None):
+        import json, os, subprocess
+        env = dict(os.environ)
+        env.pop('PYLIBSCRYPT_SELECT', None)
+        env.pop('PYLIBSCRYPT_BACKEND', None)
+        if backend is not None:
+            env['PYLIBSCRYPT_BACKEND'] = backend
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+        return json.loads(out.decode())
+
+    def test_lazy(self):
+        # Python 2 leaves None for implicit relative imports that failed
+        loaded = self.run_python(
+            'import json, sys, pylibscrypt; print(json.dumps(sorted('
+            'm for m in sys.modules if m.startswith("pylibscrypt.") and '
+            'sys.modules[m] is not None)))'
+        )
+        self.assertEqual(loaded, ['pylibscrypt.common'])
+
+    def test_probed(self):
+        info = self.run_python(
+            'import json, pylibscrypt; pylibscrypt.scrypt(b"pw", b"s", 4); '
+            'print(json.dumps(pylibscrypt.backend_info()))'
+        )
+        self.assertEqual(info['how'], 'probed')
+        self.assertTrue(info['resolve_time'] >= 0)
+
+    def test_pinned(self):
+        info = self.run_python(
+            'import json, sys, pylibscrypt; '
+            'h = pylibscrypt.scrypt_mcf(b"pw", N=4); '
+            'assert pylibscrypt.scrypt_mcf_check(h, b"pw"); '
+            'assert "pylibscrypt.hashlibscrypt" not in sys.modules; '
+            'print(json.dumps(pylibscrypt.backend_info()))',
+            'pypyscrypt_inline'
+        )
+        self.assertEqual(info['backend'], 'pypyscrypt_inline')
+        self.assertEqual(info['how'], 'pinned')
+
+    def test_router(self):
+        info = self.run_python(
+            'import json, pylibscrypt; '
+            'h = pylibscrypt.scrypt_mcf(b"pw", N=4, r=1); '
+            'assert pylibscrypt.scrypt_mcf_check(h, b"pw"); '
+            'print(json.dumps(pylibscrypt.backend_info()))',
+            'router'
+        )
+        self.assertEqual(info['backend'], 'router')
+
+    def test_pinned_unknown(self):
+        error = self.run_python(
+            'import json, pylibscrypt\n'
+            'try:\n'
+            '    pylibscrypt.scrypt(b"pw", b"s", 4)\n'
+            'except ImportError as e:\n'
+            '    print(json.dumps(str(e)))\n',
+            'nope'
+        )
+        self.assertTrue('nope' in error)
+
+
+class ScryptIntoTests(unittest.TestCase):
+    """Tests scrypt_into and the per-thread ctypes buffers"""
+
+    def test_mmap(self):
+        import mmap
+        import pylibscrypt
+        m = mmap.mmap(-1, 4096)
+        try:
+            try:
+                memoryview(m)
+            except TypeError:
+                self.skipTest('no memoryview of mmap')
+            pylibscrypt.scrypt_into(b'password', b'salt', m, 16)
+            self.assertEqual(m[:], pylibscrypt.scrypt(b'password', b'salt',
+                                                      16, olen=4096))
+        finally:
+            m.close()
+
+    def test_thread_buffer(self):
+        import threading
+        from .common import thread_buffer
+        b = thread_buffer(64)
+        self.assertEqual(len(b), 64)
+        self.assertTrue(thread_buffer(64) is b)
+        self.assertFalse(thread_buffer(65) is b)
+        other = []
+        t = threading.Thread(target=lambda: other.append(thread_buffer(64)))
+        t.start()
+        t.join()
+        self.assertFalse(other[0] is b)
+        big = thread_buffer(4096)
+        self.assertEqual(len(big), 4096)
+        self.assertFalse(thread_buffer(4096) is big)
+
+    def test_buffers_cleared(self):
+        try:
+            from . import pylibscrypt
+        except ImportError:
+            self.skipTest('libscrypt not available')
+        from .common import thread_buffer
+        key = pylibscrypt.scrypt(b'password', b'salt', 16, olen=48)
+        self.assertEqual(thread_buffer(48).raw, b'\0' * 48)
+        self.assertEqual(len(key), 48)
+
+
+class ServerTests(unittest.TestCase):
+    """Tests the scrypt daemon and its client"""
+
+    def setUp(self):
+        import socket, tempfile
+        if sys.version_info < (3,) or not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('needs Python 3 and Unix sockets')
+        from . import client, server
+        self.client = client
+        self.server = server
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp)
+
+    def start(self, address, **kwargs):
+        import threading
+        s = self.server.Server(address, **kwargs)
+        t = threading.Thread(target=s.serve_forever)
+        t.start()
+        def stop():
+            s.shutdown()
+            t.join()
+        self.addCleanup(stop)
+        return s
+
+    def test_unix(self):
+        import os, stat
+        import pylibscrypt
+        path = os.path.join(self.tmp, 'scrypt.sock')
+        self.start(path, workers=2)
+        c = self.client.Client(path)
+        self.addCleanup(c.close)
+        self.assertEqual(c.scrypt(b'pw', bytearray(b'salt'), 16, 2, 2, 42),
+                         pylibscrypt.scrypt(b'pw', b'salt', 16, 2, 2, 42))
+        mcf = c.scrypt_mcf(u'pw', N=16)
+        self.assertTrue(pylibscrypt.scrypt_mcf_check(mcf, b'pw'))
+        self.assertTrue(c.scrypt_mcf_check(mcf, b'pw'))
+        self.assertFalse(c.scrypt_mcf_check(mcf, b'px'))
+        mcf = c.scrypt_mcf(b'pw', N=1024, prefix=None)
+        self.assertEqual(mcf[:3], b'$7$')
+        self.assertTrue(c.scrypt_mcf_check(mcf, u'pw'))
+        self.assertRaises(ValueError, c.scrypt, b'pw', b'salt', 3)
+        self.assertRaises(ValueError, c.scrypt_mcf_check, b'$s1$', b'pw')
+        self.assertRaises(TypeError, c.scrypt, u'pw', b'salt', 16)
+        self.assertRaises(TimeoutError, c.scrypt, b'pw', b'salt', 16,
+                          deadline=0)
+        stats = c.stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['served'], 9)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        self.assertRaises(ValueError, self.server.Server, path)
+
+    def test_admitted(self):
+        import threading
+        import pylibscrypt
+        from . import admission
+        from .common import scrypt_memory
+        mcf = pylibscrypt.scrypt_mcf(b'pw', N=16, r=2, p=3)
+        self.assertEqual(self.server._memory('scrypt_mcf_check', (mcf, b'pw')),
+                         scrypt_memory(16, 2, 3))
+        self.assertEqual(self.server._memory('scrypt', (b'pw', b's', 16, 4, 1,
+                                                        64)),
+                         scrypt_memory(16, 4, 1))
+        self.assertEqual(self.server._memory('scrypt_mcf_check',
+                                             (b'$s1$', b'pw')), 0)
+        # Calls the server has reserved memory for don't wait for it again
+        admission.set_memory_budget(1)
+        self.addCleanup(admission.set_memory_budget)
+        with admission.reserve(100):
+            admitted = []
+            def call():
+                admitted.append(self.server._call(
+                    'scrypt_mcf_check', (mcf, b'pw'), 5, True))
+            t = threading.Thread(target=call)
+            t.start()
+            t.join()
+        self.assertEqual(admitted, [True])
+        self.assertEqual(getattr(admission._local, 'depth', 0), 0)
+
+    def test_tcp(self):
+        import os
+        import pylibscrypt
+        s = self.start(('127.0.0.1', 0), workers=1)
+        old = os.environ.get('PYLIBSCRYPT_SERVER')
+        os.environ['PYLIBSCRYPT_SERVER'] = '127.0.0.1:%d' % s.address[1]
+        try:
+            mcf = self.client.scrypt_mcf(b'pw', N=16)
+            self.assertTrue(self.client.scrypt_mcf_check(mcf, b'pw'))
+            self.assertEqual(self.client.scrypt(b'pw', b'salt', 16),
+                             pylibscrypt.scrypt(b'pw', b'salt', 16))
+        finally:
+            self.client.get_client().close()
+            if old is None:
+                del os.environ['PYLIBSCRYPT_SERVER']
+            else:
+                os.environ['PYLIBSCRYPT_SERVER'] = old
+        self.assertRaises(ValueError, self.server.Server, ('192.0.2.1', 0))
+
+    def test_fairness(self):
+        scheduler = self.server._Scheduler(4, 2)
+        self.assertTrue(scheduler.put('a', 1))
+        self.assertTrue(scheduler.put('a', 2))
+        self.assertFalse(scheduler.put('a', 3))
+        self.assertTrue(scheduler.put('b', 4))
+        self.assertTrue(scheduler.put('c', 5))
+        self.assertFalse(scheduler.put('d', 6))
+        self.assertEqual(scheduler.clients(), 3)
+        self.assertEqual([scheduler.get() for i in range(4)], [1, 4, 5, 2])
+        self.assertEqual(len(scheduler), 0)
+        scheduler.close()
+        self.assertEqual(scheduler.get(), None)
+
+    def test_busy(self):
+        import os, socket
+        s = self.server.Server(os.path.join(self.tmp, 'busy.sock'),
+                               workers=1, max_queue=1)
+        a, b = socket.socketpair()
+        conn = self.server._Connection(a, 'client')
+        try:
+            request = {'id': 1, 'op': 'scrypt', 'password': '', 'salt': '',
+                       'N': 16, 'r': 1, 'p': 1, 'olen': 64}
+            s._accept(conn, request)
+            s._accept(conn, dict(request, id=2))
+            response = self.client.recv_message(b)
+            self.assertEqual(response['id'], 2)
+            self.assertEqual(response['error'], 'ServerBusy')
+            self.assertEqual(s.stats()['refused'], 1)
+        finally:
+            s._close()
+            a.close()
+            b.close()
+
+
 def load_scrypt_suite(name, module, fast=True):
     tests = type(name, (ScryptTests,), {'module': module, 'fast': fast})
     return unittest.defaultTestLoader.loadTestsFromTestCase(tests)
@@ -434,9 +1884,81 @@ if __name__ == "__main__":
     except ImportError:
         suite.addTest(load_scrypt_suite('pylibsodiumTests', None, True))
 
+    import pylibscrypt
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        type('packageManyTests', (ScryptManyTests,), {'module': pylibscrypt})
+    ))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ScryptBatchTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ScryptAioTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(AdmissionTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(AutoselectTests))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+        BackendResolutionTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TuningTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ScryptHashTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(CheckCacheTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(AuditTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(RehashTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ResumableTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(DeadlineTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(HooksTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(MetricsTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(RouterTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(RegistryTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ScryptIntoTests))
+    suite.addTest(
+        unittest.defaultTestLoader.loadTestsFromTestCase(ServerTests))
+    from . import router
+    suite.addTest(load_scrypt_suite('routerTests', router, True))
+
+    try:
+        from . import numpyscrypt
+        suite.addTest(load_scrypt_suite('numpyscryptTests', numpyscrypt, True))
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+            type('numpyscryptManyTests', (ScryptManyTests,),
+                 {'module': numpyscrypt})
+        ))
+        def set_up_lanes(self):
+            self.tmp_lanes = self.module._MIN_LANES
+            self.module._MIN_LANES = 1
+        def tear_down_lanes(self):
+            self.module._MIN_LANES = self.tmp_lanes
+        tmp = type(
+            'numpyscryptLanesTests', (ScryptTests,),
+            {
+                'module': numpyscrypt,
+                'fast': True,
+                'set_up_lambda': set_up_lanes,
+                'tear_down_lambda': tear_down_lanes,
+            }
+        )
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(tmp))
+    except ImportError:
+        suite.addTest(load_scrypt_suite('numpyscryptTests', None, True))
+
     try:
         from . import pypyscrypt_inline as pypyscrypt
         suite.addTest(load_scrypt_suite('pypyscryptTests', pypyscrypt, True))
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(
+            type('pypyscryptWorkersTests', (ScryptWorkersTests,),
+                 {'module': pypyscrypt})
+        ))
     except ImportError:
         suite.addTest(load_scrypt_suite('pypyscryptTests', None, True))
 
@@ -0,0 +1,154 @@
+# Copyright (c) 2026, Jan Varho
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Picks scrypt parameters for a target time and memory use on this host
+
+As in the scrypt utility, N is made as large as both limits allow. If memory
+runs out first, p is increased to use the rest of the time.
+
+Results are cached along with the rankings of pylibscrypt.autoselect.
+"""
+
+
+import time
+
+from .autoselect import host_key, load_cache, save_cache
+from .bench import measure
+from .common import SCRYPT_r, scrypt_memory
+
+
+# N of the first measurement, from which the rest is predicted
+_PROBE_N = 2**10
+
+# Calls per probe measurement, the best of which is kept
+_REPEAT = 3
+
+# Largest N and p that still fit the $s1$ MCF format
+_MAX_N = 2**31
+_MAX_p = 255
+
+
+def _largest_N(r, p, max_memory):
+    N = 1
+    while N < _MAX_N and scrypt_memory(N * 2, r, p) <= max_memory:
+        N *= 2
+    return N
+
+
+def _search(scrypt, target, max_memory, r):
+    timings = []
+    def timed(N, p, repeat=1):
+        t = measure(scrypt, N, r, p, repeat=repeat)[0]
+        timings.append({'N': N, 'r': r, 'p': p, 'time': t})
+        return t
+
+    max_N = _largest_N(r, 1, max_memory)
+    if max_N < 2:
+        raise ValueError('max_memory_bytes is too small for r=%d' % r)
+
+    # Time is linear in N, so predict the answer from a small measurement
+    N = min(_PROBE_N, max_N)
+    t = timed(N, 1, _REPEAT)
+    while N < max_N and t * 2 <= target:
+        N *= 2
+        t *= 2
+    t = timed(N, 1)
+
+    # Correct the prediction
+    while t > target and N > 2:
+        N //= 2
+        t = timed(N, 1)
+    while N < max_N and t * 2 <= target:
+        t2 = timed(N * 2, 1)
+        if t2 > target:
+            break
+        N, t = N * 2, t2
+
+    # Memory bound, use the remaining time for p
+    p = 1
+    if N == max_N and t * 2 <= target:
+        p = min(_MAX_p, int(target / t))
+        while p > 1 and scrypt_memory(N, r, p) > max_memory:
+            p -= 1
+        while p > 1:
+            tp = timed(N, p)
+            if tp <= target:
+                t = tp
+                break
+            p = max(1, min(p - 1, int(p * target / tp)))
+
+    return N, p, t, timings
+
+
+def calibrate(target_seconds, max_memory_bytes, backend=None, r=SCRYPT_r,
+              refresh=False):
+    """Returns scrypt parameters that fit the given time and memory
+
+    target_seconds    -- time one call may take on this host
+    max_memory_bytes  -- memory one call may use
+    backend           -- name of the implementation to measure in
+                         pylibscrypt.registry, e.g. 'pylibsodium', by
+                         default that of the package
+
+    The result is a dict with keys N, r, p, time, memory, backend and
+    timings, a list of all measurements made. It is cached per host, so
+    pass refresh=True to measure again, e.g. after a hardware change.
+
+    Raises ValueError if even N=2 does not fit in memory. If no parameters
+    fit in time, the result has N=2 and a time over the target.
+    """
+    if not target_seconds > 0:
+        raise ValueError('target_seconds must be positive')
+    if not max_memory_bytes > 0:
+        raise ValueError('max_memory_bytes must be positive')
+
+    if backend is None:
+        from . import backend_info, scrypt
+        backend = backend_info()['backend']
+    else:
+        from . import registry
+        if backend not in registry.names():
+            raise ImportError('Unknown scrypt implementation: ' + backend)
+        module = registry.load(backend)
+        if module is None:
+            raise ImportError(registry.error(backend))
+        scrypt = module.scrypt
+
+    key = 'params %r,%d,%d,%s' % (float(target_seconds),
+                                  int(max_memory_bytes), r, backend)
+    if not refresh:
+        cached = load_cache().get(host_key(), {}).get(key)
+        if cached is not None:
+            return cached['params']
+
+    N, p, t, timings = _search(scrypt, target_seconds, max_memory_bytes, r)
+    result = {
+        'N': N,
+        'r': r,
+        'p': p,
+        'time': t,
+        'memory': scrypt_memory(N, r, p),
+        'backend': backend,
+        'timings': timings,
+    }
+    cache = load_cache()
+    cache.setdefault(host_key(), {})[key] = {
+        'params': result,
+        'time': time.time(),
+    }
+    save_cache(cache)
+    return result
+
+
+__all__ = ['calibrate']
@@ -36,6 +36,7 @@ def unimport(mod=None):
         sys.modules.pop(mod, None)
 
 import pylibscrypt
+pylibscrypt.backend_info()
 sys.modules['pylibscrypt.hashlibscrypt'] = None
 
 if '-e' in sys.argv:
@@ -46,33 +47,46 @@ if '-e' in sys.argv:
     ctypes.util.find_library = lambda *args, **kw: None
     ctypes.cdll.LoadLibrary = lambda *args, **kw: None
     import pylibscrypt
+    pylibscrypt.backend_info()
     ctypes.util.find_library = tmp1
     ctypes.cdll.LoadLibrary = tmp2
     unimport('pylibscrypt.pylibscrypt')
     ctypes.CDLL = lambda *args, **kw: None
     import pylibscrypt
+    pylibscrypt.backend_info()
     unimport('pylibscrypt.pylibscrypt')
     ctypes.CDLL = raises(OSError)
     import pylibscrypt
+    pylibscrypt.backend_info()
     ctypes.CDLL = tmp3
 
     unimport('pylibscrypt.pylibscrypt')
     ctypes.CDLL = lambda *args, **kw: None
     import pylibscrypt
+    pylibscrypt.backend_info()
 
 unimport()
 sys.modules['pylibscrypt.pylibscrypt'] = None
 import pylibscrypt
+pylibscrypt.backend_info()
 
 unimport('pylibscrypt.pyscrypt')
 sys.modules['scrypt'] = None
 import pylibscrypt
+pylibscrypt.backend_info()
 
 unimport()
 sys.modules['pylibscrypt.pyscrypt'] = None
 import pylibscrypt
+pylibscrypt.backend_info()
 
 unimport()
 sys.modules['pylibscrypt.pylibsodium'] = None
 import pylibscrypt
+pylibscrypt.backend_info()
 
+
+unimport()
+sys.modules['pylibscrypt.numpyscrypt'] = None
+import pylibscrypt
+pylibscrypt.backend_info()